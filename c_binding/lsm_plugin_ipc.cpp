@@ -37,6 +37,13 @@
 #include <libxml/uri.h>
 #include "util/qparams.h"
 #include <syslog.h>
+#include <sys/select.h>
+#include <sys/socket.h>
+#include <unistd.h>
+
+/* Single byte state changes a pooled worker reports to lsmd */
+#define LSM_WORKER_BUSY 'B'
+#define LSM_WORKER_IDLE 'I'
 
 //Forward decl.
 static int lsm_plugin_run(lsm_plugin_ptr plug);
@@ -197,7 +204,7 @@ static lsm_plugin_ptr lsm_plugin_alloc(lsm_plugin_register reg,
     return rc;
 }
 
-static void error_send(lsm_plugin_ptr p, int error_code)
+static void error_send(lsm_plugin_ptr p, int error_code, uint32_t id)
 {
     if( !LSM_IS_PLUGIN(p) ) {
         return;
@@ -206,12 +213,12 @@ static void error_send(lsm_plugin_ptr p, int error_code)
     if( p->error ) {
         if( p->tp ) {
             p->tp->errorSend(p->error->code, ss(p->error->message),
-                                ss(p->error->debug));
+                                ss(p->error->debug), id);
             lsm_error_free(p->error);
             p->error = NULL;
         }
     } else {
-        p->tp->errorSend(error_code, "UNA", "UNA");
+        p->tp->errorSend(error_code, "UNA", "UNA", id);
     }
 }
 
@@ -260,6 +267,93 @@ static bool get_num( char *sn, int &num)
     return false;
 }
 
+/**
+ * Tells lsmd a pooled worker changed state.
+ * @param ctrl_fd   Control socket shared with lsmd
+ * @param state     LSM_WORKER_BUSY or LSM_WORKER_IDLE
+ * @return true on success, false when lsmd is gone.
+ */
+static bool worker_state(int ctrl_fd, char state)
+{
+    ssize_t rc = 0;
+
+    do {
+        rc = send(ctrl_fd, &state, 1, MSG_NOSIGNAL);
+    } while( -1 == rc && EINTR == errno );
+    return 1 == rc;
+}
+
+/**
+ * Runs the plug-in as a pooled worker of lsmd.  Clients are accepted from
+ * the plug-in listening socket and served one after another, each by a new
+ * plug-in instance, until lsmd closes the control socket.
+ * @param listen_fd     Plug-in listening socket (non-blocking)
+ * @param ctrl_fd       Control socket shared with lsmd
+ * @return exit code for plug-in
+ */
+static int lsm_plugin_work(int listen_fd, int ctrl_fd,
+                            lsm_plugin_register reg,
+                            lsm_plugin_unregister unreg,
+                            const char *desc, const char *version)
+{
+    int rc = 0;
+
+    while( true ) {
+        fd_set readfds;
+        FD_ZERO(&readfds);
+        FD_SET(listen_fd, &readfds);
+        FD_SET(ctrl_fd, &readfds);
+
+        if( -1 == select(((listen_fd > ctrl_fd) ? listen_fd : ctrl_fd) + 1,
+                        &readfds, NULL, NULL, NULL) ) {
+            if( EINTR == errno ) {
+                continue;
+            }
+            rc = 1;
+            break;
+        }
+
+        /* lsmd only ever closes its end, we are no longer needed */
+        if( FD_ISSET(ctrl_fd, &readfds) ) {
+            break;
+        }
+
+        int cfd = accept(listen_fd, NULL, NULL);
+        if( -1 == cfd ) {
+            /* Another worker or lsmd got to the client first */
+            continue;
+        }
+
+        if( !worker_state(ctrl_fd, LSM_WORKER_BUSY) ) {
+            close(cfd);
+            break;
+        }
+
+        lsm_plugin_ptr plug = lsm_plugin_alloc(reg, unreg, desc, version);
+        if( plug ) {
+            plug->tp = new Ipc(cfd);
+            if (plug->tp) {
+                lsm_plugin_run(plug);
+            } else {
+                lsm_plugin_free(plug, LSM_CLIENT_FLAG_RSVD);
+                close(cfd);
+                rc = LSM_ERR_NO_MEMORY;
+                break;
+            }
+        } else {
+            close(cfd);
+            rc = LSM_ERR_NO_MEMORY;
+            break;
+        }
+
+        if( !worker_state(ctrl_fd, LSM_WORKER_IDLE) ) {
+            break;
+        }
+    }
+
+    return rc;
+}
+
 int lsm_plugin_init_v1( int argc, char *argv[], lsm_plugin_register reg,
                     lsm_plugin_unregister unreg,
                     const char *desc, const char *version)
@@ -272,7 +366,10 @@ int lsm_plugin_init_v1( int argc, char *argv[], lsm_plugin_register reg,
     }
 
     int sd = 0;
-    if( argc == 2 && get_num(argv[1], sd) ) {
+    int ctrl = 0;
+    if( argc == 3 && get_num(argv[1], sd) && get_num(argv[2], ctrl) ) {
+        rc = lsm_plugin_work(sd, ctrl, reg, unreg, desc, version);
+    } else if( argc == 2 && get_num(argv[1], sd) ) {
         plug = lsm_plugin_alloc(reg, unreg, desc, version);
         if( plug ) {
             plug->tp = new Ipc(sd);
@@ -2251,12 +2348,14 @@ static int lsm_plugin_run(lsm_plugin_ptr p)
 
                 if( req.isValidRequest() ) {
                     std::string method = req["method"].asString();
+                    /* Echo the request id so clients can pipeline requests */
+                    uint32_t id = req["id"].asUint32_t();
                     rc = process_request(p, method, req, resp);
 
                     if( LSM_ERR_OK == rc || LSM_ERR_JOB_STARTED == rc ) {
-                        p->tp->responseSend(resp);
+                        p->tp->responseSend(resp, id);
                     } else {
-                        error_send(p, rc);
+                        error_send(p, rc, id);
                     }
 
                     if( method == "plugin_unregister" ) {
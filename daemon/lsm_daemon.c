@@ -39,6 +39,8 @@
 #include <sys/queue.h>
 #include <sys/wait.h>
 #include <sys/time.h>
+#include <fcntl.h>
+#include <time.h>
 #include <libgen.h>
 #include <assert.h>
 #include <grp.h>
@@ -54,6 +56,16 @@
 #define LSMD_CONF_FILE "lsmd.conf"
 #define LSM_CONF_ALLOW_ROOT_OPT_NAME "allow-plugin-root-privilege"
 #define LSM_CONF_REQUIRE_ROOT_OPT_NAME "require-root-privilege"
+#define LSM_CONF_WORKER_POOL_OPT_NAME "plugin-worker-pool"
+#define LSM_CONF_WORKER_MAX_OPT_NAME "plugin-worker-max"
+#define LSM_CONF_WORKER_IDLE_OPT_NAME "plugin-worker-idle-timeout"
+
+/* Single byte state changes a pooled worker reports on its control socket */
+#define LSM_WORKER_BUSY 'B'
+#define LSM_WORKER_IDLE 'I'
+
+/* Workers which die sooner than this without serving a client are broken */
+#define LSM_WORKER_MIN_LIFE 2
 
 #define min(a,b) \
    ({ __typeof__ (a) _a = (a); \
@@ -84,6 +96,26 @@ int plugin_mem_debug = 0;
 int allow_root_plugin = 0;
 int has_root_plugin = 0;
 
+int worker_pool = 0;
+int worker_max = 4;
+int worker_idle_timeout = 300;
+
+/**
+ * A pre-forked plug-in process, which accepts clients on the plug-in
+ * listening socket itself and tells us when it is busy or idle.
+ */
+struct worker {
+    pid_t pid;
+    int fd;                 /* Our end of the control socket pair */
+    int busy;
+    int served;
+    time_t spawned;
+    time_t idle_since;
+    LIST_ENTRY(worker) pointers;
+};
+
+LIST_HEAD(worker_list, worker);
+
 /**
  * Each item in plugin list contains this information
  */
@@ -91,6 +123,9 @@ struct plugin {
     char *file_path;
     int require_root;
     int fd;
+    int pooled;
+    int worker_count;
+    struct worker_list workers;
     LIST_ENTRY(plugin) pointers;
 };
 
@@ -400,6 +435,28 @@ int setup_socket(char *full_name)
     return fd;
 }
 
+/**
+ * Closes the control socket of a pooled worker and forgets about it, the
+ * worker exits once it sees the socket closed (after finishing any client
+ * it is serving).
+ * @param plug      Plug-in the worker belongs to
+ * @param w         Worker to release
+ */
+void worker_free(struct plugin *plug, struct worker *w)
+{
+    int err;
+
+    LIST_REMOVE(w, pointers);
+    plug->worker_count--;
+
+    if( -1 == close(w->fd) ) {
+        err = errno;
+        info("Error on closing worker fd %d for file %s: %s\n", w->fd,
+                plug->file_path, strerror(err));
+    }
+    free(w);
+}
+
 /**
  * Closes all the listening sockets and re-claims memory in linked list.
  * @param list
@@ -414,6 +471,10 @@ void empty_plugin_list(struct plugin_list *list)
         item = LIST_FIRST(list);
         LIST_REMOVE(item, pointers);
 
+        while(!LIST_EMPTY(&item->workers)) {
+            worker_free(item, LIST_FIRST(&item->workers));
+        }
+
         if( -1 == close(item->fd) ) {
             err = errno;
             info("Error on closing fd %d for file %s: %s\n", item->fd,
@@ -463,6 +524,39 @@ void parse_conf_bool(char * conf_path, char *key_name, int *value)
     free(cfg);
 }
 
+/**
+ * Parse config and seeking provided key name integer, same rules as
+ * parse_conf_bool().
+ * @param conf_path     config file path
+ * @param key_name      string, searching key
+ * @param value         int, output, value of this config key
+ */
+
+void parse_conf_int(char * conf_path, char *key_name, int *value)
+{
+    if( access(conf_path, F_OK) == -1 ) {
+        /* file not exist. */
+        return;
+    }
+    config_t *cfg = (config_t *)malloc(sizeof(config_t));
+    if (cfg){
+        config_init(cfg);
+        if (CONFIG_TRUE == config_read_file(cfg, conf_path)){
+            config_lookup_int(cfg, key_name, value);
+        }else{
+            log_and_exit(
+                "configure %s parsing failed: %s at line %d\n",
+                conf_path, config_error_text(cfg), config_error_line(cfg));
+        }
+    } else{
+        log_and_exit(
+            "malloc failure while trying to allocate memory for config_t\n");
+    }
+
+    config_destroy(cfg);
+    free(cfg);
+}
+
 /**
  * Load plugin config for root privilege setting.
  * If config not found, return 0 for no root privilege required.
@@ -536,6 +630,21 @@ int process_plugin(void *p, char *full_name)
                     item->fd = setup_socket(full_name);
                     item->require_root = chk_pconf_root_pri(full_name);
                     has_root_plugin |= item->require_root;
+                    LIST_INIT(&item->workers);
+
+                    /* Pooled workers are forked before we know who the
+                     * client is, so they can never run as root. */
+                    if( worker_pool && !item->require_root &&
+                        !plugin_mem_debug ) {
+                        item->pooled = 1;
+
+                        /* Workers and lsmd race to accept each client */
+                        if( -1 == fcntl(item->fd, F_SETFL,
+                                fcntl(item->fd, F_GETFL) | O_NONBLOCK) ) {
+                            log_and_exit("Error on fcntl for %s: %s\n",
+                                    full_name, strerror(errno));
+                        }
+                    }
 
                     if( item->file_path && item->fd >= 0 ) {
                         LIST_INSERT_HEAD((struct plugin_list*)p, item, pointers);
@@ -736,12 +845,168 @@ void exec_plugin( char *plugin, int client_fd, int require_root)
     }
 }
 
+/**
+ * Forks a pooled worker for a plug-in.  The worker gets its own copy of the
+ * plug-in listening socket and one end of a control socket pair as
+ * arguments ("<plugin> <listen fd> <control fd>"), it accepts clients
+ * itself and serves them one after another, writing LSM_WORKER_BUSY and
+ * LSM_WORKER_IDLE to the control socket as it does.  It exits once we close
+ * our end of the control socket.
+ * @param plug      Plug-in to add a worker to
+ */
+void worker_spawn(struct plugin *plug)
+{
+    int err = 0;
+    int sv[2];
+
+    if( -1 == socketpair(AF_UNIX, SOCK_STREAM, 0, sv) ) {
+        err = errno;
+        warn("Error on creating worker socket pair for %s: %s\n",
+                plug->file_path, strerror(err));
+        return;
+    }
+
+    info("Starting worker for plug-in = %s\n", plug->file_path);
+
+    pid_t process = fork();
+    if( -1 == process ) {
+        err = errno;
+        warn("Error on forking worker for %s: %s\n", plug->file_path,
+                strerror(err));
+        close(sv[0]);
+        close(sv[1]);
+    } else if( process ) {
+        /* Parent */
+        struct worker *w = calloc(1, sizeof(struct worker));
+        if( !w ) {
+            log_and_exit("Memory allocation failure!\n");
+        }
+
+        close(sv[1]);
+        w->pid = process;
+        w->fd = sv[0];
+        w->spawned = w->idle_since = time(NULL);
+        LIST_INSERT_HEAD(&plug->workers, w, pointers);
+        plug->worker_count++;
+    } else {
+        /* Child */
+        char listen_str[12];
+        char ctrl_str[12];
+        char *plugin_argv[4];
+        extern char **environ;
+
+        drop_privileges();
+
+        /* Keep our listening socket, empty_plugin_list closes the rest along
+         * with the control sockets of the other workers. */
+        int listen_fd = dup(plug->fd);
+        char *p_copy = strdup(plug->file_path);
+
+        close(sv[0]);
+        empty_plugin_list(&head);
+
+        sprintf(listen_str, "%d", listen_fd);
+        sprintf(ctrl_str, "%d", sv[1]);
+
+        plugin_argv[0] = basename(p_copy);
+        plugin_argv[1] = listen_str;
+        plugin_argv[2] = ctrl_str;
+        plugin_argv[3] = NULL;
+
+        if( -1 == execve(p_copy, plugin_argv, environ) ) {
+            err = errno;
+            log_and_exit("Error on exec'ing Plugin %s: %s\n",
+                    p_copy, strerror(err));
+        }
+    }
+}
+
+/**
+ * Reads the state changes a worker reported on its control socket.
+ * @param plug      Plug-in the worker belongs to
+ * @param w         Worker with a readable control socket
+ */
+void worker_event(struct plugin *plug, struct worker *w)
+{
+    char buf[16];
+    ssize_t i;
+    ssize_t got = read(w->fd, buf, sizeof(buf));
+
+    if( got <= 0 ) {
+        if( got < 0 && EINTR == errno ) {
+            return;
+        }
+
+        /* A worker which never manages to serve a client is not going to
+         * start working by us forking it again and again. */
+        if( !w->served && time(NULL) - w->spawned < LSM_WORKER_MIN_LIFE ) {
+            warn("Worker for plug-in %s exited on start up, pooling "
+                 "disabled for it\n", plug->file_path);
+            plug->pooled = 0;
+        }
+        worker_free(plug, w);
+        return;
+    }
+
+    for( i = 0; i < got; i++ ) {
+        if( LSM_WORKER_BUSY == buf[i] ) {
+            w->busy = 1;
+            w->served = 1;
+        } else if( LSM_WORKER_IDLE == buf[i] ) {
+            w->busy = 0;
+            w->idle_since = time(NULL);
+        }
+    }
+}
+
+/**
+ * Keeps one idle worker ready for the next client as long as we are below
+ * plugin-worker-max and retires workers which have been idle for longer than
+ * plugin-worker-idle-timeout, as long as another one is left idle.
+ * @param plug      Plug-in to maintain the pool of
+ */
+void worker_maintain(struct plugin *plug)
+{
+    struct worker *w = NULL;
+    struct worker *next = NULL;
+    time_t now = time(NULL);
+    int idle = 0;
+
+    if( !plug->pooled ) {
+        while(!LIST_EMPTY(&plug->workers)) {
+            worker_free(plug, LIST_FIRST(&plug->workers));
+        }
+        return;
+    }
+
+    LIST_FOREACH(w, &plug->workers, pointers) {
+        idle += !w->busy;
+    }
+
+    for( w = LIST_FIRST(&plug->workers); w && idle > 1; w = next ) {
+        next = LIST_NEXT(w, pointers);
+        if( !w->busy && worker_idle_timeout > 0 &&
+            now - w->idle_since >= worker_idle_timeout ) {
+            info("Retiring idle worker %d for plug-in %s\n", w->pid,
+                    plug->file_path);
+            worker_free(plug, w);
+            idle--;
+        }
+    }
+
+    if( !idle && plug->worker_count < worker_max ) {
+        worker_spawn(plug);
+    }
+}
+
 /**
  * Main event loop
  */
 void _serving(void)
 {
     struct plugin *plug = NULL;
+    struct worker *w = NULL;
+    struct worker *next = NULL;
     struct timeval tmo;
     fd_set readfds;
     int nfds = 0;
@@ -754,11 +1019,32 @@ void _serving(void)
         nfds = 0;
 
         tmo.tv_sec = 15;
+        if( worker_pool && worker_idle_timeout > 0 ) {
+            tmo.tv_sec = min(tmo.tv_sec, worker_idle_timeout);
+        }
         tmo.tv_usec = 0;
 
         LIST_FOREACH(plug, &head, pointers) {
-            nfds = max(plug->fd, nfds);
-            FD_SET(plug->fd, &readfds);
+            worker_maintain(plug);
+
+            /* Pooled plug-ins accept their own clients, we only step in
+             * with a fork and exec when every worker is busy. */
+            if( !plug->pooled || plug->worker_count >= worker_max ) {
+                int idle = 0;
+                LIST_FOREACH(w, &plug->workers, pointers) {
+                    idle += !w->busy;
+                }
+
+                if( !idle ) {
+                    nfds = max(plug->fd, nfds);
+                    FD_SET(plug->fd, &readfds);
+                }
+            }
+
+            LIST_FOREACH(w, &plug->workers, pointers) {
+                nfds = max(w->fd, nfds);
+                FD_SET(w->fd, &readfds);
+            }
         }
 
         if( !nfds ) {
@@ -776,16 +1062,29 @@ void _serving(void)
                 log_and_exit("Error on selecting Plugin: %s", strerror(err));
             }
         } else if( ready > 0 ) {
+            LIST_FOREACH(plug, &head, pointers) {
+                for( w = LIST_FIRST(&plug->workers); w; w = next ) {
+                    next = LIST_NEXT(w, pointers);
+                    if( FD_ISSET(w->fd, &readfds) ) {
+                        worker_event(plug, w);
+                    }
+                }
+            }
+
             int fd = 0;
             for( fd = 0; fd < nfds; fd++ ) {
-                if( FD_ISSET(fd, &readfds) ) {
+                struct plugin *p = plugin_lookup(fd);
+                if( p && FD_ISSET(fd, &readfds) ) {
                     int cfd = accept(fd, NULL, NULL);
                     if( -1 != cfd ) {
-                        struct plugin *p = plugin_lookup(fd);
                         exec_plugin(p->file_path, cfd, p->require_root);
                     } else {
                         err = errno;
-                        info("Error on accepting request: %s", strerror(err));
+                        /* A pooled worker may have taken the client */
+                        if( EAGAIN != err && EWOULDBLOCK != err ) {
+                            info("Error on accepting request: %s",
+                                    strerror(err));
+                        }
                     }
                 }
             }
@@ -888,8 +1187,18 @@ int main(int argc, char *argv[])
     char *lsmd_conf_path = path_form(conf_dir, LSMD_CONF_FILE);
     parse_conf_bool(
         lsmd_conf_path, LSM_CONF_ALLOW_ROOT_OPT_NAME, &allow_root_plugin);
+    parse_conf_bool(
+        lsmd_conf_path, LSM_CONF_WORKER_POOL_OPT_NAME, &worker_pool);
+    parse_conf_int(
+        lsmd_conf_path, LSM_CONF_WORKER_MAX_OPT_NAME, &worker_max);
+    parse_conf_int(
+        lsmd_conf_path, LSM_CONF_WORKER_IDLE_OPT_NAME, &worker_idle_timeout);
     free(lsmd_conf_path);
 
+    if( worker_max < 1 ) {
+        worker_max = 1;
+    }
+
     /* Check to see if we want to check plugin for memory errors */
     if( getenv("LSM_VALGRIND") ) {
         plugin_mem_debug = 1;
@@ -955,8 +955,9 @@ def _rpercent(total, current):
         p = min(int(100 * p), 100)
         return p
 
-    def _restore_file_status(self, num):
-        running = self.f.snapshot_file_restore_num()
+    def _restore_file_status(self, num, running=None):
+        if running is None:
+            running = self.f.snapshot_file_restore_num()
 
         if running:
             running = min(num, running)
@@ -964,13 +965,14 @@ def _restore_file_status(self, num):
 
         return JobStatus.COMPLETE, 100, None
 
-    def _clone_split_status(self, volumes):
+    def _clone_split_status(self, volumes, running=None):
         vols = volumes.split(',')
         current = len(vols)
 
         #It doesn't appear that we have a good percentage
         #indicator from the clone split status...
-        running = self.f.volume_split_status()
+        if running is None:
+            running = self.f.volume_split_status()
 
         for v in vols:
             if v not in running:
@@ -982,20 +984,45 @@ def _clone_split_status(self, volumes):
             return JobStatus.INPROGRESS, \
                 Ontap._rpercent(len(vols), current), None
 
-    @handle_ontap_errors
-    def job_status(self, job_id, flags=0):
-        if job_id is None and '@' not in job_id:
+    @staticmethod
+    def _parse_job_id(job_id):
+        if job_id is None or '@' not in job_id:
             raise LsmError(ErrorNumber.INVALID_ARGUMENT,
                            "Invalid job, missing @")
 
         job = job_id.split('@', 2)
 
+        if job[0] not in (Ontap.SS_JOB, Ontap.SPLIT_JOB):
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT, "Invalid job")
+        return job
+
+    @handle_ontap_errors
+    def job_status(self, job_id, flags=0):
+        job = Ontap._parse_job_id(job_id)
+
         if job[0] == Ontap.SS_JOB:
             return self._restore_file_status(int(job[1]))
-        elif job[0] == Ontap.SPLIT_JOB:
-            return self._clone_split_status(job[1])
+        return self._clone_split_status(job[1])
 
-        raise LsmError(ErrorNumber.INVALID_ARGUMENT, "Invalid job")
+    @handle_ontap_errors
+    def jobs_status(self, job_ids, flags=0):
+        jobs = [Ontap._parse_job_id(job_id) for job_id in job_ids]
+
+        #Ask the filer once for each kind of job rather than once per job
+        restores = None
+        splits = None
+        if any(job[0] == Ontap.SS_JOB for job in jobs):
+            restores = self.f.snapshot_file_restore_num()
+        if any(job[0] == Ontap.SPLIT_JOB for job in jobs):
+            splits = self.f.volume_split_status()
+
+        rc = []
+        for job in jobs:
+            if job[0] == Ontap.SS_JOB:
+                rc.append(self._restore_file_status(int(job[1]), restores))
+            else:
+                rc.append(self._clone_split_status(job[1], splits))
+        return rc
 
     @handle_ontap_errors
     def job_free(self, job_id, flags=0):
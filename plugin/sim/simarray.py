@@ -16,6 +16,7 @@
 # Author: tasleson
 #         Gris Ge <fge@redhat.com>
 
+import json
 import random
 import tempfile
 import os
@@ -171,7 +172,7 @@ def data_disk_count(raid_type, disk_count):
 
 
 class BackStore(object):
-    VERSION = "3.1"
+    VERSION = "3.5"
     VERSION_SIGNATURE = 'LSM_SIMULATOR_DATA_%s_%s' % (VERSION, md5(VERSION))
     JOB_DEFAULT_DURATION = 1
     JOB_DATA_TYPE_VOL = 1
@@ -185,6 +186,14 @@ class BackStore(object):
 
     _LIST_SPLITTER = '#'
 
+    # Prepared statements kept by the sqlite3 connection, large enough to
+    # hold every statement the BackStore issues.
+    _SQL_CACHE_SIZE = 256
+
+    JOURNAL_MODE = 'WAL'
+
+    MEMORY = ':memory:'
+
     SYS_KEY_LIST = ['id', 'name', 'status', 'status_info', 'version']
 
     POOL_KEY_LIST = [
@@ -206,7 +215,16 @@ class BackStore(object):
 
     AG_KEY_LIST = ['id', 'name', 'init_type', 'init_ids_str']
 
-    JOB_KEY_LIST = ['id', 'duration', 'timestamp', 'data_type', 'data_id']
+    # Generations counted in table_gens and the tables changing them, the
+    # pools listing has the space ledger in it.
+    GEN_TABLES = {
+        'volumes': ['volumes'],
+        'pools': ['pools', 'pool_space'],
+        'disks': ['disks'],
+    }
+
+    JOB_KEY_LIST = ['id', 'duration', 'timestamp', 'data_type', 'data_id',
+                    'pool_id']
 
     FS_KEY_LIST = [
         'id', 'name', 'total_space', 'free_space', 'consumed_size',
@@ -220,8 +238,24 @@ class BackStore(object):
         'options', 'exp_root_hosts_str', 'exp_rw_hosts_str',
         'exp_ro_hosts_str']
 
-    def __init__(self, statefile, timeout):
-        if not os.path.exists(statefile):
+    def __init__(self, statefile, timeout, in_memory=False,
+                 snapshot_interval=0):
+        """
+        With in_memory, or the statefile MEMORY, the state is kept in an
+        in-memory database.  It is loaded from the statefile if that exists
+        and written back to it by snapshot_save(), which is also done by
+        trans_commit() when the last snapshot is more than snapshot_interval
+        seconds old.
+        """
+        self.snapshot_file = None
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_time = time.time()
+        self.timeout = timeout
+        if statefile == BackStore.MEMORY:
+            in_memory = True
+        elif in_memory:
+            self.snapshot_file = statefile
+        elif not os.path.exists(statefile):
             os.close(os.open(statefile, os.O_WRONLY | os.O_CREAT))
             # Due to umask, os.open() created file migt not be 666 permission.
             os.chmod(statefile, 0o666)
@@ -229,11 +263,22 @@ def __init__(self, statefile, timeout):
         self.statefile = statefile
         self.lastrowid = None
         self.sql_conn = sqlite3.connect(
-            statefile, timeout=int(timeout/1000), isolation_level="IMMEDIATE")
+            BackStore.MEMORY if in_memory else statefile,
+            timeout=int(timeout/1000), isolation_level="IMMEDIATE",
+            cached_statements=BackStore._SQL_CACHE_SIZE)
+        # SQL text of the statements built by _data_add() and friends, the
+        # sqlite3 module keeps them prepared as long as the text is identical.
+        self._sql_cmds = {}
         # Create tables no matter exist or not. No lock required.
 
         sql_cmd = "PRAGMA foreign_keys = ON;\n"
 
+        # In WAL journal mode readers work on a snapshot of the state and
+        # neither block nor wait for the writer, so any number of plugin
+        # instances can list while one of them changes the state.
+        sql_cmd += "PRAGMA journal_mode = %s;\n" % BackStore.JOURNAL_MODE
+        sql_cmd += "PRAGMA synchronous = NORMAL;\n"
+
         sql_cmd += (
             """
             CREATE TABLE systems (
@@ -391,10 +436,153 @@ def __init__(self, statefile, timeout):
         sql_cmd += (
             "CREATE TABLE jobs ("
             "id INTEGER PRIMARY KEY, "
-            "duration INTEGER NOT NULL, "
-            "timestamp TEXT NOT NULL, "
+            "duration REAL NOT NULL, "
+            "timestamp REAL NOT NULL, "     # Time the job starts running,
+                                            # it is queued until then.
             "data_type INTEGER, "
-            "data_id TEXT);\n")
+            "data_id TEXT, "
+            "pool_id INTEGER);\n")         # Pool whose job slots the job
+                                            # takes
+        sql_cmd += "CREATE INDEX jobs_pool_id ON jobs (pool_id);\n"
+
+        # Space ledger of each pool: total_space is the sum of its data disks
+        # or the size of a sub-pool, free_space has the volumes, file systems
+        # and sub-pools allocated from the pool taken off.  The triggers
+        # below keep it up to date within the transaction changing those, so
+        # reading the space of a pool never has to aggregate its contents.
+        sql_cmd += (
+            "CREATE TABLE pool_space ("
+            "pool_id INTEGER PRIMARY KEY, "
+            "total_space LONG NOT NULL, "
+            "free_space LONG NOT NULL, "
+            "FOREIGN KEY(pool_id) "
+            "REFERENCES pools(id) ON DELETE CASCADE);\n")
+
+        sql_cmd += (
+            """
+            CREATE TRIGGER pool_space_pool_add AFTER INSERT ON pools
+            BEGIN
+                INSERT INTO pool_space (pool_id, total_space, free_space)
+                    VALUES (NEW.id, ifnull(NEW.total_space, 0),
+                            ifnull(NEW.total_space, 0));
+                UPDATE pool_space
+                    SET free_space = free_space - ifnull(NEW.total_space, 0)
+                    WHERE pool_id = NEW.parent_pool_id;
+            END;
+
+            CREATE TRIGGER pool_space_pool_del AFTER DELETE ON pools
+            BEGIN
+                UPDATE pool_space
+                    SET free_space = free_space + ifnull(OLD.total_space, 0)
+                    WHERE pool_id = OLD.parent_pool_id;
+            END;
+
+            CREATE TRIGGER pool_space_pool_resize
+                AFTER UPDATE OF total_space ON pools
+            BEGIN
+                UPDATE pool_space
+                    SET total_space = total_space -
+                            ifnull(OLD.total_space, 0) +
+                            ifnull(NEW.total_space, 0),
+                        free_space = free_space -
+                            ifnull(OLD.total_space, 0) +
+                            ifnull(NEW.total_space, 0)
+                    WHERE pool_id = NEW.id;
+                UPDATE pool_space
+                    SET free_space = free_space +
+                            ifnull(OLD.total_space, 0) -
+                            ifnull(NEW.total_space, 0)
+                    WHERE pool_id = NEW.parent_pool_id;
+            END;
+
+            CREATE TRIGGER pool_space_disk_add AFTER INSERT ON disks
+                WHEN NEW.role = 'DATA'
+            BEGIN
+                UPDATE pool_space
+                    SET total_space = total_space + NEW.total_space,
+                        free_space = free_space + NEW.total_space
+                    WHERE pool_id = NEW.owner_pool_id;
+            END;
+
+            CREATE TRIGGER pool_space_disk_del AFTER DELETE ON disks
+                WHEN OLD.role = 'DATA'
+            BEGIN
+                UPDATE pool_space
+                    SET total_space = total_space - OLD.total_space,
+                        free_space = free_space - OLD.total_space
+                    WHERE pool_id = OLD.owner_pool_id;
+            END;
+
+            CREATE TRIGGER pool_space_disk_update
+                AFTER UPDATE OF owner_pool_id, role, total_space ON disks
+            BEGIN
+                UPDATE pool_space
+                    SET total_space = total_space - OLD.total_space,
+                        free_space = free_space - OLD.total_space
+                    WHERE pool_id = OLD.owner_pool_id AND OLD.role = 'DATA';
+                UPDATE pool_space
+                    SET total_space = total_space + NEW.total_space,
+                        free_space = free_space + NEW.total_space
+                    WHERE pool_id = NEW.owner_pool_id AND NEW.role = 'DATA';
+            END;
+            """)
+
+        for table in ['volumes', 'fss']:
+            sql_cmd += (
+                """
+                CREATE TRIGGER pool_space_%s_add AFTER INSERT ON %s
+                BEGIN
+                    UPDATE pool_space
+                        SET free_space = free_space - NEW.consumed_size
+                        WHERE pool_id = NEW.pool_id;
+                END;
+
+                CREATE TRIGGER pool_space_%s_del AFTER DELETE ON %s
+                BEGIN
+                    UPDATE pool_space
+                        SET free_space = free_space + OLD.consumed_size
+                        WHERE pool_id = OLD.pool_id;
+                END;
+
+                CREATE TRIGGER pool_space_%s_update
+                    AFTER UPDATE OF consumed_size, pool_id ON %s
+                BEGIN
+                    UPDATE pool_space
+                        SET free_space = free_space + OLD.consumed_size
+                        WHERE pool_id = OLD.pool_id;
+                    UPDATE pool_space
+                        SET free_space = free_space - NEW.consumed_size
+                        WHERE pool_id = NEW.pool_id;
+                END;
+                """ % ((table, table) * 3))
+
+        # Indexes on the foreign keys the lookups go through
+        for (table, column) in [('vol_masks', 'vol_id'),
+                                ('vol_masks', 'ag_id'),
+                                ('disks', 'owner_pool_id'),
+                                ('inits', 'owner_ag_id'),
+                                ('volumes', 'pool_id')]:
+            sql_cmd += "CREATE INDEX %s_%s ON %s (%s);\n" % (
+                table, column, table, column)
+
+        # Change counters of the tables SimArray keeps lsm objects of,
+        # bumped by triggers so the changes made by any plugin instance
+        # sharing the state file are seen.
+        sql_cmd += (
+            "CREATE TABLE table_gens ("
+            "name TEXT PRIMARY KEY, "
+            "gen INTEGER NOT NULL);\n")
+        for (name, tables) in BackStore.GEN_TABLES.items():
+            for table in tables:
+                for op in ['INSERT', 'UPDATE', 'DELETE']:
+                    sql_cmd += (
+                        """
+                        CREATE TRIGGER table_gen_%s_%s AFTER %s ON %s
+                        BEGIN
+                            UPDATE table_gens SET gen = gen + 1
+                                WHERE name = '%s';
+                        END;
+                        """ % (table, op.lower(), op, table, name))
 
         # Create views
         sql_cmd += (
@@ -410,30 +598,12 @@ def __init__(self, statefile, timeout):
                     pool.raid_type,
                     pool.member_type,
                     pool.parent_pool_id,
-                        ifnull(pool.total_space,
-                            ifnull(SUM(disk.total_space), 0))
-                    total_space,
-                        ifnull(pool.total_space,
-                            ifnull(SUM(disk.total_space), 0)) -
-                        ifnull(SUM(volume.consumed_size), 0) -
-                        ifnull(SUM(fs.consumed_size), 0) -
-                        ifnull(SUM(pool2.total_space), 0)
-                    free_space
-
+                    space.total_space,
+                    space.free_space
                 FROM
                     pools pool
-                        LEFT JOIN disks disk
-                            ON pool.id = disk.owner_pool_id AND
-                               disk.role = 'DATA'
-                        LEFT JOIN volumes volume
-                            ON volume.pool_id = pool.id
-                        LEFT JOIN fss fs
-                            ON fs.pool_id = pool.id
-                        LEFT JOIN pools pool2
-                            ON pool2.parent_pool_id = pool.id
-
-                GROUP BY
-                    pool.id
+                        INNER JOIN pool_space space
+                            ON space.pool_id = pool.id
             ;
             """)
         sql_cmd += (
@@ -613,6 +783,70 @@ def __init__(self, statefile, timeout):
             else:
                 raise sql_error
 
+        if self.snapshot_file and os.path.exists(self.snapshot_file):
+            self._snapshot_copy('main', 'snapshot')
+
+    def _snapshot_tables(self):
+        # In creation order, which has referenced tables first
+        return [r[0] for r in self._sql_exec(
+            "SELECT name FROM sqlite_master WHERE type='table' "
+            "ORDER BY rowid;")]
+
+    def _snapshot_copy(self, dst, src):
+        """
+        Replace the content of database dst with the one of src, one of
+        them being the statefile attached as 'snapshot'.  Returns False
+        without copying when loading from a statefile holding no state.
+        """
+        self._sql_exec(
+            "ATTACH DATABASE ? AS snapshot;", params=[self.snapshot_file])
+        try:
+            self.trans_begin()
+            versions = []
+            if self._sql_exec(
+                    "SELECT name FROM snapshot.sqlite_master "
+                    "WHERE type='table' AND name='systems';"):
+                versions = self._sql_exec("SELECT version FROM "
+                                          "snapshot.systems;")
+            if versions and versions[0][0] != BackStore.VERSION_SIGNATURE:
+                raise LsmError(
+                    ErrorNumber.INVALID_ARGUMENT,
+                    "Stored simulator state incompatible with "
+                    "simulator, please move or delete %s" %
+                    self.snapshot_file)
+            if not versions and src == 'snapshot':
+                self.trans_rollback()
+                return False
+
+            tables = self._snapshot_tables()
+            for table in reversed(tables):
+                self._sql_exec("DELETE FROM %s.%s;" % (dst, table))
+            # The pool space triggers fire while copying, the copy of the
+            # pool_space table itself then replaces what they computed.
+            for table in tables:
+                self._sql_exec(
+                    "INSERT OR REPLACE INTO %s.%s SELECT * FROM %s.%s;" %
+                    (dst, table, src, table))
+            self.sql_conn.commit()
+            return True
+        except (sqlite3.Error, LsmError):
+            self.trans_rollback()
+            raise
+        finally:
+            self._sql_exec("DETACH DATABASE snapshot;")
+
+    def snapshot_save(self):
+        """
+        Write the in-memory state to the statefile, no-op unless the state
+        is kept in memory with a statefile to snapshot to.
+        """
+        if not self.snapshot_file:
+            return
+        # Creates the statefile and its tables if needed
+        BackStore(self.snapshot_file, self.timeout).sql_conn.close()
+        self.snapshot_time = time.time()
+        self._snapshot_copy('snapshot', 'main')
+
     def _check_version(self):
         sim_syss = self.sim_syss()
         if len(sim_syss) == 0 or not sim_syss[0]:
@@ -627,13 +861,23 @@ def _check_version(self):
             "Stored simulator state incompatible with "
             "simulator, please move or delete %s" % self.statefile)
 
-    def check_version_and_init(self):
+    def check_version_and_init(self, profile=None):
         """
         Raise error if version not match.
-        If empty database found, initiate.
+        If empty database found, initiate, with the array described by the
+        profile dictionary when given, see _profile_init().
         """
         # The complex lock workflow is all caused by python sqlite3 do
         # autocommit for "CREATE TABLE" command.
+        # Initialized state only needs reading, don't queue up for the
+        # writer lock at every plugin_register().
+        self.trans_begin_read()
+        try:
+            if self._check_version():
+                return
+        finally:
+            self.trans_rollback()
+
         self.trans_begin()
         if self._check_version():
             self.trans_commit()
@@ -648,6 +892,14 @@ def check_version_and_init(self):
                     'status_info': "",
                     'version': BackStore.VERSION_SIGNATURE,
                 })
+            self._data_add_many(
+                'table_gens',
+                [{'name': name, 'gen': 0} for name in BackStore.GEN_TABLES])
+
+            if profile:
+                self._profile_init(profile)
+                self.trans_commit()
+                return
 
             size_bytes_2t = size_human_2_size_bytes('2TiB')
             size_bytes_512g = size_human_2_size_bytes('512GiB')
@@ -789,14 +1041,190 @@ def check_version_and_init(self):
             self.trans_commit()
             return
 
-    def _sql_exec(self, sql_cmd, key_list=None):
+    @staticmethod
+    def _profile_const(cls, prefix, name):
+        try:
+            return getattr(cls, prefix + str(name).upper())
+        except AttributeError:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Unknown %s '%s' in simulator profile" %
+                (prefix.lower()[:-1], name))
+
+    def _profile_init(self, profile):
+        """
+        Populate the empty state with the array topology of the profile
+        dictionary, all rows of a kind are inserted in a batch.  Every
+        section is optional:
+
+            {
+                "disks": [{"count": 600, "type": "SAS", "size": "2TiB"}],
+                "pools": {"count": 100, "raid_type": "RAID5",
+                          "disk_count": 5},
+                "volumes": {"count": 50000, "size": "1GiB"},
+                "fss": {"count": 1000, "size": "10GiB"},
+                "access_groups": {"count": 2000, "init_type": "ISCSI_IQN",
+                                  "init_count": 2, "masked_volumes": 25},
+                "target_ports": {"count": 16}
+            }
+
+        Pools take their disks in order and volumes and file systems are
+        spread round robin over the pools.  Access group N is masked to the
+        masked_volumes volumes following volume N * masked_volumes.
+        """
+        unknown = set(profile.keys()) - set([
+            'disks', 'pools', 'volumes', 'fss', 'access_groups',
+            'target_ports'])
+        if unknown:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Unknown section(s) in simulator profile: %s" %
+                ", ".join(sorted(unknown)))
+
+        sim_disks = []
+        for disk_def in profile.get('disks', []):
+            size_human = disk_def.get('size', '2TiB')
+            sim_disks.extend([{
+                'disk_prefix': "%s %s Disk" % (
+                    size_human, str(disk_def.get('type', 'SAS')).upper()),
+                'total_space': size_human_2_size_bytes(size_human),
+                'disk_type': BackStore._profile_const(
+                    Disk, 'TYPE_', disk_def.get('type', 'SAS')),
+                'status': Disk.STATUS_OK,
+            }] * int(disk_def.get('count', 0)))
+        self._data_add_many('disks', sim_disks)
+        sim_disk_ids = [
+            r[0] for r in self._sql_exec("SELECT id FROM disks ORDER BY id")]
+
+        pool_def = profile.get('pools', {})
+        raid_type = BackStore._profile_const(
+            Volume, 'RAID_TYPE_', pool_def.get('raid_type', 'RAID5'))
+        disk_count = int(pool_def.get('disk_count', 5))
+        pool_count = int(pool_def.get('count', 0))
+        if pool_count * disk_count > len(sim_disk_ids):
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Simulator profile needs %d disks for its pools, only %d "
+                "defined" % (pool_count * disk_count, len(sim_disk_ids)))
+        sim_pool_ids = []
+        for i in range(pool_count):
+            sim_pool_ids.append(self.sim_pool_create_from_disk(
+                name='Pool %d' % (i + 1),
+                sim_disk_ids=sim_disk_ids[i * disk_count:
+                                          (i + 1) * disk_count],
+                raid_type=raid_type,
+                element_type=Pool.ELEMENT_TYPE_FS |
+                Pool.ELEMENT_TYPE_VOLUME |
+                Pool.ELEMENT_TYPE_DELTA))
+
+        for (table, name_fmt) in [('volumes', 'volume_%d'),
+                                  ('fss', 'fs_%d')]:
+            data_def = profile.get(table, {})
+            count = int(data_def.get('count', 0))
+            if count and not sim_pool_ids:
+                raise LsmError(
+                    ErrorNumber.INVALID_ARGUMENT,
+                    "Simulator profile has %s but no pools" % table)
+            size_bytes = BackStore._block_rounding(
+                size_human_2_size_bytes(data_def.get('size', '1GiB')))
+            if table == 'volumes':
+                self._data_add_many('volumes', [{
+                    'vpd83': _random_vpd(),
+                    'name': name_fmt % (i + 1),
+                    'total_space': size_bytes,
+                    'consumed_size': size_bytes,
+                    'admin_state': Volume.ADMIN_STATE_ENABLED,
+                    'thinp': 0,
+                    'pool_id': sim_pool_ids[i % len(sim_pool_ids)],
+                } for i in range(count)])
+            else:
+                self._data_add_many('fss', [{
+                    'name': name_fmt % (i + 1),
+                    'total_space': size_bytes,
+                    'consumed_size': size_bytes,
+                    'free_space': size_bytes,
+                    'pool_id': sim_pool_ids[i % len(sim_pool_ids)],
+                } for i in range(count)])
+
+        if self._sql_exec(
+                "SELECT COUNT(pool_id) FROM pool_space "
+                "WHERE free_space < 0;")[0][0]:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Volumes and file systems of the simulator profile do not "
+                "fit in its pools")
+
+        ag_def = profile.get('access_groups', {})
+        ag_count = int(ag_def.get('count', 0))
+        init_type = BackStore._profile_const(
+            AccessGroup, 'INIT_TYPE_', ag_def.get('init_type', 'ISCSI_IQN'))
+        init_count = int(ag_def.get('init_count', 1))
+        self._data_add_many(
+            'ags', [{'name': 'ag_%d' % (i + 1)} for i in range(ag_count)])
+        sim_ag_ids = [
+            r[0] for r in self._sql_exec("SELECT id FROM ags ORDER BY id")]
+
+        inits = []
+        for sim_ag_id in sim_ag_ids:
+            for i in range(init_count):
+                if init_type == AccessGroup.INIT_TYPE_WWPN:
+                    wwpn = '%016x' % (
+                        0x5000000000000000 + sim_ag_id * 256 + i)
+                    init_id = ':'.join(
+                        wwpn[j:j + 2] for j in range(0, 16, 2))
+                else:
+                    init_id = 'iqn.1994-05.com.example:sim-ag-%d-%d' % (
+                        sim_ag_id, i)
+                inits.append({'id': init_id, 'init_type': init_type,
+                              'owner_ag_id': sim_ag_id})
+        self._data_add_many('inits', inits)
+
+        masked_volumes = int(ag_def.get('masked_volumes', 0))
+        sim_vol_ids = [
+            r[0] for r in self._sql_exec(
+                "SELECT id FROM volumes ORDER BY id")]
+        if masked_volumes and sim_vol_ids:
+            vol_masks = []
+            for (i, sim_ag_id) in enumerate(sim_ag_ids):
+                for j in range(min(masked_volumes, len(sim_vol_ids))):
+                    vol_masks.append({
+                        'ag_id': sim_ag_id,
+                        'vol_id': sim_vol_ids[
+                            (i * masked_volumes + j) % len(sim_vol_ids)]})
+            self._data_add_many('vol_masks', vol_masks)
+
+        tgts = []
+        for i in range(int(profile.get('target_ports', {}).get('count', 0))):
+            mac = 'a4:4e:31:47:%02x:%02x' % (i / 256, i % 256)
+            if i % 2 == 0:
+                wwpn = '50:0a:09:86:99:4b:%02x:%02x' % (i / 256, i % 256)
+                tgts.append({
+                    'port_type': TargetPort.TYPE_FC,
+                    'service_address': wwpn,
+                    'network_address': wwpn,
+                    'physical_address': wwpn,
+                    'physical_name': 'FC_%d' % i,
+                })
+            else:
+                tgts.append({
+                    'port_type': TargetPort.TYPE_ISCSI,
+                    'service_address': 'iqn.1986-05.com.example:sim-tgt-%d' %
+                    i,
+                    'network_address': '10.0.%d.%d:3260' % (i / 256, i % 256),
+                    'physical_address': mac,
+                    'physical_name': 'iSCSI_%d' % i,
+                })
+        self._data_add_many('tgts', tgts)
+
+    def _sql_exec(self, sql_cmd, key_list=None, params=()):
         """
-        Execute sql command and get all output.
+        Execute sql command with params bound to its '?' placeholders and get
+        all output.
         If key_list is not None, will convert returned sql data to a list of
         dictionaries.
         """
         sql_cur = self.sql_conn.cursor()
-        sql_cur.execute(sql_cmd)
+        sql_cur.execute(sql_cmd, params)
         self.lastrowid = sql_cur.lastrowid
         sql_output = sql_cur.fetchall()
         if key_list and sql_output:
@@ -807,33 +1235,95 @@ def _sql_exec(self, sql_cmd, key_list=None):
         else:
             return sql_output
 
+    def _sql_exec_many(self, sql_cmd, params_list):
+        """
+        Execute sql command once for each params in params_list.
+        """
+        self.sql_conn.executemany(sql_cmd, params_list)
+
+    def _sql_cmd(self, key, sql_fmt, *args):
+        """
+        Return the SQL text built by sql_fmt % args, cached under key so the
+        statement text of each table and column set is only built once.
+        """
+        sql_cmd = self._sql_cmds.get(key)
+        if sql_cmd is None:
+            sql_cmd = sql_fmt % args
+            self._sql_cmds[key] = sql_cmd
+        return sql_cmd
+
+    @staticmethod
+    def _sql_value(value):
+        # None has always been stored as an empty string
+        if value is None:
+            return ''
+        return value
+
     def _get_table(self, table_name, key_list):
-        sql_cmd = "SELECT %s FROM %s" % (",".join(key_list), table_name)
+        sql_cmd = self._sql_cmd(
+            ('SELECT', table_name, tuple(key_list)), "SELECT %s FROM %s",
+            ",".join(key_list), table_name)
         return self._sql_exec(sql_cmd, key_list)
 
     def trans_begin(self):
         self.sql_conn.execute("BEGIN IMMEDIATE TRANSACTION;")
 
+    def trans_begin_read(self):
+        """
+        Begin a deferred transaction for reading only, end it with
+        trans_rollback().  It reads a consistent snapshot of the state
+        without taking the writer lock.
+        """
+        self.sql_conn.execute("BEGIN DEFERRED TRANSACTION;")
+
     def trans_commit(self):
         self.sql_conn.commit()
+        if self.snapshot_interval and \
+           time.time() - self.snapshot_time >= self.snapshot_interval:
+            self.snapshot_save()
 
     def trans_rollback(self):
         self.sql_conn.rollback()
 
+    def _data_insert_cmd(self, table_name, keys):
+        return self._sql_cmd(
+            ('INSERT', table_name, tuple(keys)),
+            "INSERT INTO %s (%s) VALUES (%s);", table_name, ", ".join(keys),
+            ", ".join(['?'] * len(keys)))
+
     def _data_add(self, table_name, data_dict):
-        keys = data_dict.keys()
-        values = ['' if v is None else str(v) for v in data_dict.values()]
+        keys = sorted(data_dict.keys())
+        self._sql_exec(
+            self._data_insert_cmd(table_name, keys),
+            params=[BackStore._sql_value(data_dict[k]) for k in keys])
+
+    def _data_add_many(self, table_name, data_dicts):
+        """
+        Insert a row for each dictionary of data_dicts, all of them holding
+        the same keys.
+        """
+        if not data_dicts:
+            return
+        keys = sorted(data_dicts[0].keys())
+        self._sql_exec_many(
+            self._data_insert_cmd(table_name, keys),
+            ([BackStore._sql_value(d[k]) for k in keys] for d in data_dicts))
 
-        sql_cmd = "INSERT INTO %s (%s) VALUES (%s);" % \
-                  (table_name,
-                    "'%s'" % ("', '".join(keys)),
-                    "'%s'" % ("', '".join(values)))
-        self._sql_exec(sql_cmd)
+    def _where(self, condition):
+        """
+        Return the WHERE clause and parameters matching every
+        column: value pair of the condition dictionary.
+        """
+        columns = sorted(condition.keys())
+        return (" AND ".join("%s=?" % c for c in columns),
+                tuple(columns), [condition[c] for c in columns])
 
     def _data_find(self, table, condition, key_list, flag_unique=False):
-        sql_cmd = "SELECT %s FROM %s WHERE %s" % (
-            ",".join(key_list), table, condition)
-        sim_datas = self._sql_exec(sql_cmd, key_list)
+        (where, columns, params) = self._where(condition)
+        sql_cmd = self._sql_cmd(
+            ('FIND', table, tuple(key_list), columns),
+            "SELECT %s FROM %s WHERE %s", ",".join(key_list), table, where)
+        sim_datas = self._sql_exec(sql_cmd, key_list, params)
         if flag_unique:
             if len(sim_datas) == 0:
                 return None
@@ -846,69 +1336,159 @@ def _data_find(self, table, condition, key_list, flag_unique=False):
         else:
             return sim_datas
 
-    def _data_update(self, table, data_id, column_name, value):
-        if value is None:
-            value = ''
+    def _data_update_cmd(self, table, keys):
+        return self._sql_cmd(
+            ('UPDATE', table, tuple(keys)), "UPDATE %s SET %s WHERE id=?",
+            table, ", ".join("%s=?" % k for k in keys))
 
-        sql_cmd = "UPDATE %s SET %s='%s' WHERE id='%s'" % \
-            (table, column_name, value, data_id)
+    def _data_update(self, table, data_id, column_name, value):
+        self._sql_exec(
+            self._data_update_cmd(table, [column_name]),
+            params=[BackStore._sql_value(value), data_id])
 
-        self._sql_exec(sql_cmd)
+    def _data_update_many(self, table, data_ids, data_dict):
+        """
+        Set the columns of data_dict to its values in each row of data_ids.
+        """
+        keys = sorted(data_dict.keys())
+        values = [BackStore._sql_value(data_dict[k]) for k in keys]
+        self._sql_exec_many(
+            self._data_update_cmd(table, keys),
+            (values + [data_id] for data_id in data_ids))
 
     def _data_delete(self, table, condition):
-        sql_cmd = "DELETE FROM %s WHERE %s;" % (table, condition)
-        self._sql_exec(sql_cmd)
-
-    def sim_job_create(self, job_data_type=None, data_id=None):
+        (where, columns, params) = self._where(condition)
+        sql_cmd = self._sql_cmd(
+            ('DELETE', table, columns), "DELETE FROM %s WHERE %s;", table,
+            where)
+        self._sql_exec(sql_cmd, params=params)
+
+    def sim_job_create(self, job_data_type=None, data_id=None,
+                       sim_pool_id=None, size_bytes=0):
         """
         Return a job id(Integer)
+        The job takes LSM_SIM_TIME seconds, plus size_bytes at
+        LSM_SIM_JOB_RATE bytes per second if set, for operations whose
+        duration depends on the amount of data copied or allocated.
+        If LSM_SIM_JOB_MAX is set, at most that many jobs run on a pool at
+        a time, the job is queued until one of them finishes.
         """
+        now = time.time()
+        duration = float(os.getenv(
+            "LSM_SIM_TIME", BackStore.JOB_DEFAULT_DURATION))
+        rate = float(os.getenv("LSM_SIM_JOB_RATE", 0))
+        if rate > 0:
+            duration += abs(size_bytes) / rate
+
+        start = now
+        job_max = int(os.getenv("LSM_SIM_JOB_MAX", 0))
+        if job_max > 0 and sim_pool_id is not None:
+            # Jobs take the first slot to free up, the one of the job_max-th
+            # latest finishing job
+            ends = self._sql_exec(
+                "SELECT timestamp + duration FROM jobs WHERE pool_id=? AND "
+                "timestamp + duration > ? ORDER BY 1 DESC LIMIT ?;",
+                params=[sim_pool_id, now, job_max])
+            if len(ends) == job_max:
+                start = ends[-1][0]
+
         self._data_add(
             "jobs",
             {
-                "duration": os.getenv(
-                    "LSM_SIM_TIME", BackStore.JOB_DEFAULT_DURATION),
-                "timestamp": time.time(),
+                "duration": duration,
+                "timestamp": start,
                 "data_type": job_data_type,
                 "data_id": data_id,
+                "pool_id": sim_pool_id,
             })
         return self.lastrowid
 
     def sim_job_delete(self, sim_job_id):
-        self._data_delete('jobs', 'id="%s"' % sim_job_id)
+        self._data_delete('jobs', {'id': sim_job_id})
 
     def sim_job_status(self, sim_job_id):
         """
         Return (progress, data_type, data) tuple.
         progress is the integer of percent.
         """
-        sim_job = self._data_find(
-            'jobs', 'id=%s' % sim_job_id, BackStore.JOB_KEY_LIST,
-            flag_unique=True)
-        if sim_job is None:
-            raise LsmError(
-                ErrorNumber.NOT_FOUND_JOB, "Job not found")
-
-        progress = int(
-            (time.time() - float(sim_job['timestamp'])) /
-            sim_job['duration'] * 100)
-
-        data = None
-        data_type = None
+        return self.sim_jobs_status([sim_job_id])[0]
+
+    # Table, columns and lookup method raising the not found error of each
+    # job data type
+    _JOB_DATA_TABLES = {
+        JOB_DATA_TYPE_VOL: ('volumes', VOL_KEY_LIST, 'sim_vol_of_id'),
+        JOB_DATA_TYPE_FS: ('fss', FS_KEY_LIST, 'sim_fs_of_id'),
+        JOB_DATA_TYPE_FS_SNAP: (
+            'fs_snaps', FS_SNAP_KEY_LIST, 'sim_fs_snap_of_id'),
+    }
 
-        if progress >= 100:
+    def _sim_datas_of_ids(self, table, key_list, data_ids):
+        """
+        Return a dictionary of the rows of the table having the ids, keyed
+        by id.
+        """
+        rc = {}
+        data_ids = list(set(data_ids))
+        # Stay below the SQLite limit of bound parameters
+        for i in range(0, len(data_ids), 500):
+            chunk = data_ids[i:i + 500]
+            for sim_data in self._sql_exec(
+                    "SELECT %s FROM %s WHERE id IN (%s);" % (
+                        ",".join(key_list), table,
+                        ", ".join(['?'] * len(chunk))),
+                    key_list, chunk):
+                rc[sim_data['id']] = sim_data
+        return rc
+
+    def sim_jobs_status(self, sim_job_ids):
+        """
+        Return a list of (progress, data_type, data) tuples, one for each
+        of sim_job_ids, reading the jobs and the data of the finished ones
+        with a query per table.  A job which is still queued has progress 0.
+        """
+        sim_jobs = self._sim_datas_of_ids(
+            'jobs', BackStore.JOB_KEY_LIST, sim_job_ids)
+
+        now = time.time()
+        progresses = {}
+        data_ids = dict((t, []) for t in BackStore._JOB_DATA_TABLES.keys())
+        for sim_job_id in sim_job_ids:
+            sim_job = sim_jobs.get(int(sim_job_id))
+            if sim_job is None:
+                raise LsmError(
+                    ErrorNumber.NOT_FOUND_JOB, "Job not found")
             progress = 100
-            if sim_job['data_type'] == BackStore.JOB_DATA_TYPE_VOL:
-                data = self.sim_vol_of_id(sim_job['data_id'])
-                data_type = sim_job['data_type']
-            elif sim_job['data_type'] == BackStore.JOB_DATA_TYPE_FS:
-                data = self.sim_fs_of_id(sim_job['data_id'])
+            if sim_job['duration'] > 0:
+                progress = min(100, max(0, int(
+                    (now - sim_job['timestamp']) / sim_job['duration'] *
+                    100)))
+            progresses[sim_job['id']] = progress
+            if progress == 100 and sim_job['data_type'] in data_ids:
+                data_ids[sim_job['data_type']].append(
+                    int(sim_job['data_id']))
+
+        datas = {}
+        for (data_type, ids) in data_ids.items():
+            if ids:
+                (table, key_list, _) = BackStore._JOB_DATA_TABLES[data_type]
+                datas[data_type] = self._sim_datas_of_ids(
+                    table, key_list, ids)
+
+        rc = []
+        for sim_job_id in sim_job_ids:
+            sim_job = sim_jobs[int(sim_job_id)]
+            progress = progresses[sim_job['id']]
+            data = None
+            data_type = None
+            if progress == 100 and sim_job['data_type'] in datas:
                 data_type = sim_job['data_type']
-            elif sim_job['data_type'] == BackStore.JOB_DATA_TYPE_FS_SNAP:
-                data = self.sim_fs_snap_of_id(sim_job['data_id'])
-                data_type = sim_job['data_type']
-
-        return (progress, data_type, data)
+                data = datas[data_type].get(int(sim_job['data_id']))
+                if data is None:
+                    # Gone since the job finished
+                    getattr(self, BackStore._JOB_DATA_TABLES[data_type][2])(
+                        sim_job['data_id'])
+            rc.append((progress, data_type, data))
+        return rc
 
     def sim_syss(self):
         """
@@ -916,16 +1496,31 @@ def sim_syss(self):
         """
         return self._get_table('systems', BackStore.SYS_KEY_LIST)
 
-    def sim_disks(self):
+    def sim_disks(self, condition=None):
         """
-        Return a list of sim_disk dict.
+        Return a list of sim_disk dict, only those matching the SQL
+        condition if given.
         """
+        if condition:
+            return self._data_find(
+                'disks_view', condition, BackStore.DISK_KEY_LIST)
         return self._get_table('disks_view', BackStore.DISK_KEY_LIST)
 
-    def sim_pools(self):
+    def sim_table_gen(self, name):
         """
-        Return a list of sim_pool dict.
+        Return the change counter of the table(s) named in GEN_TABLES.
         """
+        return self._sql_exec(
+            "SELECT gen FROM table_gens WHERE name=?;", params=[name])[0][0]
+
+    def sim_pools(self, condition=None):
+        """
+        Return a list of sim_pool dict, only those matching the SQL
+        condition if given.
+        """
+        if condition:
+            return self._data_find(
+                'pools_view', condition, BackStore.POOL_KEY_LIST)
         return self._get_table('pools_view', BackStore.POOL_KEY_LIST)
 
     def sim_pool_of_id(self, sim_pool_id):
@@ -936,18 +1531,12 @@ def sim_pool_of_id(self, sim_pool_id):
     def sim_pool_create_from_disk(self, name, sim_disk_ids, raid_type,
                                   element_type, unsupported_actions=0):
         # Detect disk type
-        disk_type = None
-        for sim_disk in self.sim_disks():
-            if sim_disk['id'] not in sim_disk_ids:
-                continue
-            if disk_type is None:
-                disk_type = sim_disk['disk_type']
-            elif disk_type != sim_disk['disk_type']:
-                disk_type = None
-                break
+        disk_types = self._sql_exec(
+            "SELECT DISTINCT disk_type FROM disks WHERE id IN (%s);" %
+            ", ".join(['?'] * len(sim_disk_ids)), params=sim_disk_ids)
         member_type = PoolRAID.MEMBER_TYPE_DISK
-        if disk_type is not None:
-            member_type = PoolRAID.disk_type_to_member_type(disk_type)
+        if len(disk_types) == 1:
+            member_type = PoolRAID.disk_type_to_member_type(disk_types[0][0])
 
         self._data_add(
             'pools',
@@ -966,17 +1555,12 @@ def sim_pool_create_from_disk(self, name, sim_disk_ids, raid_type,
 
         # update disk owner
         sim_pool_id = self.lastrowid
-        for sim_disk_id in sim_disk_ids[:data_disk_count]:
-            self._data_update(
-                'disks', sim_disk_id, 'owner_pool_id', sim_pool_id)
-            self._data_update(
-                'disks', sim_disk_id, 'role', 'DATA')
-
-        for sim_disk_id in sim_disk_ids[data_disk_count:]:
-            self._data_update(
-                'disks', sim_disk_id, 'owner_pool_id', sim_pool_id)
-            self._data_update(
-                'disks', sim_disk_id, 'role', 'PARITY')
+        self._data_update_many(
+            'disks', sim_disk_ids[:data_disk_count],
+            {'owner_pool_id': sim_pool_id, 'role': 'DATA'})
+        self._data_update_many(
+            'disks', sim_disk_ids[data_disk_count:],
+            {'owner_pool_id': sim_pool_id, 'role': 'PARITY'})
 
         return sim_pool_id
 
@@ -999,29 +1583,33 @@ def sim_pool_create_sub_pool(self, name, parent_pool_id, size,
 
     def sim_pool_disks_count(self, sim_pool_id):
         return self._sql_exec(
-            "SELECT COUNT(id) FROM disks WHERE owner_pool_id=%s;" %
-            sim_pool_id)[0][0]
+            "SELECT COUNT(id) FROM disks WHERE owner_pool_id=?;",
+            params=[sim_pool_id])[0][0]
 
     def sim_pool_data_disks_count(self, sim_pool_id=None):
         return self._sql_exec(
             "SELECT COUNT(id) FROM disks WHERE "
-            "owner_pool_id=%s and role='DATA';" % sim_pool_id)[0][0]
+            "owner_pool_id=? and role='DATA';", params=[sim_pool_id])[0][0]
 
-    def sim_vols(self, sim_ag_id=None):
+    def sim_vols(self, sim_ag_id=None, condition=None):
         """
-        Return a list of sim_vol dict.
+        Return a list of sim_vol dict, only those matching the SQL
+        condition if given.
         """
         if sim_ag_id:
             return self._data_find(
-                'volumes_by_ag_view', 'ag_id=%s' % sim_ag_id,
+                'volumes_by_ag_view', {'ag_id': sim_ag_id},
                 BackStore.VOL_KEY_LIST)
+        elif condition:
+            return self._data_find(
+                'volumes', condition, BackStore.VOL_KEY_LIST)
         else:
             return self._get_table('volumes', BackStore.VOL_KEY_LIST)
 
     def _sim_data_of_id(self, table_name, data_id, key_list, lsm_error_no,
                         data_name):
         sim_data = self._data_find(
-            table_name, 'id=%s' % data_id, key_list, flag_unique=True)
+            table_name, {'id': data_id}, key_list, flag_unique=True)
         if sim_data is None:
             if lsm_error_no:
                 raise LsmError(
@@ -1093,14 +1681,14 @@ def sim_vol_delete(self, sim_vol_id):
                         ErrorNumber.PLUGIN_BUG,
                         "Requested volume is a replication source")
 
-        self._data_delete("volumes", 'id="%s"' % sim_vol_id)
+        self._data_delete("volumes", {'id': sim_vol_id})
 
     def sim_vol_mask(self, sim_vol_id, sim_ag_id):
         self.sim_vol_of_id(sim_vol_id)
         self.sim_ag_of_id(sim_ag_id)
         exist_mask = self._data_find(
-            'vol_masks', 'ag_id="%s" AND vol_id="%s"' %
-            (sim_ag_id, sim_vol_id), ['vol_id'])
+            'vol_masks', {'ag_id': sim_ag_id, 'vol_id': sim_vol_id},
+            ['vol_id'])
         if exist_mask:
             raise LsmError(
                 ErrorNumber.NO_STATE_CHANGE,
@@ -1114,7 +1702,7 @@ def sim_vol_mask(self, sim_vol_id, sim_ag_id):
     def sim_vol_unmask(self, sim_vol_id, sim_ag_id):
         self.sim_vol_of_id(sim_vol_id)
         self.sim_ag_of_id(sim_ag_id)
-        condition = 'ag_id="%s" AND vol_id="%s"' % (sim_ag_id, sim_vol_id)
+        condition = {'ag_id': sim_ag_id, 'vol_id': sim_vol_id}
         exist_mask = self._data_find('vol_masks', condition, ['vol_id'])
         if exist_mask:
             self._data_delete('vol_masks', condition)
@@ -1127,12 +1715,12 @@ def sim_vol_unmask(self, sim_vol_id, sim_ag_id):
     def _sim_vol_ids_of_masked_ag(self, sim_ag_id):
         return list(
             m['vol_id'] for m in self._data_find(
-                'vol_masks', 'ag_id="%s"' % sim_ag_id, ['vol_id']))
+                'vol_masks', {'ag_id': sim_ag_id}, ['vol_id']))
 
     def _sim_ag_ids_of_masked_vol(self, sim_vol_id):
         return list(
             m['ag_id'] for m in self._data_find(
-                'vol_masks', 'vol_id="%s"' % sim_vol_id, ['ag_id']))
+                'vol_masks', {'vol_id': sim_vol_id}, ['ag_id']))
 
     def sim_vol_resize(self, sim_vol_id, new_size_bytes):
         org_new_size_bytes = new_size_bytes
@@ -1182,7 +1770,7 @@ def dst_sim_vol_ids_of_src(self, src_sim_vol_id):
         self.sim_vol_of_id(src_sim_vol_id)
         return list(
             d['dst_vol_id'] for d in self._data_find(
-                'vol_reps', 'src_vol_id="%s"' % src_sim_vol_id,
+                'vol_reps', {'src_vol_id': src_sim_vol_id},
                 ['dst_vol_id']))
 
     def sim_vol_replica(self, src_sim_vol_id, dst_sim_vol_id, rep_type,
@@ -1194,7 +1782,7 @@ def sim_vol_replica(self, src_sim_vol_id, dst_sim_vol_id, rep_type,
         #                type.
         cur_src_sim_vol_ids = list(
             r['src_vol_id'] for r in self._data_find(
-                'vol_reps', 'dst_vol_id="%s"' % dst_sim_vol_id,
+                'vol_reps', {'dst_vol_id': dst_sim_vol_id},
                 ['src_vol_id']))
         if len(cur_src_sim_vol_ids) == 1 and \
            cur_src_sim_vol_ids[0] == src_sim_vol_id:
@@ -1226,8 +1814,7 @@ def sim_vol_src_replica_break(self, src_sim_vol_id):
                 ErrorNumber.NO_STATE_CHANGE,
                 "Provided volume is not a replication source")
 
-        self._data_delete(
-            'vol_reps', 'src_vol_id="%s"' % src_sim_vol_id)
+        self._data_delete('vol_reps', {'src_vol_id': src_sim_vol_id})
 
     def sim_vol_state_change(self, sim_vol_id, new_admin_state):
         sim_vol = self.sim_vol_of_id(sim_vol_id)
@@ -1252,7 +1839,7 @@ def _sim_ag_format(sim_ag):
     def sim_ags(self, sim_vol_id=None):
         if sim_vol_id:
             sim_ags = self._data_find(
-                'ags_by_vol_view', 'vol_id=%s' % sim_vol_id,
+                'ags_by_vol_view', {'vol_id': sim_vol_id},
                 BackStore.AG_KEY_LIST)
         else:
             sim_ags = self._get_table('ags_view', BackStore.AG_KEY_LIST)
@@ -1300,7 +1887,7 @@ def sim_ag_delete(self, sim_ag_id):
                 ErrorNumber.IS_MASKED,
                 "Access group has volume masked to")
 
-        self._data_delete('ags', 'id="%s"' % sim_ag_id)
+        self._data_delete('ags', {'id': sim_ag_id})
 
     def sim_ag_init_add(self, sim_ag_id, init_id, init_type):
         sim_ag = self.sim_ag_of_id(sim_ag_id)
@@ -1329,7 +1916,7 @@ def sim_ag_init_delete(self, sim_ag_id, init_id):
                 ErrorNumber.LAST_INIT_IN_ACCESS_GROUP,
                 "Refused to remove the last initiator from access group")
 
-        self._data_delete('inits', 'id="%s"' % init_id)
+        self._data_delete('inits', {'id': init_id})
 
     def sim_ag_of_id(self, sim_ag_id):
         sim_ag = self._sim_data_of_id(
@@ -1387,14 +1974,14 @@ def sim_fs_delete(self, sim_fs_id):
                 ErrorNumber.PLUGIN_BUG,
                 "Requested file system has snapshot attached")
 
-        if self._data_find('exps', 'fs_id="%s"' % sim_fs_id, ['id']):
+        if self._data_find('exps', {'fs_id': sim_fs_id}, ['id']):
             # TODO(Gris Ge): API does not have dedicate error for this
             #                scenario
             raise LsmError(
                 ErrorNumber.PLUGIN_BUG,
                 "Requested file system is exported via NFS")
 
-        self._data_delete("fss", 'id="%s"' % sim_fs_id)
+        self._data_delete("fss", {'id': sim_fs_id})
 
     def sim_fs_resize(self, sim_fs_id, new_size_bytes):
         org_new_size_bytes = new_size_bytes
@@ -1429,7 +2016,7 @@ def sim_fs_resize(self, sim_fs_id, new_size_bytes):
     def sim_fs_snaps(self, sim_fs_id):
         self.sim_fs_of_id(sim_fs_id)
         return self._data_find(
-            'fs_snaps', 'fs_id="%s"' % sim_fs_id, BackStore.FS_SNAP_KEY_LIST)
+            'fs_snaps', {'fs_id': sim_fs_id}, BackStore.FS_SNAP_KEY_LIST)
 
     def sim_fs_snap_of_id(self, sim_fs_snap_id, sim_fs_id=None):
         sim_fs_snap = self._sim_data_of_id(
@@ -1470,11 +2057,10 @@ def sim_fs_snap_restore(self, sim_fs_id, sim_fs_snap_id, files,
     def sim_fs_snap_delete(self, sim_fs_snap_id, sim_fs_id):
         self.sim_fs_of_id(sim_fs_id)
         self.sim_fs_snap_of_id(sim_fs_snap_id, sim_fs_id)
-        self._data_delete('fs_snaps', 'id="%s"' % sim_fs_snap_id)
+        self._data_delete('fs_snaps', {'id': sim_fs_snap_id})
 
     def sim_fs_snap_del_by_fs(self, sim_fs_id):
-        sql_cmd = "DELETE FROM fs_snaps WHERE fs_id='%s';" % sim_fs_id
-        self._sql_exec(sql_cmd)
+        self._data_delete('fs_snaps', {'fs_id': sim_fs_id})
 
     def sim_fs_clone(self, src_sim_fs_id, dst_sim_fs_id, sim_fs_snap_id):
         self.sim_fs_of_id(src_sim_fs_id)
@@ -1509,11 +2095,11 @@ def clone_dst_sim_fs_ids_of_src(self, src_sim_fs_id):
         self.sim_fs_of_id(src_sim_fs_id)
         return list(
             d['dst_fs_id'] for d in self._data_find(
-                'fs_clones', 'src_fs_id="%s"' % src_sim_fs_id,
+                'fs_clones', {'src_fs_id': src_sim_fs_id},
                 ['dst_fs_id']))
 
     def sim_fs_src_clone_break(self, src_sim_fs_id):
-        self._data_delete('fs_clones', 'src_fs_id="%s"' % src_sim_fs_id)
+        self._data_delete('fs_clones', {'src_fs_id': src_sim_fs_id})
 
     def _sim_exp_format(self, sim_exp):
         for key_name in ['root_hosts', 'rw_hosts', 'ro_hosts']:
@@ -1563,33 +2149,18 @@ def sim_exp_create(self, sim_fs_id, exp_path, root_hosts, rw_hosts,
 
         sim_exp_id = self.lastrowid
 
-        for root_host in root_hosts:
-            self._data_add(
-                'exp_root_hosts',
-                {
-                    'host': root_host,
-                    'exp_id': sim_exp_id,
-                })
-        for rw_host in rw_hosts:
-            self._data_add(
-                'exp_rw_hosts',
-                {
-                    'host': rw_host,
-                    'exp_id': sim_exp_id,
-                })
-        for ro_host in ro_hosts:
-            self._data_add(
-                'exp_ro_hosts',
-                {
-                    'host': ro_host,
-                    'exp_id': sim_exp_id,
-                })
+        for (table_name, hosts) in [('exp_root_hosts', root_hosts),
+                                    ('exp_rw_hosts', rw_hosts),
+                                    ('exp_ro_hosts', ro_hosts)]:
+            self._data_add_many(
+                table_name,
+                [{'host': host, 'exp_id': sim_exp_id} for host in hosts])
 
         return sim_exp_id
 
     def sim_exp_delete(self, sim_exp_id):
         self.sim_exp_of_id(sim_exp_id)
-        self._data_delete('exps', 'id="%s"' % sim_exp_id)
+        self._data_delete('exps', {'id': sim_exp_id})
 
     def sim_tgts(self):
         """
@@ -1615,6 +2186,31 @@ def _lsm_id_to_sim_id(lsm_id, lsm_error):
         except ValueError:
             raise lsm_error
 
+    @staticmethod
+    def _sim_search_condition(search_key, search_value, columns):
+        """
+        Turns a search on an lsm id property into a BackStore condition on
+        the sim id column, columns maps the search keys to (column, id
+        prefix).
+        Returns None when there is nothing to search and False when nothing
+        can match.
+        """
+        if search_key is None:
+            return None
+        if search_key == 'system_id':
+            if search_value == BackStore.SYS_ID:
+                return None
+            return False
+
+        (column, prefix) = columns[search_key]
+        try:
+            sim_id = int(search_value[-SimArray.ID_FMT:])
+        except (TypeError, ValueError):
+            return False
+        if SimArray._sim_id_to_lsm_id(sim_id, prefix) != search_value:
+            return False
+        return {column: sim_id}
+
     @staticmethod
     def _sim_job_id_of(job_id):
         return SimArray._lsm_id_to_sim_id(
@@ -1658,27 +2254,67 @@ def _sim_ag_id_of(ag_id):
                 ErrorNumber.NOT_FOUND_NFS_EXPORT,
                 "File system export not found"))
 
+    @staticmethod
+    def _profile_load(profile_file):
+        try:
+            with open(profile_file) as f:
+                return json.load(f)
+        except (IOError, ValueError) as error:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Failed to load simulator profile '%s': %s" %
+                (profile_file, error))
+
     @_handle_errors
-    def __init__(self, statefile, timeout):
+    def __init__(self, statefile, timeout, profile_file=None,
+                 in_memory=False, snapshot_interval=0):
+        """
+        profile_file is a JSON file describing the array a state file which
+        does not exist yet is populated with, see BackStore._profile_init().
+        in_memory and snapshot_interval keep the state in memory, see
+        BackStore.
+        """
         if statefile is None:
             statefile = SimArray.SIM_DATA_FILE
 
-        self.bs_obj = BackStore(statefile, timeout)
-        self.bs_obj.check_version_and_init()
+        profile = None
+        if profile_file:
+            profile = SimArray._profile_load(profile_file)
+
+        self.bs_obj = BackStore(statefile, timeout, in_memory,
+                                snapshot_interval)
+        self.bs_obj.check_version_and_init(profile)
         self.statefile = statefile
         self.timeout = timeout
+        # Table name => (generation, [(sim_data, lsm object)] in listing
+        # order, {sim id: (sim_data, lsm object)})
+        self._lsm_obj_cache = {}
 
-    def _job_create(self, data_type=None, sim_data_id=None):
+    def _job_create(self, data_type=None, sim_data_id=None,
+                    sim_pool_id=None, size_bytes=0):
         sim_job_id = self.bs_obj.sim_job_create(
-            data_type, sim_data_id)
+            data_type, sim_data_id, sim_pool_id, size_bytes)
         return SimArray._sim_id_to_lsm_id(sim_job_id, 'JOB')
 
     @_handle_errors
     def job_status(self, job_id, flags=0):
-        sim_job_id = SimArray._sim_job_id_of(job_id)
+        return self.jobs_status([job_id], flags)[0]
 
-        (progress, data_type, sim_data) = self.bs_obj.sim_job_status(
-            sim_job_id)
+    @_handle_errors
+    def jobs_status(self, job_ids, flags=0):
+        """
+        Return a list of (status, percent, data) tuples, one for each job
+        of job_ids.  Queued jobs are in progress at 0 percent.
+        """
+        self.bs_obj.trans_begin_read()
+        rc = self.bs_obj.sim_jobs_status(
+            [SimArray._sim_job_id_of(job_id) for job_id in job_ids])
+        self.bs_obj.trans_rollback()
+
+        return [SimArray._sim_job_status_2_lsm(*r) for r in rc]
+
+    @staticmethod
+    def _sim_job_status_2_lsm(progress, data_type, sim_data):
         status = JobStatus.INPROGRESS
         if progress == 100:
             status = JobStatus.COMPLETE
@@ -1702,10 +2338,16 @@ def job_free(self, job_id, flags=0):
 
     @_handle_errors
     def time_out_set(self, ms, flags=0):
-        self.bs_obj = BackStore(self.statefile, int(ms/1000))
+        # Keep the connection, an in-memory state lives in it
+        self.bs_obj.sql_conn.execute("PRAGMA busy_timeout = %d;" % int(ms))
+        self.bs_obj.timeout = ms
         self.timeout = ms
         return None
 
+    @_handle_errors
+    def snapshot_save(self):
+        self.bs_obj.snapshot_save()
+
     @_handle_errors
     def time_out_get(self, flags=0):
         return self.timeout
@@ -1718,9 +2360,51 @@ def _sim_sys_2_lsm(sim_sys):
 
     @_handle_errors
     def systems(self):
+        self.bs_obj.trans_begin_read()
+        sim_syss = self.bs_obj.sim_syss()
+        self.bs_obj.trans_rollback()
         return list(
-            SimArray._sim_sys_2_lsm(sim_sys)
-            for sim_sys in self.bs_obj.sim_syss())
+            SimArray._sim_sys_2_lsm(sim_sys) for sim_sys in sim_syss)
+
+    def _lsm_objs(self, name, condition, sim_datas_get, convert):
+        """
+        Return the lsm objects of the table(s) named in
+        BackStore.GEN_TABLES, those matching the BackStore condition if not
+        None.  sim_datas_get(condition) reads the sim data and convert()
+        turns one into an lsm object.
+        The objects of the whole listing are kept with the generation of
+        the table, while it does not change they are returned without
+        reading the state, and once it does the objects of unchanged rows
+        are reused.  Searches by id are answered from a current listing,
+        other searches read the state.
+        """
+        self.bs_obj.trans_begin_read()
+        try:
+            gen = self.bs_obj.sim_table_gen(name)
+            cache = self._lsm_obj_cache.get(name)
+            if cache is not None and cache[0] == gen and \
+               (condition is None or condition.keys() == ['id']):
+                if condition is None:
+                    return [lsm_obj for (_, lsm_obj) in cache[1]]
+                entry = cache[2].get(condition['id'])
+                return entry and [entry[1]] or []
+
+            entries = []
+            cached = {}
+            if cache is not None:
+                cached = cache[2]
+            for sim_data in sim_datas_get(condition):
+                entry = cached.get(sim_data['id'])
+                if entry is None or entry[0] != sim_data:
+                    entry = (sim_data, convert(sim_data))
+                entries.append(entry)
+        finally:
+            self.bs_obj.trans_rollback()
+
+        if condition is None:
+            self._lsm_obj_cache[name] = (
+                gen, entries, dict((e[0]['id'], e) for e in entries))
+        return [lsm_obj for (_, lsm_obj) in entries]
 
     @staticmethod
     def _sim_vol_2_lsm(sim_vol):
@@ -1733,9 +2417,16 @@ def _sim_vol_2_lsm(sim_vol):
                       pool_id)
 
     @_handle_errors
-    def volumes(self):
-        return list(
-            SimArray._sim_vol_2_lsm(v) for v in self.bs_obj.sim_vols())
+    def volumes(self, search_key=None, search_value=None):
+        condition = SimArray._sim_search_condition(
+            search_key, search_value,
+            {'id': ('id', 'VOL'), 'pool_id': ('pool_id', 'POOL')})
+        if condition is False:
+            return []
+        return self._lsm_objs(
+            'volumes', condition,
+            lambda c: self.bs_obj.sim_vols(condition=c),
+            SimArray._sim_vol_2_lsm)
 
     @staticmethod
     def _sim_pool_2_lsm(sim_pool):
@@ -1753,12 +2444,14 @@ def _sim_pool_2_lsm(sim_pool):
             free_space, status, status_info, sys_id)
 
     @_handle_errors
-    def pools(self, flags=0):
-        self.bs_obj.trans_begin()
-        sim_pools = self.bs_obj.sim_pools()
-        self.bs_obj.trans_rollback()
-        return list(
-            SimArray._sim_pool_2_lsm(sim_pool) for sim_pool in sim_pools)
+    def pools(self, flags=0, search_key=None, search_value=None):
+        condition = SimArray._sim_search_condition(
+            search_key, search_value, {'id': ('id', 'POOL')})
+        if condition is False:
+            return []
+        return self._lsm_objs(
+            'pools', condition, self.bs_obj.sim_pools,
+            SimArray._sim_pool_2_lsm)
 
     @staticmethod
     def _sim_disk_2_lsm(sim_disk):
@@ -1774,10 +2467,14 @@ def _sim_disk_2_lsm(sim_disk):
             disk_status, BackStore.SYS_ID)
 
     @_handle_errors
-    def disks(self):
-        return list(
-            SimArray._sim_disk_2_lsm(sim_disk)
-            for sim_disk in self.bs_obj.sim_disks())
+    def disks(self, search_key=None, search_value=None):
+        condition = SimArray._sim_search_condition(
+            search_key, search_value, {'id': ('id', 'DISK')})
+        if condition is False:
+            return []
+        return self._lsm_objs(
+            'disks', condition, self.bs_obj.sim_disks,
+            SimArray._sim_disk_2_lsm)
 
     @_handle_errors
     def volume_create(self, pool_id, vol_name, size_bytes, thinp, flags=0,
@@ -1797,27 +2494,79 @@ def volume_create(self, pool_id, vol_name, size_bytes, thinp, flags=0,
             return new_sim_vol_id
 
         job_id = self._job_create(
-            BackStore.JOB_DATA_TYPE_VOL, new_sim_vol_id)
+            BackStore.JOB_DATA_TYPE_VOL, new_sim_vol_id,
+            SimArray._sim_pool_id_of(pool_id))
         self.bs_obj.trans_commit()
 
         return job_id, None
 
+    def _many(self, func, items):
+        """
+        Call func on each of items in a single transaction, return a
+        [result, error] pair for each item, error being the
+        [code, message, data] of the LsmError func raised.
+
+        A failed item is not rolled back on its own (the sqlite3 module
+        commits around SAVEPOINT statements), so func must raise every
+        LsmError before its first write: create() inserts a volume and then
+        a job, _volume_delete() deletes a volume and then inserts a job, and
+        the sim_* helpers they call do all of their checks first.  Keep it
+        that way when changing them, or a failed item leaves its first
+        writes behind in the committed batch.  Any other exception aborts
+        the whole batch through _handle_errors().
+        """
+        rc = []
+        self.bs_obj.trans_begin()
+        for item in items:
+            try:
+                rc.append([func(item), None])
+            except LsmError as lsm_error:
+                rc.append(
+                    [None, [lsm_error.code, lsm_error.msg, lsm_error.data]])
+        self.bs_obj.trans_commit()
+        return rc
+
+    @_handle_errors
+    def volume_create_many(self, pool_id, vol_names, size_bytes, thinp,
+                           flags=0):
+        sim_pool_id = SimArray._sim_pool_id_of(pool_id)
+
+        def create(vol_name):
+            new_sim_vol_id = self.bs_obj.sim_vol_create(
+                vol_name, size_bytes, sim_pool_id, thinp)
+            return self._job_create(
+                BackStore.JOB_DATA_TYPE_VOL, new_sim_vol_id,
+                sim_pool_id), None
+
+        return self._many(create, vol_names)
+
     @_handle_errors
     def volume_delete(self, vol_id, flags=0):
         self.bs_obj.trans_begin()
-        self.bs_obj.sim_vol_delete(SimArray._sim_vol_id_of(vol_id))
-        job_id = self._job_create()
+        job_id = self._volume_delete(vol_id)
         self.bs_obj.trans_commit()
         return job_id
 
+    def _volume_delete(self, vol_id):
+        sim_vol_id = SimArray._sim_vol_id_of(vol_id)
+        sim_vol = self.bs_obj.sim_vol_of_id(sim_vol_id)
+        self.bs_obj.sim_vol_delete(sim_vol_id)
+        return self._job_create(sim_pool_id=sim_vol['pool_id'])
+
+    @_handle_errors
+    def volume_delete_many(self, vol_ids, flags=0):
+        return self._many(self._volume_delete, vol_ids)
+
     @_handle_errors
     def volume_resize(self, vol_id, new_size_bytes, flags=0):
         self.bs_obj.trans_begin()
 
         sim_vol_id = SimArray._sim_vol_id_of(vol_id)
+        sim_vol = self.bs_obj.sim_vol_of_id(sim_vol_id)
         self.bs_obj.sim_vol_resize(sim_vol_id, new_size_bytes)
         job_id = self._job_create(
-            BackStore.JOB_DATA_TYPE_VOL, sim_vol_id)
+            BackStore.JOB_DATA_TYPE_VOL, sim_vol_id, sim_vol['pool_id'],
+            new_size_bytes - sim_vol['total_space'])
         self.bs_obj.trans_commit()
 
         return job_id, None
@@ -1838,7 +2587,8 @@ def volume_replicate(self, dst_pool_id, rep_type, src_vol_id, new_vol_name,
         self.bs_obj.sim_vol_replica(src_sim_vol_id, dst_sim_vol_id, rep_type)
 
         job_id = self._job_create(
-            BackStore.JOB_DATA_TYPE_VOL, dst_sim_vol_id)
+            BackStore.JOB_DATA_TYPE_VOL, dst_sim_vol_id,
+            SimArray._sim_pool_id_of(dst_pool_id), src_sim_vol['total_space'])
         self.bs_obj.trans_commit()
 
         return job_id, None
@@ -1864,7 +2614,12 @@ def volume_replicate_range(self, rep_type, src_vol_id, dst_vol_id, ranges,
             SimArray._sim_pool_id_of(src_vol_id),
             SimArray._sim_pool_id_of(dst_vol_id), rep_type, ranges)
 
-        job_id = self._job_create()
+        dst_sim_vol = self.bs_obj.sim_vol_of_id(
+            SimArray._sim_vol_id_of(dst_vol_id))
+        job_id = self._job_create(
+            sim_pool_id=dst_sim_vol['pool_id'],
+            size_bytes=sum(r.block_count for r in ranges) *
+            BackStore.BLK_SIZE)
 
         self.bs_obj.trans_commit()
         return job_id
@@ -1933,7 +2688,10 @@ def _sim_fs_2_lsm(sim_fs):
 
     @_handle_errors
     def fs(self):
-        return list(SimArray._sim_fs_2_lsm(f) for f in self.bs_obj.sim_fss())
+        self.bs_obj.trans_begin_read()
+        sim_fss = self.bs_obj.sim_fss()
+        self.bs_obj.trans_rollback()
+        return list(SimArray._sim_fs_2_lsm(f) for f in sim_fss)
 
     @_handle_errors
     def fs_create(self, pool_id, fs_name, size_bytes, flags=0,
@@ -1949,7 +2707,8 @@ def fs_create(self, pool_id, fs_name, size_bytes, flags=0,
             return new_sim_fs_id
 
         job_id = self._job_create(
-            BackStore.JOB_DATA_TYPE_FS, new_sim_fs_id)
+            BackStore.JOB_DATA_TYPE_FS, new_sim_fs_id,
+            SimArray._sim_pool_id_of(pool_id))
         self.bs_obj.trans_commit()
 
         return job_id, None
@@ -1957,8 +2716,10 @@ def fs_create(self, pool_id, fs_name, size_bytes, flags=0,
     @_handle_errors
     def fs_delete(self, fs_id, flags=0):
         self.bs_obj.trans_begin()
-        self.bs_obj.sim_fs_delete(SimArray._sim_fs_id_of(fs_id))
-        job_id = self._job_create()
+        sim_fs_id = SimArray._sim_fs_id_of(fs_id)
+        sim_fs = self.bs_obj.sim_fs_of_id(sim_fs_id)
+        self.bs_obj.sim_fs_delete(sim_fs_id)
+        job_id = self._job_create(sim_pool_id=sim_fs['pool_id'])
         self.bs_obj.trans_commit()
         return job_id
 
@@ -1966,8 +2727,11 @@ def fs_delete(self, fs_id, flags=0):
     def fs_resize(self, fs_id, new_size_bytes, flags=0):
         sim_fs_id = SimArray._sim_fs_id_of(fs_id)
         self.bs_obj.trans_begin()
+        sim_fs = self.bs_obj.sim_fs_of_id(sim_fs_id)
         self.bs_obj.sim_fs_resize(sim_fs_id, new_size_bytes)
-        job_id = self._job_create(BackStore.JOB_DATA_TYPE_FS, sim_fs_id)
+        job_id = self._job_create(
+            BackStore.JOB_DATA_TYPE_FS, sim_fs_id, sim_fs['pool_id'],
+            new_size_bytes - sim_fs['total_space'])
         self.bs_obj.trans_commit()
         return job_id, None
 
@@ -1990,7 +2754,8 @@ def fs_clone(self, src_fs_id, dst_fs_name, snap_id, flags=0):
         self.bs_obj.sim_fs_clone(src_sim_fs_id, dst_sim_fs_id, sim_fs_snap_id)
 
         job_id = self._job_create(
-            BackStore.JOB_DATA_TYPE_FS, dst_sim_fs_id)
+            BackStore.JOB_DATA_TYPE_FS, dst_sim_fs_id, src_sim_fs['pool_id'],
+            src_sim_fs['total_space'])
         self.bs_obj.trans_commit()
 
         return job_id, None
@@ -2018,10 +2783,10 @@ def _sim_fs_snap_2_lsm(sim_fs_snap):
 
     @_handle_errors
     def fs_snapshots(self, fs_id, flags=0):
-        return list(
-            SimArray._sim_fs_snap_2_lsm(s)
-            for s in self.bs_obj.sim_fs_snaps(
-                SimArray._sim_fs_id_of(fs_id)))
+        self.bs_obj.trans_begin_read()
+        sim_fs_snaps = self.bs_obj.sim_fs_snaps(SimArray._sim_fs_id_of(fs_id))
+        self.bs_obj.trans_rollback()
+        return list(SimArray._sim_fs_snap_2_lsm(s) for s in sim_fs_snaps)
 
     @_handle_errors
     def fs_snapshot_create(self, fs_id, snap_name, flags=0):
@@ -2101,7 +2866,10 @@ def _sim_exp_2_lsm(sim_exp):
 
     @_handle_errors
     def exports(self, flags=0):
-        return [SimArray._sim_exp_2_lsm(e) for e in self.bs_obj.sim_exps()]
+        self.bs_obj.trans_begin_read()
+        sim_exps = self.bs_obj.sim_exps()
+        self.bs_obj.trans_rollback()
+        return [SimArray._sim_exp_2_lsm(e) for e in sim_exps]
 
     @_handle_errors
     def fs_export(self, fs_id, exp_path, root_hosts, rw_hosts, ro_hosts,
@@ -2129,7 +2897,10 @@ def _sim_ag_2_lsm(sim_ag):
 
     @_handle_errors
     def ags(self):
-        return list(SimArray._sim_ag_2_lsm(a) for a in self.bs_obj.sim_ags())
+        self.bs_obj.trans_begin_read()
+        sim_ags = self.bs_obj.sim_ags()
+        self.bs_obj.trans_rollback()
+        return list(SimArray._sim_ag_2_lsm(a) for a in sim_ags)
 
     @_handle_errors
     def access_group_create(self, name, init_id, init_type, sys_id, flags=0):
@@ -2178,6 +2949,14 @@ def volume_mask(self, ag_id, vol_id, flags=0):
         self.bs_obj.trans_commit()
         return None
 
+    @_handle_errors
+    def volume_mask_many(self, ag_id, vol_ids, flags=0):
+        sim_ag_id = SimArray._sim_ag_id_of(ag_id)
+        return self._many(
+            lambda vol_id: self.bs_obj.sim_vol_mask(
+                SimArray._sim_vol_id_of(vol_id), sim_ag_id),
+            vol_ids)
+
     @_handle_errors
     def volume_unmask(self, ag_id, vol_id, flags=0):
         self.bs_obj.trans_begin()
@@ -2189,7 +2968,7 @@ def volume_unmask(self, ag_id, vol_id, flags=0):
 
     @_handle_errors
     def volumes_accessible_by_access_group(self, ag_id, flags=0):
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_begin_read()
 
         sim_vols = self.bs_obj.sim_vols(
             sim_ag_id=SimArray._sim_ag_id_of(ag_id))
@@ -2199,7 +2978,7 @@ def volumes_accessible_by_access_group(self, ag_id, flags=0):
 
     @_handle_errors
     def access_groups_granted_to_volume(self, vol_id, flags=0):
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_begin_read()
         sim_ags = self.bs_obj.sim_ags(
             sim_vol_id=SimArray._sim_vol_id_of(vol_id))
         self.bs_obj.trans_rollback()
@@ -2225,7 +3004,10 @@ def _sim_tgt_2_lsm(sim_tgt):
 
     @_handle_errors
     def target_ports(self):
-        return list(SimArray._sim_tgt_2_lsm(t) for t in self.bs_obj.sim_tgts())
+        self.bs_obj.trans_begin_read()
+        sim_tgts = self.bs_obj.sim_tgts()
+        self.bs_obj.trans_rollback()
+        return list(SimArray._sim_tgt_2_lsm(t) for t in sim_tgts)
 
     @_handle_errors
     def volume_raid_info(self, lsm_vol):
@@ -17,7 +17,8 @@
 #         Gris Ge <fge@redhat.com>
 
 from lsm import (uri_parse, VERSION, Capabilities, INfs,
-                 IStorageAreaNetwork, search_property)
+                 IStorageAreaNetwork, search_property, quick_search_set,
+                 LsmError, ErrorNumber)
 
 from simarray import SimArray
 
@@ -26,6 +27,12 @@ class SimPlugin(INfs, IStorageAreaNetwork):
     """
     Simple class that implements enough to allow the framework to be exercised.
     """
+    QUICK_SEARCH_KEYS = {
+        'pools': ['id', 'system_id'],
+        'volumes': ['id', 'system_id', 'pool_id'],
+        'disks': ['id', 'system_id'],
+    }
+
     def __init__(self):
         self.uri = None
         self.password = None
@@ -37,21 +44,35 @@ def plugin_register(self, uri, password, timeout, flags=0):
 
         #The caller may want to start clean, so we allow the caller to specify
         #a file to store and retrieve individual state.
+        #The profile parameter names a JSON file describing a (large) array
+        #to populate a new state file with.  With memory=yes the state is
+        #kept in memory and saved to the state file at unregister and, with
+        #snapshot_interval, every that many seconds.  A statefile of
+        #':memory:' is never saved.
         qp = uri_parse(uri)
-        if 'parameters' in qp and 'statefile' in qp['parameters'] \
-                and qp['parameters']['statefile'] is not None:
-            self.sim_array = SimArray(qp['parameters']['statefile'], timeout)
-        else:
-            self.sim_array = SimArray(None, timeout)
+        parameters = qp.get('parameters') or {}
+        try:
+            snapshot_interval = float(
+                parameters.get('snapshot_interval') or 0)
+        except ValueError:
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                           "snapshot_interval must be a number of seconds")
+        self.sim_array = SimArray(
+            parameters.get('statefile'), timeout, parameters.get('profile'),
+            parameters.get('memory') in ('yes', 'true', '1'),
+            snapshot_interval)
 
         return None
 
     def plugin_unregister(self, flags=0):
-        pass
+        self.sim_array.snapshot_save()
 
     def job_status(self, job_id, flags=0):
         return self.sim_array.job_status(job_id, flags)
 
+    def jobs_status(self, job_ids, flags=0):
+        return self.sim_array.jobs_status(job_ids, flags)
+
     def job_free(self, job_id, flags=0):
         return self.sim_array.job_free(job_id, flags)
 
@@ -76,15 +97,7 @@ def time_out_get(self, flags=0):
     def capabilities(self, system, flags=0):
         rc = Capabilities()
         rc.enable_all()
-        rc.set(Capabilities.POOLS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.VOLUMES_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.DISKS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.FS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.ACCESS_GROUPS_QUICK_SEARCH,
-               Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.NFS_EXPORTS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.TARGET_PORTS_QUICK_SEARCH,
-               Capabilities.UNSUPPORTED)
+        quick_search_set(rc, SimPlugin.QUICK_SEARCH_KEYS)
         return rc
 
     def plugin_info(self, flags=0):
@@ -95,22 +108,16 @@ def systems(self, flags=0):
         return [SimPlugin._sim_data_2_lsm(s) for s in sim_syss]
 
     def pools(self, search_key=None, search_value=None, flags=0):
-        sim_pools = self.sim_array.pools(flags)
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(p) for p in sim_pools],
-            search_key, search_value)
+        sim_pools = self.sim_array.pools(flags, search_key, search_value)
+        return [SimPlugin._sim_data_2_lsm(p) for p in sim_pools]
 
     def volumes(self, search_key=None, search_value=None, flags=0):
-        sim_vols = self.sim_array.volumes()
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(v) for v in sim_vols],
-            search_key, search_value)
+        sim_vols = self.sim_array.volumes(search_key, search_value)
+        return [SimPlugin._sim_data_2_lsm(v) for v in sim_vols]
 
     def disks(self, search_key=None, search_value=None, flags=0):
-        sim_disks = self.sim_array.disks()
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(d) for d in sim_disks],
-            search_key, search_value)
+        sim_disks = self.sim_array.disks(search_key, search_value)
+        return [SimPlugin._sim_data_2_lsm(d) for d in sim_disks]
 
     def volume_create(self, pool, volume_name, size_bytes, provisioning,
                       flags=0):
@@ -118,9 +125,18 @@ def volume_create(self, pool, volume_name, size_bytes, provisioning,
             pool.id, volume_name, size_bytes, provisioning, flags)
         return SimPlugin._sim_data_2_lsm(sim_vol)
 
+    def volume_create_many(self, pool, volume_names, size_bytes,
+                           provisioning, flags=0):
+        return self.sim_array.volume_create_many(
+            pool.id, volume_names, size_bytes, provisioning, flags)
+
     def volume_delete(self, volume, flags=0):
         return self.sim_array.volume_delete(volume.id, flags)
 
+    def volume_delete_many(self, volumes, flags=0):
+        return self.sim_array.volume_delete_many(
+            [v.id for v in volumes], flags)
+
     def volume_resize(self, volume, new_size_bytes, flags=0):
         sim_vol = self.sim_array.volume_resize(
             volume.id, new_size_bytes, flags)
@@ -182,6 +198,10 @@ def volume_mask(self, access_group, volume, flags=0):
         return self.sim_array.volume_mask(
             access_group.id, volume.id, flags)
 
+    def volume_mask_many(self, access_group, volumes, flags=0):
+        return self.sim_array.volume_mask_many(
+            access_group.id, [v.id for v in volumes], flags)
+
     def volume_unmask(self, access_group, volume, flags=0):
         return self.sim_array.volume_unmask(
             access_group.id, volume.id, flags)
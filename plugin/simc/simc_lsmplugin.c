@@ -26,6 +26,7 @@
 #include <glib.h>
 #include <assert.h>
 #include <time.h>
+#include <sys/time.h>
 #include <stdlib.h>
 #include <stdio.h>
 #include <openssl/md5.h>
@@ -132,15 +133,29 @@ struct plugin_data {
 
 struct allocated_job {
     int polls;
+    double start;       /* Creation time in seconds */
+    double duration;    /* Seconds the job runs, < 0 to finish in 3 polls */
     lsm_data_type type;
     void *return_data;
 };
 
+static double time_now(void)
+{
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1000000.0;
+}
+
 struct allocated_job *alloc_allocated_job( lsm_data_type type, void *return_data )
 {
     struct allocated_job *rc = malloc( sizeof(struct allocated_job) );
     if( rc ) {
+        /* Same job duration as the python simulator when set */
+        const char *sim_time = getenv("LSM_SIM_TIME");
+
         rc->polls = 0;
+        rc->start = time_now();
+        rc->duration = sim_time ? strtod(sim_time, NULL) : -1;
         rc->type = type;
         rc->return_data = return_data;
     }
@@ -392,6 +407,9 @@ static int cap(lsm_plugin_ptr c, lsm_system *system,
             LSM_CAP_EXPORT_FS,
             LSM_CAP_EXPORT_REMOVE,
             LSM_CAP_VOLUME_RAID_INFO,
+            LSM_CAP_VOLUME_THIN,
+            LSM_CAP_DISKS,
+            LSM_CAP_TARGET_PORTS,
             -1
             );
 
@@ -417,7 +435,14 @@ static int job_status(lsm_plugin_ptr c, const char *job_id,
         if( val ) {
             *status = LSM_JOB_INPROGRESS;
 
-            val->polls += 34;
+            if( val->duration < 0 ) {
+                val->polls += 34;
+            } else if( val->duration > 0 ) {
+                val->polls = (int)((time_now() - val->start) * 100 /
+                                    val->duration);
+            } else {
+                val->polls = 100;
+            }
 
             if( (val->polls) >= 100 ) {
                 *t = val->type;
@@ -707,18 +732,8 @@ static struct allocated_volume *find_volume(struct plugin_data *pd,
 static struct allocated_volume * find_volume_name(struct plugin_data *pd,
         const char *name)
 {
-    struct allocated_volume *found = NULL;
-    char *k = NULL;
-    struct allocated_volume *vol;
-    GHashTableIter iter;
-    g_hash_table_iter_init(&iter, pd->volumes);
-    while(g_hash_table_iter_next(&iter,(gpointer) &k,(gpointer)&vol)) {
-        if( strcmp(lsm_volume_name_get(vol->v), name) == 0 ) {
-            found = vol;
-            break;
-        }
-    }
-    return found;
+    /* Volume ids are the md5 of the name, no need to scan the volumes */
+    return find_volume(pd, md5(name));
 }
 
 static int volume_create(lsm_plugin_ptr c, lsm_pool *pool,
@@ -741,7 +756,8 @@ static int volume_create(lsm_plugin_ptr c, lsm_pool *pool,
 
                 lsm_volume *v = lsm_volume_record_alloc(id, volume_name,
                                    "60a980003246694a412b45673342616e",
-                                    BS, allocated_size/BS, 0, sys_id,
+                                    BS, allocated_size/BS,
+                                    LSM_VOLUME_ADMIN_STATE_ENABLED, sys_id,
                                     lsm_pool_id_get(pool), NULL);
 
                 lsm_volume *to_store = lsm_volume_record_copy(v);
@@ -869,7 +885,9 @@ static int volume_resize(lsm_plugin_ptr c, lsm_volume *volume,
                                                     lsm_volume_name_get(v),
                                                     lsm_volume_vpd83_get(v),
                                                     lsm_volume_block_size_get(v),
-                                                    resized_size/BS, 0, sys_id,
+                                                    resized_size/BS,
+                                                    lsm_volume_admin_state_get(v),
+                                                    sys_id,
                                                     lsm_volume_pool_id_get(volume), NULL);
 
             if( vp ) {
@@ -984,8 +1002,8 @@ static struct lsm_ops_v1_2 ops_v1_2 = {
     volume_raid_info
 };
 
-static int volume_enable_disable(lsm_plugin_ptr c, lsm_volume *v,
-                                    lsm_flag flags)
+static int volume_admin_state_set(lsm_plugin_ptr c, lsm_volume *v,
+                                    uint32_t admin_state)
 {
     int rc = LSM_ERR_OK;
     struct plugin_data *pd = (struct plugin_data*)lsm_private_data_get(c);
@@ -994,10 +1012,39 @@ static int volume_enable_disable(lsm_plugin_ptr c, lsm_volume *v,
     if( !av) {
         rc = lsm_log_error_basic(c, LSM_ERR_NOT_FOUND_VOLUME,
                                     "volume not found!");
+    } else if( lsm_volume_admin_state_get(av->v) == admin_state ) {
+        rc = lsm_log_error_basic(c, LSM_ERR_NO_STATE_CHANGE,
+                                    "Volume admin state is identical to "
+                                    "requested");
+    } else {
+        lsm_volume *vp = lsm_volume_record_alloc(lsm_volume_id_get(av->v),
+                                            lsm_volume_name_get(av->v),
+                                            lsm_volume_vpd83_get(av->v),
+                                            lsm_volume_block_size_get(av->v),
+                                            lsm_volume_number_of_blocks_get(av->v),
+                                            admin_state, sys_id,
+                                            lsm_volume_pool_id_get(av->v),
+                                            NULL);
+        if( vp ) {
+            lsm_volume_record_free(av->v);
+            av->v = vp;
+        } else {
+            rc = lsm_log_error_basic(c, LSM_ERR_NO_MEMORY, "ENOMEM");
+        }
     }
     return rc;
 }
 
+static int volume_enable(lsm_plugin_ptr c, lsm_volume *v, lsm_flag flags)
+{
+    return volume_admin_state_set(c, v, LSM_VOLUME_ADMIN_STATE_ENABLED);
+}
+
+static int volume_disable(lsm_plugin_ptr c, lsm_volume *v, lsm_flag flags)
+{
+    return volume_admin_state_set(c, v, LSM_VOLUME_ADMIN_STATE_DISABLED);
+}
+
 static int access_group_list(lsm_plugin_ptr c,
                                 const char *search_key,
                                 const char *search_value,
@@ -1538,8 +1585,8 @@ static struct lsm_san_ops_v1 san_ops = {
     volume_replicate_range,
     volume_resize,
     volume_delete,
-    volume_enable_disable,
-    volume_enable_disable,
+    volume_enable,
+    volume_disable,
     iscsi_chap_auth,
     access_group_list,
     access_group_create,
@@ -38,7 +38,8 @@
                  VERSION, TargetPort,
                  search_property)
 
-from utils import (merge_list, handle_cim_errors, hex_string_format)
+from utils import (merge_list, handle_cim_errors, hex_string_format,
+                   cim_path_key)
 
 from smis_common import SmisCommon
 
@@ -112,6 +113,9 @@ class Smis(IStorageAreaNetwork):
         smis_vol.volume_create_error_handler,
     }
 
+    # Above this many SPCs, look up their initiator masking groups in bulk
+    _SPC_BULK_MIN = 2
+
     def __init__(self):
         self._c = None
         self.tmo = 0
@@ -159,9 +163,29 @@ def plugin_register(self, uri, password, timeout, flags=0):
         if 'debug_path' in u['parameters']:
             debug_path = u['parameters']['debug_path']
 
+        discovery_cache_ttl = None
+        if 'discovery_cache_ttl' in u['parameters']:
+            try:
+                discovery_cache_ttl = int(
+                    u['parameters']['discovery_cache_ttl'])
+            except ValueError:
+                raise LsmError(
+                    ErrorNumber.INVALID_ARGUMENT,
+                    "discovery_cache_ttl should be a number of seconds")
+
+        force_rediscover = False
+        if "force_rediscover" in u["parameters"] \
+           and u["parameters"]["force_rediscover"] == 'yes':
+            force_rediscover = True
+
+        use_pull = True
+        if "pull" in u["parameters"] and u["parameters"]["pull"] == 'no':
+            use_pull = False
+
         self._c = SmisCommon(
             url, u['username'], password, namespace, no_ssl_verify,
-            debug_path, system_list)
+            debug_path, system_list, discovery_cache_ttl, force_rediscover,
+            use_pull)
 
         self.tmo = timeout
 
@@ -186,12 +210,40 @@ def capabilities(self, system, flags=0):
     def plugin_info(self, flags=0):
         return "Generic SMI-S support", VERSION
 
+    @staticmethod
+    def _cim_job_status_pros():
+        cim_job_pros = SmisCommon.cim_job_pros()
+        cim_job_pros.extend(
+            ['JobState', 'PercentComplete', 'ErrorDescription',
+             'OperationalStatus'])
+        return cim_job_pros
+
     @handle_cim_errors
     def job_status(self, job_id, flags=0):
         """
         Given a job id returns the current status as a tuple
         (status (enum), percent_complete(integer), volume (None or Volume))
         """
+        cim_job = self._c.cim_job_of_job_id(
+            job_id, Smis._cim_job_status_pros())
+        return self._job_status_of_cim_job(job_id, cim_job)
+
+    @handle_cim_errors
+    def jobs_status(self, job_ids, flags=0):
+        """
+        Given a list of job ids returns a list of the job_status() tuples,
+        enumerating CIM_ConcreteJob only once for all of them.
+        """
+        cim_jobs = self._c.cim_jobs_of_job_ids(
+            job_ids, Smis._cim_job_status_pros())
+        return [self._job_status_of_cim_job(job_id, cim_job)
+                for (job_id, cim_job) in zip(job_ids, cim_jobs)]
+
+    def _job_status_of_cim_job(self, job_id, cim_job):
+        """
+        Return the job_status() tuple of the job_id from its
+        CIM_ConcreteJob.
+        """
         completed_item = None
 
         error_handler = None
@@ -201,12 +253,6 @@ def job_status(self, job_id, flags=0):
         if retrieve_data in Smis._JOB_ERROR_HANDLER.keys():
             error_handler = Smis._JOB_ERROR_HANDLER[retrieve_data]
 
-        cim_job_pros = SmisCommon.cim_job_pros()
-        cim_job_pros.extend(
-            ['JobState', 'PercentComplete', 'ErrorDescription',
-             'OperationalStatus'])
-        cim_job = self._c.cim_job_of_job_id(job_id, cim_job_pros)
-
         job_state = cim_job['JobState']
 
         try:
@@ -344,6 +390,10 @@ def pools(self, search_key=None, search_value=None, flags=0):
         cim_sys_pros = smis_sys.cim_sys_id_pros()
         cim_syss = smis_sys.root_cim_sys(self._c, cim_sys_pros)
 
+        scc_index = None
+        if len(cim_syss) > 0:
+            scc_index = smis_pool.cim_scc_index(self._c)
+
         for cim_sys in cim_syss:
             system_id = smis_sys.sys_id_of_cim_sys(cim_sys)
             cim_pools = smis_pool.cim_pools_of_cim_sys_path(
@@ -351,7 +401,7 @@ def pools(self, search_key=None, search_value=None, flags=0):
             for cim_pool in cim_pools:
                 rc.append(
                     smis_pool.cim_pool_to_lsm_pool(
-                        self._c, cim_pool, system_id))
+                        self._c, cim_pool, system_id, scc_index))
 
         return search_property(rc, search_key, search_value)
 
@@ -571,6 +621,8 @@ def volume_delete(self, volume, flags=0):
 
         in_params = {'TheElement': cim_vol_path}
 
+        self._c.cache_invalidate(smis_pool.CACHE_KEY_VOL_POOL_IDS)
+
         # Delete returns None or Job number
         return self._c.invoke_method(
             'ReturnToStoragePool', cim_scs.path, in_params)[0]
@@ -755,7 +807,9 @@ def _cim_tgt_mg_path_create(self, cim_sys_path, cim_gmms_path, name,
             'Type': dmtf.MASK_GROUP_TYPE_TGT}
 
         if init_type == AccessGroup.INIT_TYPE_WWPN:
-            cim_fc_tgts = self._cim_fc_tgt_of(cim_sys_path)
+            # Not converted while the pull operation is open, as
+            # _cim_pep_path_of_fc_tgt() queries the provider
+            cim_fc_tgts = list(self._cim_fc_tgt_of(cim_sys_path))
             all_cim_fc_peps_path = []
             all_cim_fc_peps_path.extend(
                 [self._cim_pep_path_of_fc_tgt(x.path) for x in cim_fc_tgts])
@@ -1159,8 +1213,9 @@ def volumes_accessible_by_access_group(self, access_group, flags=0):
             cim_vols = smis_ag.cim_vols_masked_to_cim_spc_path(
                 self._c, cim_spc_path, cim_vol_pros)
         rc = []
-        for cim_vol in cim_vols:
-            pool_id = smis_pool.pool_id_of_cim_vol(self._c, cim_vol.path)
+        pool_ids = smis_pool.pool_ids_of_cim_vols(
+            self._c, [cim_vol.path for cim_vol in cim_vols])
+        for cim_vol, pool_id in zip(cim_vols, pool_ids):
             sys_id = smis_sys.sys_id_of_cim_vol(cim_vol)
             rc.append(
                 smis_vol.cim_vol_to_lsm_vol(cim_vol, pool_id, sys_id))
@@ -1191,18 +1246,11 @@ def access_groups_granted_to_volume(self, volume, flags=0):
             PropertyList=cim_spc_pros)
 
         if mask_type == smis_cap.MASK_TYPE_GROUP:
-            cim_init_mg_pros = smis_ag.cim_init_mg_pros()
-            for cim_spc in cim_spcs:
-                cim_init_mgs = self._c.Associators(
-                    cim_spc.path,
-                    AssocClass='CIM_AssociatedInitiatorMaskingGroup',
-                    ResultClass='CIM_InitiatorMaskingGroup',
-                    PropertyList=cim_init_mg_pros)
-                rc.extend(
-                    list(
-                        smis_ag.cim_init_mg_to_lsm_ag(
-                            self._c, x, volume.system_id)
-                        for x in cim_init_mgs))
+            for cim_init_mg in self._cim_init_mgs_of_cim_spcs(
+                    volume.system_id, cim_spcs):
+                rc.append(
+                    smis_ag.cim_init_mg_to_lsm_ag(
+                        self._c, cim_init_mg, volume.system_id))
         else:
             for cim_spc in cim_spcs:
                 if self._is_access_group(cim_spc):
@@ -1212,6 +1260,55 @@ def access_groups_granted_to_volume(self, volume, flags=0):
 
         return rc
 
+    def _cim_init_mgs_of_cim_spcs(self, system_id, cim_spcs):
+        """
+        Return the CIM_InitiatorMaskingGroup of each CIM_SCSIProtocolController
+        in cim_spcs, in the same order.
+        With more than _SPC_BULK_MIN SPCs, enumerate
+        CIM_AssociatedInitiatorMaskingGroup once and use one _cim_init_mg_of()
+        call instead of one Associators() call per SPC.
+        """
+        cim_init_mg_pros = smis_ag.cim_init_mg_pros()
+        if len(cim_spcs) > Smis._SPC_BULK_MIN:
+            try:
+                cim_aimgs = self._c.EnumerateInstances(
+                    'CIM_AssociatedInitiatorMaskingGroup',
+                    PropertyList=['Antecedent', 'Dependent'])
+                cim_init_mg_dict = dict(
+                    (cim_path_key(x.path), x)
+                    for x in self._cim_init_mg_of(
+                        system_id, cim_init_mg_pros))
+            except CIMError:
+                pass
+            else:
+                # Do not rely on which end of the association is the
+                # InitiatorMaskingGroup
+                init_mg_keys_of_spc = {}
+                for cim_aimg in cim_aimgs:
+                    init_mg_key = cim_path_key(cim_aimg['Antecedent'])
+                    spc_key = cim_path_key(cim_aimg['Dependent'])
+                    if init_mg_key not in cim_init_mg_dict:
+                        (init_mg_key, spc_key) = (spc_key, init_mg_key)
+                    init_mg_keys_of_spc.setdefault(spc_key, []).append(
+                        init_mg_key)
+                rc = []
+                for cim_spc in cim_spcs:
+                    for key in init_mg_keys_of_spc.get(
+                            cim_path_key(cim_spc.path), []):
+                        if key in cim_init_mg_dict:
+                            rc.append(cim_init_mg_dict[key])
+                return rc
+
+        rc = []
+        for cim_spc in cim_spcs:
+            rc.extend(
+                self._c.Associators(
+                    cim_spc.path,
+                    AssocClass='CIM_AssociatedInitiatorMaskingGroup',
+                    ResultClass='CIM_InitiatorMaskingGroup',
+                    PropertyList=cim_init_mg_pros))
+        return rc
+
     def _cim_init_mg_of(self, system_id, property_list=None):
         """
         We use this association to get all CIM_InitiatorMaskingGroup:
@@ -1469,8 +1566,9 @@ def disks(self, search_key=None, search_value=None, flags=0):
                               SmisCommon.SMIS_SPEC_VER_1_4,
                               raise_error=True)
         cim_disk_pros = smis_disk.cim_disk_pros()
-        cim_disks = self._c.EnumerateInstances(
-            'CIM_DiskDrive', PropertyList=cim_disk_pros)
+        # cim_disk_to_lsm_disk() queries the provider for each disk
+        cim_disks = self._c.IterEnumerateInstances(
+            'CIM_DiskDrive', slow=True, PropertyList=cim_disk_pros)
         for cim_disk in cim_disks:
             if self._c.system_list and \
                smis_disk.sys_id_of_cim_disk(cim_disk) not in \
@@ -1493,10 +1591,9 @@ def _is_frontend_fc_tgt(cim_fc_tgt):
 
     def _cim_fc_tgt_of(self, cim_sys_path, property_list=None):
         """
-        Get all CIM_FCPort (frontend only) from CIM_ComputerSystem and its
+        Yield all CIM_FCPort (frontend only) from CIM_ComputerSystem and its
         leaf CIM_ComputerSystem
         """
-        rc = []
         if property_list is None:
             property_list = ['UsageRestriction']
         else:
@@ -1506,15 +1603,14 @@ def _cim_fc_tgt_of(self, cim_sys_path, property_list=None):
             all_cim_syss_path.extend(
                 self._leaf_cim_syss_path_of(cim_sys_path))
         for cur_cim_sys_path in all_cim_syss_path:
-            cur_cim_fc_tgts = self._c.Associators(
+            cur_cim_fc_tgts = self._c.IterAssociatorInstances(
                 cur_cim_sys_path,
                 AssocClass='CIM_SystemDevice',
                 ResultClass='CIM_FCPort',
                 PropertyList=property_list)
             for cim_fc_tgt in cur_cim_fc_tgts:
                 if Smis._is_frontend_fc_tgt(cim_fc_tgt):
-                    rc.extend([cim_fc_tgt])
-        return rc
+                    yield cim_fc_tgt
 
     @staticmethod
     def _cim_fc_tgt_to_lsm(cim_fc_tgt, system_id):
@@ -1561,12 +1657,12 @@ def _iscsi_node_names_of(self, cim_iscsi_pg_path):
             return []
         return [n['Name'] for n in  cim_iscsi_nodes]
 
-    def _cim_iscsi_pg_of(self, cim_sys_path, property_list=None):
+    def _cim_iscsi_pg_of(self, cim_sys_path, property_list=None, slow=False):
         """
-        Get all CIM_iSCSIProtocolEndpoint(Target only) from CIM_ComputerSystem
-        and its leaf CIM_ComputerSystem
+        Yield all CIM_iSCSIProtocolEndpoint(Target only) from
+        CIM_ComputerSystem and its leaf CIM_ComputerSystem.
+        Set slow if the caller queries the provider about each of them.
         """
-        rc = []
         if property_list is None:
             property_list = ['Role']
         else:
@@ -1576,15 +1672,14 @@ def _cim_iscsi_pg_of(self, cim_sys_path, property_list=None):
             all_cim_syss_path.extend(
                 self._leaf_cim_syss_path_of(cim_sys_path))
         for cur_cim_sys_path in all_cim_syss_path:
-            cur_cim_iscsi_pgs = self._c.Associators(
-                cur_cim_sys_path,
+            cur_cim_iscsi_pgs = self._c.IterAssociatorInstances(
+                cur_cim_sys_path, slow=slow,
                 AssocClass='CIM_HostedAccessPoint',
                 ResultClass='CIM_iSCSIProtocolEndpoint',
                 PropertyList=property_list)
             for cim_iscsi_pg in cur_cim_iscsi_pgs:
                 if cim_iscsi_pg['Role'] == dmtf.ISCSI_TGT_ROLE_TARGET:
-                    rc.extend([cim_iscsi_pg])
-        return rc
+                    yield cim_iscsi_pg
 
     def _cim_iscsi_pg_to_lsm(self, cim_iscsi_pg, system_id):
         """
@@ -1803,7 +1898,9 @@ def target_ports(self, search_key=None, search_value=None, flags=0):
                         for x in cim_fc_tgts))
 
             if flag_iscsi_support:
-                cim_iscsi_pgs = self._cim_iscsi_pg_of(cim_sys.path)
+                # _cim_iscsi_pg_to_lsm() queries the provider for each
+                cim_iscsi_pgs = self._cim_iscsi_pg_of(cim_sys.path,
+                                                      slow=True)
                 for cim_iscsi_pg in cim_iscsi_pgs:
                     rc.extend(
                         self._cim_iscsi_pg_to_lsm(cim_iscsi_pg, system_id))
@@ -29,10 +29,19 @@
 import datetime
 import time
 import sys
+import json
+import stat
+import tempfile
 
 import dmtf
 from lsm import LsmError, ErrorNumber, md5
-from utils import (merge_list)
+from utils import (merge_list, cim_path_to_path_str, path_str_to_cim_path)
+
+
+_CIM_RP_PROS = ['RegisteredName', 'RegisteredVersion',
+                'RegisteredOrganization', 'ElementName']
+
+_DISCOVERY_CACHE_VERSION = 1
 
 
 def _profile_register_load(wbem_conn):
@@ -58,8 +67,7 @@ def _profile_register_load(wbem_conn):
             cim_rps = wbem_conn.EnumerateInstances(
                 'CIM_RegisteredProfile',
                 namespace=namespace,
-                PropertyList=['RegisteredName', 'RegisteredVersion',
-                              'RegisteredOrganization'],
+                PropertyList=_CIM_RP_PROS,
                 LocalOnly=False)
         except CIMError as e:
             if e[0] == pywbem.CIM_ERR_NOT_SUPPORTED or \
@@ -96,6 +104,77 @@ def _profile_register_load(wbem_conn):
     return profile_dict, root_blk_cim_rp
 
 
+def _cim_rp_fingerprint(cim_rp):
+    """
+    Return the properties of the root CIM_RegisteredProfile which tell
+    whether the provider behind a cached discovery has changed.
+    """
+    element_name = None
+    if 'ElementName' in cim_rp.keys():
+        element_name = cim_rp['ElementName']
+    return [cim_rp['RegisteredVersion'], element_name]
+
+
+def _discovery_cache_dir_ok(cache_dir):
+    """
+    Create cache_dir if needed. Return True only if it is a directory owned
+    by us which no one else can write to, as what we read back from it is
+    trusted.
+    """
+    try:
+        if not os.path.lexists(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        st = os.lstat(cache_dir)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and \
+        not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _discovery_cache_load(cache_file, ttl):
+    """
+    Return the discovery data stored by _discovery_cache_save() or None if
+    there is none, it is older than ttl seconds or the cache directory is
+    not safe to use.
+    """
+    if not _discovery_cache_dir_ok(os.path.dirname(cache_file)):
+        return None
+    try:
+        with open(cache_file) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(data, dict) or \
+       data.get('version') != _DISCOVERY_CACHE_VERSION or \
+       not 0 <= time.time() - data.get('time', 0) <= ttl:
+        return None
+    return data
+
+
+def _discovery_cache_save(cache_file, data):
+    """
+    Write the discovery data to cache_file, failing silently as the cache
+    only saves time.
+    """
+    data['version'] = _DISCOVERY_CACHE_VERSION
+    cache_dir = os.path.dirname(cache_file)
+    if not _discovery_cache_dir_ok(cache_dir):
+        return
+    tmp_file = None
+    try:
+        (fd, tmp_file) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        # Rename so that concurrent plugins never read half a file
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError, TypeError, ValueError):
+        if tmp_file is not None:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+
+
 def _profile_check(profile_dict, profile_name, spec_ver,
                    raise_error=False):
     """
@@ -188,15 +267,43 @@ class SmisCommon(object):
     _INVOKE_MAX_LOOP_COUNT = 60
     _INVOKE_CHECK_INTERVAL = 5
 
+    # Profile register and vendor namespace discovery is cached on disk, per
+    # provider url, user and namespace, for this many seconds. The default
+    # directory sits next to the lsmd socket directory, which only the
+    # daemon user can write to.
+    DISCOVERY_CACHE_TTL = 3600
+    DISCOVERY_CACHE_DIR = os.getenv(
+        "LSM_SMISPY_CACHE_DIR",
+        os.path.join(
+            os.path.dirname(os.getenv("LSM_UDS_PATH", "/var/run/lsm/ipc")),
+            'smispy_cache'))
+
+    # Pull operations fetch this many instances per request, and the
+    # provider may drop an open enumeration idle for this many seconds.
+    PULL_MAX_OBJECT_COUNT = 500
+    PULL_OPERATION_TIMEOUT = 60
+    # The same for listings which query the provider about each instance
+    # while the enumeration is open: small batches, so the enumeration stays
+    # idle for a few queries only, and a longer timeout.
+    PULL_SLOW_MAX_OBJECT_COUNT = 32
+    PULL_SLOW_OPERATION_TIMEOUT = 300
+
     def __init__(self, url, username, password,
                  namespace=dmtf.DEFAULT_NAMESPACE,
-                 no_ssl_verify=False, debug_path=None, system_list=None):
+                 no_ssl_verify=False, debug_path=None, system_list=None,
+                 discovery_cache_ttl=None, force_rediscover=False,
+                 use_pull=True):
         self._wbem_conn = None
         self._profile_dict = {}
         self.root_blk_cim_rp = None    # For root_cim_
+        self._vendor_ns = None
         self._vendor_product = None     # For vendor workaround codes.
         self.system_list = system_list
         self._debug_path = debug_path
+        self._cache_file = None
+        self._cache_data = None
+        self._session_cache = {}
+        self._use_pull = use_pull
 
         if namespace is None:
             namespace = dmtf.DEFAULT_NAMESPACE
@@ -216,6 +323,10 @@ def __init__(self, url, username, password,
         if debug_path is not None:
             self._wbem_conn.debug = True
 
+        # Pull operations need pywbem 0.9 or later
+        if not hasattr(self._wbem_conn, 'OpenEnumerateInstances'):
+            self._use_pull = False
+
         if namespace.lower() == SmisCommon._MEGARAID_NAMESPACE.lower():
         # Skip profile register check on MegaRAID for better performance.
         # MegaRAID SMI-S profile support status will not change for a while.
@@ -228,8 +339,11 @@ def __init__(self, url, username, password,
             }
             self._vendor_product = SmisCommon._PRODUCT_MEGARAID
         else:
-            (self._profile_dict, self.root_blk_cim_rp) = \
-                _profile_register_load(self._wbem_conn)
+            if discovery_cache_ttl is None:
+                discovery_cache_ttl = SmisCommon.DISCOVERY_CACHE_TTL
+            self._discovery_load(
+                url, username, namespace, discovery_cache_ttl,
+                force_rediscover)
 
         if namespace.lower() == SmisCommon._NETAPP_E_NAMESPACE.lower():
             self._vendor_product = SmisCommon._PRODUCT_NETAPP_E
@@ -269,7 +383,67 @@ def profile_check(self, profile_name, spec_ver, raise_error=False):
         return _profile_check(
             self._profile_dict, profile_name, spec_ver, raise_error)
 
+    def _discovery_load(self, url, username, namespace, ttl,
+                        force_rediscover):
+        """
+        Set self._profile_dict and self.root_blk_cim_rp from the discovery
+        cache, or by checking the provider when the cache is disabled
+        (ttl <= 0), expired, forced out or stale.
+        A cached discovery is only used when the root CIM_RegisteredProfile
+        it points to still exists with the same version and name.
+        """
+        if ttl <= 0:
+            (self._profile_dict, self.root_blk_cim_rp) = \
+                _profile_register_load(self._wbem_conn)
+            return
+
+        self._cache_file = os.path.join(
+            SmisCommon.DISCOVERY_CACHE_DIR,
+            md5("%s %s %s" % (url, username, namespace)))
+
+        data = None
+        if not force_rediscover:
+            data = _discovery_cache_load(self._cache_file, ttl)
+        if data is not None:
+            try:
+                cim_rp = self._wbem_conn.GetInstance(
+                    path_str_to_cim_path(data['root_blk_cim_rp']),
+                    PropertyList=_CIM_RP_PROS, LocalOnly=False)
+                if _cim_rp_fingerprint(cim_rp) == data['fingerprint']:
+                    self._profile_dict = dict(data['profile_dict'])
+                    self.root_blk_cim_rp = cim_rp
+                    self._vendor_ns = data.get('vendor_namespace')
+                    self._cache_data = data
+                    return
+            except (CIMError, KeyError, TypeError, ValueError):
+                pass
+
+        (self._profile_dict, self.root_blk_cim_rp) = \
+            _profile_register_load(self._wbem_conn)
+        if self.root_blk_cim_rp is None:
+            return
+        # Like _discovery_cache_save(), failing to build the cache entry
+        # only means no cache.
+        keybindings = self.root_blk_cim_rp.path.keybindings
+        if not all(isinstance(value, basestring)
+                   for value in keybindings.values()):
+            return
+        try:
+            self._cache_data = {
+                'time': time.time(),
+                'profile_dict': dict(self._profile_dict),
+                'root_blk_cim_rp': cim_path_to_path_str(
+                    self.root_blk_cim_rp.path),
+                'fingerprint': _cim_rp_fingerprint(self.root_blk_cim_rp),
+            }
+        except (KeyError, TypeError, ValueError):
+            self._cache_data = None
+            return
+        _discovery_cache_save(self._cache_file, self._cache_data)
+
     def _vendor_namespace(self):
+        if self._vendor_ns is not None:
+            return self._vendor_ns
         if self.root_blk_cim_rp:
             cim_syss_path = self._wbem_conn.AssociatorNames(
                 self.root_blk_cim_rp.path,
@@ -281,7 +455,11 @@ def _vendor_namespace(self):
                     "Target SMI-S provider does not support any "
                     "CIM_ComputerSystem for SNIA SMI-S '%s' profile" %
                     SmisCommon.SNIA_BLK_ROOT_PROFILE)
-            return cim_syss_path[0].namespace
+            self._vendor_ns = cim_syss_path[0].namespace
+            if self._cache_data is not None:
+                self._cache_data['vendor_namespace'] = self._vendor_ns
+                _discovery_cache_save(self._cache_file, self._cache_data)
+            return self._vendor_ns
         else:
             raise LsmError(
                 ErrorNumber.PLUGIN_BUG,
@@ -303,6 +481,84 @@ def EnumerateInstanceNames(self, ClassName, namespace=None, **params):
         return self._wbem_conn.EnumerateInstanceNames(
             ClassName, namespace, **params)
 
+    def _pull_instances(self, context, eos, instances, max_object_count):
+        """
+        Yield instances, then the instances of each PullInstancesWithPath()
+        of max_object_count instances until the end of the enumeration. The
+        enumeration is closed if the caller stops early.
+        """
+        try:
+            while True:
+                for instance in instances:
+                    yield instance
+                if eos:
+                    return
+                (instances, eos, context) = \
+                    self._wbem_conn.PullInstancesWithPath(
+                        context, max_object_count)
+        finally:
+            if not eos:
+                try:
+                    self._wbem_conn.CloseEnumeration(context)
+                except CIMError:
+                    pass
+
+    def _pull(self, open_method, fallback_method, slow, *args, **params):
+        """
+        Return an iterator of the instances of open_method, a DMTF pull
+        operation, which only holds PULL_MAX_OBJECT_COUNT instances at a
+        time.
+        If open_method fails, use fallback_method, the matching non-pull
+        operation, instead. When the provider does not support pull
+        operations, do so for the rest of this session.
+        The enumeration is dropped if it is idle for PULL_OPERATION_TIMEOUT.
+        Callers which query the provider about each instance while iterating
+        should set slow, to pull PULL_SLOW_MAX_OBJECT_COUNT instances at a
+        time with PULL_SLOW_OPERATION_TIMEOUT instead.
+        """
+        if self._use_pull:
+            max_object_count = SmisCommon.PULL_MAX_OBJECT_COUNT
+            operation_timeout = SmisCommon.PULL_OPERATION_TIMEOUT
+            if slow:
+                max_object_count = SmisCommon.PULL_SLOW_MAX_OBJECT_COUNT
+                operation_timeout = SmisCommon.PULL_SLOW_OPERATION_TIMEOUT
+            try:
+                (instances, eos, context) = open_method(
+                    *args,
+                    MaxObjectCount=max_object_count,
+                    OperationTimeout=pywbem.Uint32(operation_timeout),
+                    **params)
+                return self._pull_instances(
+                    context, eos, instances, max_object_count)
+            except CIMError as e:
+                if e[0] == pywbem.CIM_ERR_NOT_SUPPORTED or \
+                   e[0] == pywbem.CIM_ERR_FAILED:
+                    self._use_pull = False
+        return iter(fallback_method(*args, **params))
+
+    def IterEnumerateInstances(self, ClassName, namespace=None, slow=False,
+                               **params):
+        """
+        Like EnumerateInstances(), but return an iterator which uses pull
+        operations when the provider supports them, so that large results
+        are never held in memory at once.  See _pull() for slow.
+        """
+        if self._wbem_conn.default_namespace in dmtf.INTEROP_NAMESPACES:
+            # We have to enumerate in vendor namespace
+            self._wbem_conn.default_namespace = self._vendor_namespace()
+        return self._pull(
+            self._wbem_conn.OpenEnumerateInstances, self.EnumerateInstances,
+            slow, ClassName, namespace, **params)
+
+    def IterAssociatorInstances(self, InstanceName, slow=False, **params):
+        """
+        Like Associators(), but return an iterator which uses pull
+        operations when the provider supports them.  See _pull() for slow.
+        """
+        return self._pull(
+            self._wbem_conn.OpenAssociatorInstances, self.Associators,
+            slow, InstanceName, **params)
+
     def Associators(self, ObjectName, **params):
         return self._wbem_conn.Associators(ObjectName, **params)
 
@@ -333,6 +589,13 @@ def cim_job_of_job_id(self, job_id, property_list=None):
         """
         Return CIM_ConcreteJob for given job_id.
         """
+        return self.cim_jobs_of_job_ids([job_id], property_list)[0]
+
+    def cim_jobs_of_job_ids(self, job_ids, property_list=None):
+        """
+        Return a list of CIM_ConcreteJob, one for each of job_ids, using a
+        single enumeration of CIM_ConcreteJob.
+        """
         if property_list is None:
             property_list = SmisCommon.cim_job_pros()
         else:
@@ -342,14 +605,18 @@ def cim_job_of_job_id(self, job_id, property_list=None):
         cim_jobs = self.EnumerateInstances(
             'CIM_ConcreteJob',
             PropertyList=property_list)
-        real_job_id = SmisCommon.parse_job_id(job_id)[0]
-        for cim_job in cim_jobs:
-            if md5(cim_job['InstanceID']) == real_job_id:
-                return cim_job
+        cim_job_dict = dict(
+            (md5(cim_job['InstanceID']), cim_job) for cim_job in cim_jobs)
 
-        raise LsmError(
-            ErrorNumber.NOT_FOUND_JOB,
-            "Job %s not found" % job_id)
+        rc = []
+        for job_id in job_ids:
+            real_job_id = SmisCommon.parse_job_id(job_id)[0]
+            if real_job_id not in cim_job_dict:
+                raise LsmError(
+                    ErrorNumber.NOT_FOUND_JOB,
+                    "Job %s not found" % job_id)
+            rc.append(cim_job_dict[real_job_id])
+        return rc
 
     @staticmethod
     def _job_id_of_cim_job(cim_job, retrieve_data, method_data):
@@ -406,6 +673,35 @@ def _dump_wbem_xml(self, file_prefix):
             # data when we are most likely already in a bad spot
             pass
 
+    def cached(self, key, func):
+        """
+        Return func() from the session cache, only calling it the first time
+        a key is requested or after cache_invalidate().
+        Used for instances which do not change while the plugin is
+        connected, like services and root systems.
+        """
+        if key not in self._session_cache:
+            self._session_cache[key] = func()
+        return self._session_cache[key]
+
+    def cache_invalidate(self, key=None):
+        """
+        Drop key, or everything when key is None, from the session cache.
+        """
+        if key is None:
+            self._session_cache = {}
+        else:
+            self._session_cache.pop(key, None)
+
+    def _invoke(self, cmd, cim_path, in_params):
+        try:
+            return self._wbem_conn.InvokeMethod(cmd, cim_path, **in_params)
+        except CIMError as e:
+            if e[0] == pywbem.CIM_ERR_NOT_FOUND:
+                # cim_path might be a cached service which is gone
+                self.cache_invalidate()
+            raise
+
     def invoke_method(self, cmd, cim_path, in_params, out_handler=None,
                       error_handler=None, retrieve_data=None,
                       method_data=None):
@@ -437,8 +733,7 @@ def invoke_method(self, cmd, cim_path, in_params, out_handler=None,
         if retrieve_data is None:
             retrieve_data = SmisCommon.JOB_RETRIEVE_NONE
         try:
-            (rc, out) = self._wbem_conn.InvokeMethod(
-                cmd, cim_path, **in_params)
+            (rc, out) = self._invoke(cmd, cim_path, in_params)
 
             # Check to see if operation is done
             if rc == SmisCommon.SNIA_INVOKE_OK:
@@ -484,7 +779,7 @@ def invoke_method_wait(self, cmd, cim_path, in_params,
             CIMInstanceName # expect_class
         If flag_out_array is True, return the first element of out[out_key].
         """
-        (rc, out) = self._wbem_conn.InvokeMethod(cmd, cim_path, **in_params)
+        (rc, out) = self._invoke(cmd, cim_path, in_params)
 
         try:
             if rc == SmisCommon.SNIA_INVOKE_OK:
@@ -569,16 +864,27 @@ def invoke_method_wait(self, cmd, cim_path, in_params,
             self._dump_wbem_xml(cmd)
             raise exc_info[0], exc_info[1], exc_info[2]
 
-    def _cim_srv_of_sys_id(self, srv_name, sys_id, raise_error):
-        property_list = ['SystemName']
+    def _cim_srvs_of_srv_name(self, srv_name):
+        """
+        Return a dictionary of the first srv_name instance of each system:
+            {
+                # sys_id: CIMInstance
+            }
+        """
+        cim_srvs = self.EnumerateInstances(
+            srv_name,
+            PropertyList=['SystemName'])
+        rc = {}
+        for cim_srv in cim_srvs:
+            rc.setdefault(cim_srv['SystemName'], cim_srv)
+        return rc
 
+    def _cim_srv_of_sys_id(self, srv_name, sys_id, raise_error):
         try:
-            cim_srvs = self.EnumerateInstances(
-                srv_name,
-                PropertyList=property_list)
-            for cim_srv in cim_srvs:
-                if cim_srv['SystemName'] == sys_id:
-                    return cim_srv
+            cim_srv_dict = self.cached(
+                srv_name, lambda: self._cim_srvs_of_srv_name(srv_name))
+            if sys_id in cim_srv_dict:
+                return cim_srv_dict[sys_id]
         except CIMError:
             if raise_error:
                 raise
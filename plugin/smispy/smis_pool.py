@@ -15,7 +15,9 @@
 #
 # Author: Gris Ge <fge@redhat.com>
 
-from utils import merge_list, path_str_to_cim_path, cim_path_to_path_str
+from pywbem import CIMError
+from utils import (merge_list, path_str_to_cim_path, cim_path_to_path_str,
+                   cim_path_key)
 import dmtf
 from lsm import LsmError, ErrorNumber, Pool
 
@@ -111,12 +113,58 @@ def cim_pool_pros():
     return pool_pros
 
 
-def _pool_element_type(smis_common, cim_pool):
+_CIM_SCC_PROS = ['SupportedStorageElementFeatures',
+                 'SupportedStorageElementTypes']
+
+
+def cim_scc_index(smis_common):
+    """
+    Return a dictionary of the CIM_StorageConfigurationCapabilities of each
+    element:
+        {
+            cim_path_key(element_path): [cim_scc, ...]
+        }
+    Built from one enumeration of CIM_StorageConfigurationCapabilities and
+    one of CIM_ElementCapabilities, instead of one Associators() call per
+    pool in _pool_element_type().
+    Return None for MegaRAID, which does not need it, or when the provider
+    rejects these enumerations. cim_pool_to_lsm_pool() will then query
+    each pool.
+    """
+    if smis_common.is_megaraid():
+        return None
+    try:
+        cim_sccs = smis_common.EnumerateInstances(
+            'CIM_StorageConfigurationCapabilities',
+            PropertyList=_CIM_SCC_PROS)
+        cim_ecs = smis_common.EnumerateInstances(
+            'CIM_ElementCapabilities',
+            PropertyList=['ManagedElement', 'Capabilities'])
+    except CIMError:
+        return None
+
+    cim_scc_dict = dict(
+        (cim_path_key(cim_scc.path), cim_scc) for cim_scc in cim_sccs)
+    rc = {}
+    for cim_ec in cim_ecs:
+        scc_key = cim_path_key(cim_ec['Capabilities'])
+        if scc_key in cim_scc_dict:
+            rc.setdefault(cim_path_key(cim_ec['ManagedElement']), []).append(
+                cim_scc_dict[scc_key])
+    if len(rc) == 0:
+        # Some providers do not enumerate association instances, checking
+        # each pool is safer than treating them all as having no capability.
+        return None
+    return rc
+
+
+def _pool_element_type(smis_common, cim_pool, scc_index=None):
     """
     Return a set (Pool.element_type, Pool.unsupported)
     Using CIM_StorageConfigurationCapabilities
     'SupportedStorageElementFeatures' and 'SupportedStorageElementTypes'
-    property.
+    property, looked up in scc_index from cim_scc_index() if provided.
+    Pools missing from scc_index are queried with Associators().
     For MegaRAID, just return (Pool.ELEMENT_TYPE_VOLUME, 0)
     """
     if smis_common.is_megaraid():
@@ -126,12 +174,17 @@ def _pool_element_type(smis_common, cim_pool):
     unsupported = 0
 
     # check whether current pool support create volume or not.
-    cim_sccs = smis_common.Associators(
-        cim_pool.path,
-        AssocClass='CIM_ElementCapabilities',
-        ResultClass='CIM_StorageConfigurationCapabilities',
-        PropertyList=['SupportedStorageElementFeatures',
-                      'SupportedStorageElementTypes'])
+    cim_sccs = None
+    if scc_index is not None:
+        cim_sccs = scc_index.get(cim_path_key(cim_pool.path))
+    if cim_sccs is None:
+        # Not in the index, the provider might not link every pool through
+        # CIM_ElementCapabilities, ask about this pool directly.
+        cim_sccs = smis_common.Associators(
+            cim_pool.path,
+            AssocClass='CIM_ElementCapabilities',
+            ResultClass='CIM_StorageConfigurationCapabilities',
+            PropertyList=_CIM_SCC_PROS)
     # Associate StorageConfigurationCapabilities to StoragePool
     # is experimental in SNIA 1.6rev4, Block Book PDF Page 68.
     # Section 5.1.6 StoragePool, StorageVolume and LogicalDisk
@@ -201,10 +254,12 @@ def _pool_status_of_cim_pool(dmtf_op_status_list):
         Pool.STATUS_UNKNOWN, Pool.STATUS_OTHER)
 
 
-def cim_pool_to_lsm_pool(smis_common, cim_pool, system_id):
+def cim_pool_to_lsm_pool(smis_common, cim_pool, system_id, scc_index=None):
     """
     Return a Pool object base on information of cim_pool.
     Assuming cim_pool already holding correct properties.
+    When converting many pools, pass scc_index from cim_scc_index() to save
+    one Associators() call per pool.
     """
     status_info = ''
     pool_id = pool_id_of_cim_pool(cim_pool)
@@ -222,7 +277,8 @@ def cim_pool_to_lsm_pool(smis_common, cim_pool, system_id):
         (status, status_info) = _pool_status_of_cim_pool(
             cim_pool['OperationalStatus'])
 
-    element_type, unsupported = _pool_element_type(smis_common, cim_pool)
+    element_type, unsupported = _pool_element_type(
+        smis_common, cim_pool, scc_index)
 
     plugin_data = cim_path_to_path_str(cim_pool.path)
 
@@ -249,6 +305,77 @@ def lsm_pool_to_cim_pool_path(smis_common, lsm_pool):
     return path_str_to_cim_path(lsm_pool.plugin_data)
 
 
+# smis_common.cached() key of the volume to pool id dictionary
+CACHE_KEY_VOL_POOL_IDS = 'vol_pool_ids'
+
+
+def _vol_pool_id_index(smis_common):
+    """
+    Return a dictionary of the pool id of each volume:
+        {
+            cim_path_key(cim_vol_path): pool_id
+        }
+    from one enumeration of CIM_AllocatedFromStoragePool, or None if the
+    provider rejects it.
+    Only Antecedents which are CIM_StoragePool with an 'InstanceID', the
+    pool id, are used, so no pool instance is needed. Volumes allocated from
+    more than one pool get None, for pool_ids_of_cim_vols() to check them
+    one by one like pool_id_of_cim_vol() always did.
+    """
+    try:
+        cim_pool_keys = set(
+            cim_path_key(cim_pool_path)
+            for cim_pool_path in smis_common.EnumerateInstanceNames(
+                'CIM_StoragePool'))
+        cim_afsps = smis_common.EnumerateInstances(
+            'CIM_AllocatedFromStoragePool',
+            PropertyList=['Antecedent', 'Dependent'])
+    except CIMError:
+        return None
+    rc = {}
+    for cim_afsp in cim_afsps:
+        cim_pool_path = cim_afsp['Antecedent']
+        if 'InstanceID' not in cim_pool_path.keybindings or \
+           cim_path_key(cim_pool_path) not in cim_pool_keys:
+            continue
+        key = cim_path_key(cim_afsp['Dependent'])
+        pool_id = cim_pool_path['InstanceID']
+        if key in rc and rc[key] != pool_id:
+            rc[key] = None
+        else:
+            rc[key] = pool_id
+    return rc
+
+
+def pool_ids_of_cim_vols(smis_common, cim_vols_path):
+    """
+    Return the lsm.Pool.id of each CIM_StorageVolume in cim_vols_path.
+    The volume to pool index is built once per session and cached through
+    smis_common.cached(). Volumes missing from it, like those created after
+    it was built, are resolved by pool_id_of_cim_vol() and then added.
+    Volumes it holds no single pool for are always resolved by
+    pool_id_of_cim_vol(), which raises PLUGIN_BUG for them.
+    Whoever deletes volumes should drop CACHE_KEY_VOL_POOL_IDS, as a new
+    volume could reuse the path of a deleted one.
+    """
+    index = smis_common.cached(
+        CACHE_KEY_VOL_POOL_IDS, lambda: _vol_pool_id_index(smis_common))
+    if index is None:
+        return [pool_id_of_cim_vol(smis_common, cim_vol_path)
+                for cim_vol_path in cim_vols_path]
+
+    rc = []
+    for cim_vol_path in cim_vols_path:
+        key = cim_path_key(cim_vol_path)
+        if key not in index:
+            index[key] = pool_id_of_cim_vol(smis_common, cim_vol_path)
+        elif index[key] is None:
+            rc.append(pool_id_of_cim_vol(smis_common, cim_vol_path))
+            continue
+        rc.append(index[key])
+    return rc
+
+
 def pool_id_of_cim_vol(smis_common, cim_vol_path):
     """
     Find out the lsm.Pool.id of CIM_StorageVolume
@@ -19,6 +19,9 @@
 import dmtf
 from lsm import System, LsmError, ErrorNumber
 
+# smis_common.cached() key of the root CIM_ComputerSystem dictionary
+_CACHE_KEY_ROOT_SYSS = 'root_cim_syss'
+
 
 def cim_sys_id_pros():
     """
@@ -139,16 +142,31 @@ def cim_sys_to_lsm_sys(cim_sys):
     return System(sys_id, sys_name, status, status_info)
 
 
+def _cim_syss_of_sys_ids(smis_common):
+    return dict(
+        (sys_id_of_cim_sys(cim_sys), cim_sys)
+        for cim_sys in root_cim_sys(smis_common, cim_sys_id_pros()))
+
+
 def cim_sys_of_sys_id(smis_common, sys_id, property_list=None):
     """
     Find out the CIM_ComputerSystem for given lsm.System.id using
     root_cim_sys()
+    Without property_list, the root systems are looked up only once per
+    session through smis_common.cached().
     """
     id_pros = cim_sys_id_pros()
     if property_list is None:
-        property_list = id_pros
-    else:
-        property_list = merge_list(property_list, id_pros)
+        cim_sys_dict = smis_common.cached(
+            _CACHE_KEY_ROOT_SYSS,
+            lambda: _cim_syss_of_sys_ids(smis_common))
+        if sys_id in cim_sys_dict:
+            return cim_sys_dict[sys_id]
+        raise LsmError(
+            ErrorNumber.NOT_FOUND_SYSTEM,
+            "Not found System")
+
+    property_list = merge_list(property_list, id_pros)
 
     cim_syss = root_cim_sys(smis_common, property_list)
     for cim_sys in cim_syss:
@@ -81,6 +81,16 @@ def cim_path_to_path_str(cim_path):
     })
 
 
+def cim_path_key(cim_path):
+    """
+    Return a hashable key of a CIMInstanceName which matches the references
+    held by association instances, ignoring class name, host and namespace.
+    """
+    return tuple(sorted(
+        (key.lower(), unicode(value))
+        for key, value in cim_path.keybindings.items()))
+
+
 def path_str_to_cim_path(path_str):
     """
     Convert a string into CIMInstanceName.
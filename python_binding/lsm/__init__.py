@@ -12,4 +12,5 @@
     INfs
 
 from _client import Client
-from _pluginrunner import PluginRunner, search_property
+from _pluginrunner import PluginRunner, search_property, SearchIndex, \
+    quick_search_set
@@ -16,9 +16,10 @@
 # Author: tasleson
 
 import os
+import time
 from lsm import (Volume, NfsExport, Capabilities, Pool, System,
                  Disk, AccessGroup, FileSystem, FsSnapshot,
-                 uri_parse, LsmError, ErrorNumber,
+                 uri_parse, LsmError, ErrorNumber, JobStatus,
                  INetworkAttachedStorage, TargetPort)
 
 from _common import return_requires as _return_requires
@@ -39,6 +40,12 @@ def _del_self(d):
     return d
 
 
+## Turns the [result, error] pairs returned by a batched call into tuples
+# of the result and an LsmError or None.
+def _many_results(results):
+    return [(r, e and LsmError(*e)) for (r, e) in results]
+
+
 def _check_search_key(search_key, supported_keys):
     if search_key and search_key not in supported_keys:
         raise LsmError(ErrorNumber.UNSUPPORTED_SEARCH_KEY,
@@ -46,6 +53,15 @@ def _check_search_key(search_key, supported_keys):
     return
 
 
+# Client methods which manage the connection itself or are not simple
+# request/reply calls and thus cannot be part of Client.rpc_pipeline()
+_NOT_PIPELINED = ['rpc_pipeline', 'close', 'plugin_register',
+                  'plugin_unregister', 'session_invalidate',
+                  'available_plugins', 'volumes_iter', 'disks_iter',
+                  'access_groups_iter', 'fs_iter', 'job_wait_any',
+                  'job_wait_all']
+
+
 ## Descriptive exception about daemon not running.
 def _raise_no_daemon():
     raise LsmError(ErrorNumber.DAEMON_NOT_RUNNING,
@@ -67,6 +83,12 @@ class Client(INetworkAttachedStorage):
     #
     FLAG_RSVD = 0
 
+    ##
+    # First and longest interval in seconds between the polls of
+    # job_wait_any() and job_wait_all()
+    JOB_POLL_MIN = 0.1
+    JOB_POLL_MAX = 5
+
     """
     Client side class used for managing storage that utilises RPC mechanism.
     """
@@ -81,12 +103,19 @@ def plugin_register(self, uri, plain_text_password, timeout_ms, flags=0):
     # @param    plain_text_password     Password as plain text
     # @param    timeout_ms              The timeout in ms
     # @param    flags                   Reserved for future use, must be zero.
+    # @param    session_ttl             Seconds to keep the session for reuse
+    # @param    cache_ttl               Seconds to cache read only results
     # @returns None
-    def __start(self, uri, password, timeout, flags=0):
+    def __start(self, uri, password, timeout, flags=0, session_ttl=0,
+                cache_ttl=0):
         """
         Instruct the plug-in to get ready
         """
-        self._tp.rpc('plugin_register', _del_self(locals()))
+        params = _del_self(locals())
+        for k in ['session_ttl', 'cache_ttl']:
+            if not params[k]:
+                del params[k]
+        self._tp.rpc('plugin_register', params)
 
     ## Checks to see if any unix domain sockets exist in the base directory
     # and opens a socket to one to see if the server is actually there.
@@ -127,9 +156,20 @@ def _plugin_uds_path():
     # @param    plain_text_password     Password as plain text (Optional)
     # @param    timeout_ms              The timeout in ms
     # @param    flags                   Reserved for future use, must be zero.
+    # @param    session_ttl             Seconds the plug-in may keep the
+    #                                   registered session after close() for
+    #                                   reuse by a later Client with the same
+    #                                   uri and password, 0 to never keep it.
+    # @param    cache_ttl               Seconds the plug-in may answer read
+    #                                   only calls (systems, pools, volumes
+    #                                   ...) from cached results, 0 to never
+    #                                   cache.  Calls which change the array
+    #                                   through this client drop the results
+    #                                   they affect, changes made elsewhere
+    #                                   are only seen once the results expire.
     # @returns None
     def __init__(self, uri, plain_text_password=None, timeout_ms=30000,
-                 flags=0):
+                 flags=0, session_ttl=0, cache_ttl=0):
         self._uri = uri
         self._password = plain_text_password
         self._timeout = timeout_ms
@@ -156,7 +196,8 @@ def __init__(self, uri, plain_text_password=None, timeout_ms=30000,
             else:
                 _raise_no_daemon()
 
-        self.__start(uri, plain_text_password, timeout_ms, flags)
+        self.__start(uri, plain_text_password, timeout_ms, flags,
+                     session_ttl, cache_ttl)
 
     ## Synonym for close.
     @_return_requires(None)
@@ -178,6 +219,55 @@ def close(self, flags=FLAG_RSVD):
         self._tp.close()
         self._tp = None
 
+    ## Stops the plug-in session of this client from being kept for reuse
+    # and drops a kept one it is using, e.g. after the array configuration
+    # or the credentials changed.
+    # @param    self    The this pointer
+    # @param    flags   Reserved for future use, must be zero.
+    @_return_requires(None)
+    def session_invalidate(self, flags=FLAG_RSVD):
+        """
+        Stops the session of this client from being kept for reuse, the next
+        Client has to register with the plug-in again.  Sessions are only
+        kept when lsmd runs the plug-in in a worker pool and the client was
+        created with a session_ttl.
+        """
+        try:
+            self._tp.rpc('session_invalidate', _del_self(locals()))
+        except LsmError as le:
+            #Plug-in does not keep sessions, so there is nothing to drop
+            if le.code != ErrorNumber.NO_SUPPORT:
+                raise
+
+    ## Returns the statistics of the plug-in result cache.
+    # @param    self    The this pointer
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns Dictionary with the keys ttl, hits, misses, invalidations and
+    #          entries.
+    @_return_requires(dict)
+    def cache_stats(self, flags=FLAG_RSVD):
+        """
+        Returns the statistics of the plug-in result cache, see cache_ttl of
+        the constructor.  All counts are zero when the cache is not in use.
+        """
+        return self._tp.rpc('cache_stats', _del_self(locals()))
+
+    ## Returns the per method instrumentation of the plug-in process.
+    # @param    self    The this pointer
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns Dictionary with the keys pid, uptime, buckets and methods.
+    @_return_requires(dict)
+    def plugin_stats(self, flags=FLAG_RSVD):
+        """
+        Returns the call counts, wall and CPU time totals and histograms,
+        request/response sizes and json decode/encode times of every method
+        served by the plug-in process, keyed by method name in 'methods'.
+        'buckets' holds the upper bounds in seconds of the histogram buckets,
+        the last bucket counts the slower calls.  With a worker pool the
+        numbers cover every client the worker has served.
+        """
+        return self._tp.rpc('plugin_stats', _del_self(locals()))
+
     ## Retrieves all the available plug-ins
     @staticmethod
     @_return_requires([unicode])
@@ -231,6 +321,50 @@ def time_out_get(self, flags=FLAG_RSVD):
         """
         return self._tp.rpc('time_out_get', _del_self(locals()))
 
+    ## Issues several requests to the plug-in without waiting for the reply
+    # of each one before sending the next.
+    # @param    self    The this pointer
+    # @param    calls   List of tuples (method name, dict of parameters)
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns  List of results in the same order as calls.
+    @_return_requires(list)
+    def rpc_pipeline(self, calls, flags=FLAG_RSVD):
+        """
+        Pipelines a list of (method name, parameters) calls to the plug-in,
+        e.g. [('volume_delete', dict(volume=v)) for v in vols].  Parameters
+        use the same names as the corresponding Client method, 'flags' is
+        defaulted when absent.
+
+        Returns a list of results in the order of calls, if any call failed
+        the first LsmError is raised once all replies have been received.
+        """
+        requests = []
+        for (method, params) in calls:
+            if method.startswith('_') or method in _NOT_PIPELINED \
+                    or not hasattr(self, method):
+                raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                               "Method '%s' cannot be pipelined" % method)
+            params = dict(params)
+            params.setdefault('flags', flags)
+            requests.append((method, params))
+        return self._tp.rpc_pipeline(requests)
+
+    ## Fetches a list result from the plug-in in batches.
+    # @param    self    The this pointer
+    # @param    method  Plug-in method to call
+    # @param    params  Parameters of the call, including 'batch'
+    # @returns An iterator over the items of the list.
+    def _rpc_iter(self, method, params):
+        """
+        Pops the 'batch' size out of params and returns an iterator which
+        requests the list result of method in chunks of that many items.
+        """
+        batch = params.pop('batch')
+        if batch < 1:
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                           "Batch size must be greater than zero")
+        return self._tp.rpc_iter(method, params, batch)
+
     ## Retrieves the status of the specified job id.
     # @param    self    The this pointer
     # @param    job_id  The job identifier
@@ -248,6 +382,98 @@ def job_status(self, job_id, flags=FLAG_RSVD):
         """
         return self._tp.rpc('job_status', _del_self(locals()))
 
+    ## Retrieves the status of several jobs with one request.
+    # @param    self    The this pointer
+    # @param    job_ids List of job identifiers
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns A list of tuples ( status (enumeration), percent_complete,
+    # completed item), one for each job id.
+    @_return_requires([[int, int, _IData]])
+    def jobs_status(self, job_ids, flags=FLAG_RSVD):
+        """
+        Returns the stats of the given jobs.
+
+        Returns a list of job_status() tuples in the order of job_ids,
+        else LsmError exception, e.g. the error of the first failed job.
+        Plug-ins which do not support the call are sent pipelined
+        job_status() requests instead.
+        """
+        try:
+            return self._tp.rpc('jobs_status', _del_self(locals()))
+        except LsmError as le:
+            if le.code != ErrorNumber.NO_SUPPORT:
+                raise
+        return self.rpc_pipeline(
+            [('job_status', dict(job_id=job_id)) for job_id in job_ids],
+            flags)
+
+    ## Waits for the first of several jobs to finish.
+    # @param    self    The this pointer
+    # @param    job_ids List of job identifiers
+    # @param    timeout Seconds to wait at most, None to wait forever
+    # @param    max_interval    Longest interval in seconds between polls,
+    #                           None for JOB_POLL_MAX
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns A dictionary of job_status() tuples of the finished jobs, keyed
+    # by job id.
+    def job_wait_any(self, job_ids, timeout=None, max_interval=None,
+                     flags=FLAG_RSVD):
+        """
+        Polls the jobs with jobs_status() until at least one of them is no
+        longer in progress, see job_wait_all().
+        """
+        return self._jobs_wait(job_ids, timeout, max_interval, False, flags)
+
+    ## Waits for several jobs to finish.
+    # @param    self    The this pointer
+    # @param    job_ids List of job identifiers
+    # @param    timeout Seconds to wait at most, None to wait forever
+    # @param    max_interval    Longest interval in seconds between polls,
+    #                           None for JOB_POLL_MAX
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns A dictionary of job_status() tuples of the jobs, keyed by job
+    # id.
+    def job_wait_all(self, job_ids, timeout=None, max_interval=None,
+                     flags=FLAG_RSVD):
+        """
+        Polls the jobs with jobs_status() until none of them is in progress.
+        The polls start JOB_POLL_MIN seconds apart and the interval doubles
+        up to max_interval (JOB_POLL_MAX by default) seconds.  Interactive
+        callers should pass a small max_interval so that they notice
+        finished jobs promptly.  Raises LsmError TIMEOUT if the jobs are
+        still running after timeout seconds.  The jobs are not freed.
+        """
+        return self._jobs_wait(job_ids, timeout, max_interval, True, flags)
+
+    def _jobs_wait(self, job_ids, timeout, max_interval, wait_all, flags):
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+
+        if max_interval is None:
+            max_interval = Client.JOB_POLL_MAX
+        interval = min(Client.JOB_POLL_MIN, max_interval)
+        pending = list(job_ids)
+        done = {}
+        while True:
+            for (job_id, status) in zip(pending,
+                                        self.jobs_status(pending, flags)):
+                if status[0] != JobStatus.INPROGRESS:
+                    done[job_id] = tuple(status)
+            pending = [job_id for job_id in pending if job_id not in done]
+            if not pending or (done and not wait_all):
+                return done
+
+            delay = interval
+            if end is not None:
+                delay = min(delay, end - time.time())
+                if delay <= 0:
+                    raise LsmError(ErrorNumber.TIMEOUT,
+                                   "Timed out waiting for %d job(s)" %
+                                   len(pending))
+            time.sleep(delay)
+            interval = min(interval * 2, max_interval)
+
     ## Frees the resources for the specified job id.
     # @param    self    The this pointer
     # @param    job_id  Job id in which to release resource for
@@ -352,6 +578,23 @@ def volumes(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, Volume.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('volumes', _del_self(locals()))
 
+    ## Returns an iterator of volume objects fetched in batches
+    # @param    self            The this pointer
+    # @param    search_key      Search key to use
+    # @param    search_value    Search value
+    # @param    batch           Number of volumes per reply message
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns An iterator of volume objects.
+    def volumes_iter(self, search_key=None, search_value=None, batch=500,
+                     flags=FLAG_RSVD):
+        """
+        Returns an iterator of volume objects, the plug-in sends them in
+        chunks of 'batch' volumes so the first ones are usable before the
+        whole list has been transferred.
+        """
+        _check_search_key(search_key, Volume.SUPPORTED_SEARCH_KEYS)
+        return self._rpc_iter('volumes', _del_self(locals()))
+
     ## Creates a volume
     # @param    self            The this pointer
     # @param    pool            The pool object to allocate storage from
@@ -373,6 +616,31 @@ def volume_create(self, pool, volume_name, size_bytes, provisioning,
         """
         return self._tp.rpc('volume_create', _del_self(locals()))
 
+    ## Creates several volumes with one request
+    # @param    self            The this pointer
+    # @param    pool            The pool object to allocate storage from
+    # @param    volume_names    List of the human text names of the volumes
+    # @param    size_bytes      Size of each volume in bytes
+    # @param    provisioning    How the volumes are to be provisioned
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns  A list with a tuple (result, error) for each name, result is
+    #           the volume_create() tuple (job_id, new volume) and error
+    #           None, or result is None and error the LsmError of the name.
+    @_return_requires([[list, LsmError]])
+    def volume_create_many(self, pool, volume_names, size_bytes,
+                           provisioning, flags=FLAG_RSVD):
+        """
+        Creates a volume for each of volume_names, given a pool, size and
+        provisioning.  Plug-ins able to do so create them all at once,
+        others create them one by one, either way a failed volume does not
+        stop the creation of the others.
+
+        Returns a list of (result, error) tuples in the order of
+        volume_names, see volume_create() for result.
+        """
+        return _many_results(
+            self._tp.rpc('volume_create_many', _del_self(locals())))
+
     ## Re-sizes a volume
     # @param    self    The this pointer
     # @param    volume  The volume object to re-size
@@ -462,6 +730,23 @@ def volume_delete(self, volume, flags=FLAG_RSVD):
         """
         return self._tp.rpc('volume_delete', _del_self(locals()))
 
+    ## Deletes several volumes with one request
+    # @param    self    The this pointer
+    # @param    volumes List of the volume objects to delete
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns A list with a tuple (result, error) for each volume, see
+    #          volume_create_many(), result is the volume_delete() job id.
+    @_return_requires([[unicode, LsmError]])
+    def volume_delete_many(self, volumes, flags=FLAG_RSVD):
+        """
+        Deletes the volumes, see volume_create_many().
+
+        Returns a list of (job id or None, error) tuples in the order of
+        volumes.
+        """
+        return _many_results(
+            self._tp.rpc('volume_delete_many', _del_self(locals())))
+
     ## Makes a volume online and available to the host.
     # @param    self    The this pointer
     # @param    volume  The volume to place online
@@ -507,6 +792,21 @@ def disks(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, Disk.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('disks', _del_self(locals()))
 
+    ## Returns an iterator of disk objects fetched in batches
+    # @param    self            The this pointer
+    # @param    search_key      Search key to use
+    # @param    search_value    Search value
+    # @param    batch           Number of disks per reply message
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns An iterator of disk objects.
+    def disks_iter(self, search_key=None, search_value=None, batch=500,
+                   flags=FLAG_RSVD):
+        """
+        Returns an iterator of disk objects, fetched in chunks of 'batch'.
+        """
+        _check_search_key(search_key, Disk.SUPPORTED_SEARCH_KEYS)
+        return self._rpc_iter('disks', _del_self(locals()))
+
     ## Access control for allowing an access group to access a volume
     # @param    self            The this pointer
     # @param    access_group    The access group
@@ -520,6 +820,25 @@ def volume_mask(self, access_group, volume, flags=FLAG_RSVD):
         """
         return self._tp.rpc('volume_mask', _del_self(locals()))
 
+    ## Access control for allowing an access group to access several volumes
+    # with one request
+    # @param    self            The this pointer
+    # @param    access_group    The access group
+    # @param    volumes         List of the volumes to grant access to
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns A list with a tuple (None, error) for each volume, see
+    #          volume_create_many().
+    @_return_requires([[None, LsmError]])
+    def volume_mask_many(self, access_group, volumes, flags=FLAG_RSVD):
+        """
+        Allows an access group to access the volumes, see
+        volume_create_many().
+
+        Returns a list of (None, error) tuples in the order of volumes.
+        """
+        return _many_results(
+            self._tp.rpc('volume_mask_many', _del_self(locals())))
+
     ## Revokes access to a volume to initiators in an access group
     # @param    self            The this pointer
     # @param    access_group    The access group
@@ -548,6 +867,22 @@ def access_groups(self, search_key=None, search_value=None,
         _check_search_key(search_key, AccessGroup.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('access_groups', _del_self(locals()))
 
+    ## Returns an iterator of access group objects fetched in batches
+    # @param    self            The this pointer
+    # @param    search_key      Search key to use
+    # @param    search_value    Search value
+    # @param    batch           Number of access groups per reply message
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns An iterator of access group objects.
+    def access_groups_iter(self, search_key=None, search_value=None,
+                           batch=500, flags=FLAG_RSVD):
+        """
+        Returns an iterator of access group objects, fetched in chunks of
+        'batch'.
+        """
+        _check_search_key(search_key, AccessGroup.SUPPORTED_SEARCH_KEYS)
+        return self._rpc_iter('access_groups', _del_self(locals()))
+
     ## Creates an access a group with the specified initiator in it.
     # @param    self                The this pointer
     # @param    name                The initiator group name
@@ -691,6 +1026,22 @@ def fs(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, FileSystem.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('fs', _del_self(locals()))
 
+    ## Returns an iterator of file system objects fetched in batches
+    # @param    self            The this pointer
+    # @param    search_key      Search key to use
+    # @param    search_value    Search value
+    # @param    batch           Number of file systems per reply message
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns An iterator of file system objects.
+    def fs_iter(self, search_key=None, search_value=None, batch=500,
+                flags=FLAG_RSVD):
+        """
+        Returns an iterator of file system objects, fetched in chunks of
+        'batch'.
+        """
+        _check_search_key(search_key, FileSystem.SUPPORTED_SEARCH_KEYS)
+        return self._rpc_iter('fs', _del_self(locals()))
+
     ## Deletes a file system
     # @param    self    The this pointer
     # @param    fs      The file system to delete
@@ -17,6 +17,7 @@
 #         Gris Ge <fge@redhat.com>
 
 from abc import ABCMeta as _ABCMeta
+import inspect
 import re
 
 try:
@@ -24,7 +25,6 @@
 except ImportError:
     import json
 
-from json.decoder import WHITESPACE
 from _common import get_class, default_property, ErrorNumber, LsmError
 
 
@@ -43,96 +43,123 @@ def default(self, my_class):
 class DataDecoder(json.JSONDecoder):
     """
     Custom json decoder for objects derived from ILsmData
+
+    Objects are built while the json is being parsed: the parser hands every
+    dict to IData._factory once its members are decoded, so nested IData
+    objects are already constructed when their parent is.
     """
 
-    @staticmethod
-    def __process_dict(d):
-        """
-        Processes a dictionary
-        """
-        rc = {}
+    def __init__(self, *args, **kwargs):
+        kwargs['object_hook'] = IData._factory
+        json.JSONDecoder.__init__(self, *args, **kwargs)
 
-        if 'class' in d:
-            rc = IData._factory(d)
-        else:
-            for (k, v) in d.iteritems():
-                rc[k] = DataDecoder.__decode(v)
 
-        return rc
+# Class name => (class, serialized key to constructor argument map), filled in
+# by IData._class_info()
+_CLASS_REGISTRY = {}
 
-    @staticmethod
-    def __process_list(l):
-        """
-        Processes a list
-        """
-        rc = []
-        for elem, value in enumerate(l):
-            if type(value) is list:
-                rc.append(DataDecoder.__process_list(value))
-            elif type(value) is dict:
-                rc.append(DataDecoder.__process_dict(value))
-            else:
-                rc.append(value)
-        return rc
-
-    @staticmethod
-    def __decode(e):
-        """
-        Decodes the parsed json
-        """
-        if type(e) is dict:
-            return DataDecoder.__process_dict(e)
-        elif type(e) is list:
-            return DataDecoder.__process_list(e)
-        else:
-            return e
-
-    def decode(self, json_string, _w=WHITESPACE.match):
-        return DataDecoder.__decode(json.loads(json_string))
+# All registered IData classes, cheaper to test against than isinstance()
+# which goes through ABCMeta.
+_IDATA_CLASSES = set()
 
 
 class IData(object):
     """
     Base class functionality of serializable
     classes.
+
+    Sub-classes list their '_' prefixed attributes in __slots__, so instances
+    carry no per-instance __dict__.  _KEYS holds the (serialized key,
+    attribute name) pairs derived from the __slots__ of the class and its
+    bases, see _register().  A sub-class without __slots__ still works, its
+    '_' prefixed instance attributes are then read from __dict__ as well.
     """
     __metaclass__ = _ABCMeta
 
+    __slots__ = ()
+    _KEYS = ()
+    _HAS_DICT = False
+
     def _to_dict(self):
         """
         Represent the class as a dictionary
         """
+        if self.__class__ not in _IDATA_CLASSES:
+            IData._register(self.__class__)
+
         rc = {'class': self.__class__.__name__}
 
+        keys = self._KEYS
+        if self._HAS_DICT:
+            keys = keys + tuple((a[1:], a) for a in self.__dict__
+                                if a.startswith('_'))
+
         #If one of the attributes is another IData we will
         #process that too, is there a better way to handle this?
-        for (k, v) in self.__dict__.items():
-            if isinstance(v, IData):
-                rc[k[1:]] = v._to_dict()
+        for (k, attr) in keys:
+            v = getattr(self, attr)
+            if v.__class__ in _IDATA_CLASSES:
+                rc[k] = v._to_dict()
             else:
-                rc[k[1:]] = v
+                rc[k] = v
 
         return rc
 
+    @staticmethod
+    def _register(c):
+        """
+        Adds class c to the decoder registry along with the mapping of its
+        serialized keys to constructor argument names.
+        """
+        args = inspect.getargspec(c.__init__).args[1:]
+        info = (c, dict((a[1:], a) for a in args if a.startswith('_')))
+        _CLASS_REGISTRY[c.__name__] = info
+        _IDATA_CLASSES.add(c)
+        keys = []
+        c._HAS_DICT = False
+        for base in c.__mro__:
+            if base is object:
+                continue
+            slots = base.__dict__.get('__slots__')
+            if slots is None:
+                # No __slots__ here, so instances get a __dict__
+                c._HAS_DICT = True
+                continue
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            keys.extend((a[1:], a) for a in slots
+                        if a.startswith('_') and (a[1:], a) not in keys)
+        c._KEYS = tuple(keys)
+        return info
+
+    @staticmethod
+    def _class_info(class_name):
+        """
+        Returns a tuple (class, dict of serialized key to constructor
+        argument name) for the IData class with the given name.
+        """
+        info = _CLASS_REGISTRY.get(class_name)
+        if info is None:
+            info = IData._register(get_class(__name__ + '.' + class_name))
+        return info
+
     @staticmethod
     def _factory(d):
         """
         Factory for creating the appropriate class given a dictionary.
-        This only works for objects that inherit from IData
+        This only works for objects that inherit from IData, any other
+        dictionary is returned as is.  Members which are themselves IData
+        need to have been processed already (see DataDecoder).
         """
-        if 'class' in d:
-            class_name = d['class']
-            del d['class']
-            c = get_class(__name__ + '.' + class_name)
-
-            #If any of the parameters are themselves an IData process them
-            for k, v in d.items():
-                if isinstance(v, dict) and 'class' in v:
-                    d['_' + k] = IData._factory(d.pop(k))
-                else:
-                    d['_' + k] = d.pop(k)
+        if 'class' not in d:
+            return d
 
-            return c(**d)
+        (c, arg_map) = IData._class_info(d['class'])
+        kwargs = {}
+        for k, v in d.iteritems():
+            if k != 'class':
+                kwargs[arg_map.get(k) or '_' + k] = v
+        return c(**kwargs)
 
     def __str__(self):
         """
@@ -208,6 +235,9 @@ class Disk(IData):
     # any explicit action when assigning to pool, it should be treated as
     # free disk and marked as STATUS_FREE|STATUS_SPARE_DISK.
 
+    __slots__ = ('_id', '_name', '_disk_type', '_block_size', '_num_of_blocks',
+                 '_status', '_system_id', '_plugin_data')
+
     def __init__(self, _id, _name, _disk_type, _block_size, _num_of_blocks,
                  _status, _system_id, _plugin_data=None):
         self._id = _id
@@ -306,6 +336,9 @@ class Volume(IData):
     MIN_IO_SIZE_UNKNOWN = 0
     OPT_IO_SIZE_UNKNOWN = 0
 
+    __slots__ = ('_id', '_name', '_vpd83', '_block_size', '_num_of_blocks',
+                 '_admin_state', '_system_id', '_pool_id', '_plugin_data')
+
     def __init__(self, _id, _name, _vpd83, _block_size, _num_of_blocks,
                  _admin_state, _system_id, _pool_id, _plugin_data=None):
         self._id = _id                        # Identifier
@@ -356,6 +389,8 @@ class System(IData):
     STATUS_PREDICTIVE_FAILURE = 1 << 4
     STATUS_OTHER = 1 << 5
 
+    __slots__ = ('_id', '_name', '_status', '_status_info', '_plugin_data')
+
     def __init__(self, _id, _name, _status, _status_info, _plugin_data=None):
         self._id = _id
         self._name = _name
@@ -412,6 +447,10 @@ class Pool(IData):
     STATUS_INITIALIZING = 1 << 14
     STATUS_GROWING = 1 << 15
 
+    __slots__ = ('_id', '_name', '_element_type', '_unsupported_actions',
+                 '_total_space', '_free_space', '_status', '_status_info',
+                 '_system_id', '_plugin_data')
+
     def __init__(self, _id, _name, _element_type, _unsupported_actions,
                  _total_space, _free_space,
                  _status, _status_info, _system_id, _plugin_data=None):
@@ -438,6 +477,9 @@ def __init__(self, _id, _name, _element_type, _unsupported_actions,
 class FileSystem(IData):
     SUPPORTED_SEARCH_KEYS = ['id', 'system_id', 'pool_id']
 
+    __slots__ = ('_id', '_name', '_total_space', '_free_space', '_pool_id',
+                 '_system_id', '_plugin_data')
+
     def __init__(self, _id, _name, _total_space, _free_space, _pool_id,
                  _system_id, _plugin_data=None):
         self._id = _id
@@ -455,6 +497,8 @@ def __init__(self, _id, _name, _total_space, _free_space, _pool_id,
 @default_property("plugin_data", "Private plugin data")
 class FsSnapshot(IData):
 
+    __slots__ = ('_id', '_name', '_ts', '_plugin_data')
+
     def __init__(self, _id, _name, _ts, _plugin_data=None):
         self._id = _id
         self._name = _name
@@ -478,6 +522,9 @@ class NfsExport(IData):
     ANON_UID_GID_NA = -1
     ANON_UID_GID_ERROR = -2
 
+    __slots__ = ('_id', '_fs_id', '_export_path', '_auth', '_root', '_rw',
+                 '_ro', '_anonuid', '_anongid', '_options', '_plugin_data')
+
     def __init__(self, _id, _fs_id, _export_path, _auth, _root, _rw, _ro,
                  _anonuid, _anongid, _options, _plugin_data=None):
         assert (_fs_id is not None)
@@ -500,6 +547,8 @@ def __init__(self, _id, _fs_id, _export_path, _auth, _root, _rw, _ro,
 @default_property('dest_block', doc="Destination logical block address")
 @default_property('block_count', doc="Number of blocks")
 class BlockRange(IData):
+    __slots__ = ('_src_block', '_dest_block', '_block_count')
+
     def __init__(self, _src_block, _dest_block, _block_count):
         self._src_block = _src_block
         self._dest_block = _dest_block
@@ -521,6 +570,9 @@ class AccessGroup(IData):
     INIT_TYPE_ISCSI_IQN = 5
     INIT_TYPE_ISCSI_WWPN_MIXED = 7
 
+    __slots__ = ('_id', '_name', '_init_ids', '_init_type', '_system_id',
+                 '_plugin_data')
+
     def __init__(self, _id, _name, _init_ids, _init_type, _system_id,
                  _plugin_data=None):
         self._id = _id
@@ -633,6 +685,10 @@ class TargetPort(IData):
     TYPE_FCOE = 3
     TYPE_ISCSI = 4
 
+    __slots__ = ('_id', '_port_type', '_service_address', '_network_address',
+                 '_physical_address', '_physical_name', '_system_id',
+                 '_plugin_data')
+
     def __init__(self, _id, _port_type, _service_address,
                  _network_address, _physical_address, _physical_name,
                  _system_id, _plugin_data=None):
@@ -755,6 +811,8 @@ class Capabilities(IData):
 
     DISKS = 220
 
+    __slots__ = ('_cap',)
+
     def _to_dict(self):
         return {'class': self.__class__.__name__,
                 'cap': ''.join(['%02x' % b for b in self._cap])}
@@ -812,6 +870,11 @@ def enable_all(self):
             self._cap[i] = Capabilities.SUPPORTED
 
 
+# Pre-compute the decoder registry for every class defined above
+for _c in IData.__subclasses__():
+    IData._register(_c)
+
+
 if __name__ == '__main__':
     #TODO Need some unit tests that encode/decode all the types with nested
     pass
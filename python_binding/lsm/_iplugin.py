@@ -27,6 +27,12 @@ class IPlugin(object):
     """
     __metaclass__ = _ABCMeta
 
+    # Search keys each listing method evaluates on the array when fetching,
+    # e.g. {'volumes': ['id', 'pool_id']}, see lsm.quick_search_set().  The
+    # other supported keys are expected to be filtered with
+    # lsm.search_property() once the whole list has been fetched.
+    QUICK_SEARCH_KEYS = {}
+
     @_abstractmethod
     def plugin_register(self, uri, password, timeout, flags=0):
         """
@@ -156,6 +162,28 @@ def volume_delete(self, volume, flags=0):
         """
         raise LsmError(ErrorNumber.NO_SUPPORT, "Not supported")
 
+    def volume_create_many(self, pool, volume_names, size_bytes,
+                           provisioning, flags=0):
+        """
+        Creates a volume of the given size and provisioning in the pool for
+        each of volume_names.
+
+        Returns a list with a [result, error] pair for each name, result is
+        the volume_create() tuple and error None, or result is None and
+        error the [code, message, data] of the failure.  Plug-ins which do
+        not implement it get volume_create() called for each name.
+        """
+        raise LsmError(ErrorNumber.NO_SUPPORT, "Not supported")
+
+    def volume_delete_many(self, volumes, flags=0):
+        """
+        Deletes the volumes.
+
+        Returns a list with a [result, error] pair for each volume, see
+        volume_create_many(), result is the volume_delete() job id.
+        """
+        raise LsmError(ErrorNumber.NO_SUPPORT, "Not supported")
+
     def volume_resize(self, volume, new_size_bytes, flags=0):
         """
         Re-sizes a volume.
@@ -238,6 +266,15 @@ def volume_mask(self, access_group, volume, flags=0):
         """
         raise LsmError(ErrorNumber.NO_SUPPORT, "Not supported")
 
+    def volume_mask_many(self, access_group, volumes, flags=0):
+        """
+        Allows an access group to access the volumes.
+
+        Returns a list with a [None, error] pair for each volume, see
+        volume_create_many().
+        """
+        raise LsmError(ErrorNumber.NO_SUPPORT, "Not supported")
+
     def volume_unmask(self, access_group, volume, flags=0):
         """
         Revokes access for an access group for a volume
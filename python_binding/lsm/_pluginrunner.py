@@ -15,26 +15,355 @@
 #
 # Author: tasleson
 
+import bisect
+import cProfile
+import errno
+import hashlib
+import json
+import os
+import select
 import socket
 import traceback
 import sys
+import time
+import types
 from _common import SocketEOF as _SocketEOF
+from _common import JobStatus as _JobStatus
+from _data import (DataEncoder as _DataEncoder, Capabilities, Pool, Volume,
+                   Disk, AccessGroup, FileSystem, NfsExport, TargetPort)
 from lsm import LsmError, error, ErrorNumber
 import _transport
 from lsm.lsmcli import cmd_line_wrapper
 
+# Single byte state changes a pooled worker reports to lsmd
+_WORKER_BUSY = 'B'
+_WORKER_IDLE = 'I'
+
+# Most registered sessions a worker keeps for reuse
+SESSION_MAX = 8
+
+# Upper bounds (seconds) of the plugin_stats() latency histogram buckets, one
+# more bucket counts everything slower
+STATS_BUCKETS = [0.001, 0.01, 0.1, 1, 10]
+
+# Read only plug-in methods whose results may be cached
+_CACHED = frozenset(['capabilities', 'plugin_info', 'pools', 'systems',
+                     'volumes', 'disks', 'access_groups',
+                     'volumes_accessible_by_access_group',
+                     'access_groups_granted_to_volume',
+                     'volume_child_dependency',
+                     'volume_replicate_range_block_size', 'target_ports',
+                     'fs', 'fs_snapshots', 'fs_child_dependency',
+                     'export_auth', 'exports'])
+
+# Methods which neither get cached nor change anything on the array
+_NOT_CACHED = frozenset(['plugin_register', 'plugin_unregister',
+                         'time_out_set', 'time_out_get', 'job_free'])
+
+# Methods the PluginRunner serves with one of its own, named here, for
+# plug-ins which do not implement them or raise NO_SUPPORT
+_FALLBACKS = {
+    'jobs_status': '_jobs_status',
+    'volume_create_many': '_volume_create_many',
+    'volume_delete_many': '_volume_delete_many',
+    'volume_mask_many': '_volume_mask_many',
+}
+
+# Methods returning a list of [result, error] pairs, one for each item
+_BATCHED = frozenset(['volume_create_many', 'volume_delete_many',
+                      'volume_mask_many'])
+
+_VOLUME_READS = ('volumes', 'pools', 'volume_child_dependency',
+                 'volumes_accessible_by_access_group',
+                 'access_groups_granted_to_volume')
+_MASK_READS = ('volumes_accessible_by_access_group',
+               'access_groups_granted_to_volume')
+_FS_READS = ('fs', 'pools', 'fs_snapshots', 'fs_child_dependency', 'exports')
+
+# Cached methods a mutating method makes stale, any other method drops the
+# whole cache
+_INVALIDATES = {
+    'volume_create': _VOLUME_READS,
+    'volume_create_many': _VOLUME_READS,
+    'volume_delete': _VOLUME_READS,
+    'volume_delete_many': _VOLUME_READS,
+    'volume_resize': _VOLUME_READS,
+    'volume_replicate': _VOLUME_READS,
+    'volume_replicate_range': _VOLUME_READS,
+    'volume_child_dependency_rm': _VOLUME_READS,
+    'volume_enable': ('volumes',),
+    'volume_disable': ('volumes',),
+    'volume_mask': _MASK_READS,
+    'volume_mask_many': _MASK_READS,
+    'volume_unmask': _MASK_READS,
+    'access_group_create': ('access_groups',) + _MASK_READS,
+    'access_group_delete': ('access_groups',) + _MASK_READS,
+    'access_group_initiator_add': ('access_groups',) + _MASK_READS,
+    'access_group_initiator_delete': ('access_groups',) + _MASK_READS,
+    'iscsi_chap_auth': ('access_groups',),
+    'fs_create': _FS_READS,
+    'fs_delete': _FS_READS,
+    'fs_resize': _FS_READS,
+    'fs_clone': _FS_READS,
+    'fs_file_clone': _FS_READS,
+    'fs_child_dependency_rm': _FS_READS,
+    'fs_snapshot_create': _FS_READS,
+    'fs_snapshot_delete': _FS_READS,
+    'fs_snapshot_restore': _FS_READS,
+    'export_fs': ('exports',),
+    'export_remove': ('exports',),
+}
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+class _PluginStats(object):
+    """
+    Per method call counts, wall and CPU time histograms, message sizes and
+    json decode/encode times of the requests served by this plug-in process.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.methods = {}
+
+    def record(self, method, failed, wall, cpu, counters_before,
+               counters_after):
+        """
+        Accounts one request, counters_before/after are the transport
+        counters taken after the request was read and after the reply was
+        sent.
+        """
+        m = self.methods.get(method)
+        if m is None:
+            m = dict(calls=0, errors=0, wall_time=0.0, wall_max=0.0,
+                     cpu_time=0.0, wall_hist=[0] * (len(STATS_BUCKETS) + 1),
+                     cpu_hist=[0] * (len(STATS_BUCKETS) + 1),
+                     request_bytes=0, response_bytes=0, decode_time=0.0,
+                     encode_time=0.0)
+            self.methods[method] = m
+
+        (recv, send) = (counters_before['recv'], counters_after['send'])
+        m['calls'] += 1
+        m['errors'] += int(failed)
+        m['wall_time'] += wall
+        m['wall_max'] = max(m['wall_max'], wall)
+        m['cpu_time'] += cpu
+        m['wall_hist'][bisect.bisect_left(STATS_BUCKETS, wall)] += 1
+        m['cpu_hist'][bisect.bisect_left(STATS_BUCKETS, cpu)] += 1
+        m['request_bytes'] += recv['last_bytes']
+        m['decode_time'] += recv['last_json_time']
+        m['response_bytes'] += \
+            send['bytes'] - counters_before['send']['bytes']
+        m['encode_time'] += \
+            send['json_time'] - counters_before['send']['json_time']
+
+    def report(self):
+        return dict(pid=os.getpid(), uptime=time.time() - self.start,
+                    buckets=STATS_BUCKETS, methods=self.methods)
+
+
+class _ResultCache(object):
+    """
+    Memoizes the results of the read only plug-in methods per (method,
+    parameters) for ttl seconds.  A mutating method drops the cached results
+    it makes stale when it is called and, if it returned a job, once more
+    when job_status() reports the job finished.
+
+    Searches the plug-in does not evaluate on the array (see
+    IPlugin.QUICK_SEARCH_KEYS) are answered from a SearchIndex of the whole
+    cached list instead of the plug-in fetching and scanning it each time.
+    """
+
+    def __init__(self, ttl, quick_search_keys=None):
+        self.ttl = ttl
+        self.quick_search_keys = quick_search_keys or {}
+        self.entries = {}
+        self.jobs = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self, methods=None):
+        """
+        Drops the cached results of methods, or every result if None.
+        """
+        if methods is None:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+        else:
+            for key in [k for k in self.entries if k[0] in methods]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        return dict(ttl=self.ttl, hits=self.hits, misses=self.misses,
+                    invalidations=self.invalidations,
+                    entries=len(self.entries))
+
+    def _lookup(self, func, method, params, wrap):
+        """
+        Returns the cached result of method for params, calling func on a
+        miss and storing its result, wrapped by wrap if given.
+        """
+        key = (method, json.dumps(params, cls=_DataEncoder, sort_keys=True))
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        result = func(**params)
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        if wrap:
+            result = wrap(result)
+        self.entries[key] = (time.time() + self.ttl, result)
+        return result
+
+    def _job_done(self, job_id, status):
+        """
+        Drops the results made stale by the job once it is no longer in
+        progress.
+        """
+        if status[0] != _JobStatus.INPROGRESS and job_id in self.jobs:
+            self.invalidate(self.jobs.pop(job_id))
+
+    def call(self, func, method, params):
+        """
+        Returns func(**params), from the cache if it holds a fresh result.
+        """
+        if method in _CACHED:
+            search_key = params.get('search_key')
+            if 'search_key' not in params or \
+                    search_key in self.quick_search_keys.get(method, []):
+                return self._lookup(func, method, params, None)
+
+            index = self._lookup(
+                func, method,
+                dict(params, search_key=None, search_value=None),
+                SearchIndex)
+            return index.search(search_key, params.get('search_value'))
+
+        if method == 'job_status':
+            result = func(**params)
+            self._job_done(params['job_id'], result)
+            return result
+
+        if method == 'jobs_status':
+            result = func(**params)
+            for (job_id, status) in zip(params['job_ids'], result):
+                self._job_done(job_id, status)
+            return result
+
+        if method in _NOT_CACHED:
+            return func(**params)
+
+        affected = _INVALIDATES.get(method)
+        try:
+            result = func(**params)
+        finally:
+            self.invalidate(affected)
+
+        #Mutating methods return a job id alone or first in a tuple, the
+        #batched ones a list of [result, error] pairs of those
+        results = [result]
+        if method in _BATCHED:
+            results = [r for (r, e) in result]
+        for job in results:
+            if isinstance(job, (list, tuple)) and job:
+                job = job[0]
+            if isinstance(job, basestring):
+                self.jobs[job] = affected
+        return result
+
+
+class SearchIndex(object):
+    """
+    Holds a list of lsm objects and searches it by property.  The first
+    search on a property builds a hash index of the list for it, so further
+    searches on the same property are O(1).
+    """
+
+    def __init__(self, lsm_objs):
+        self.lsm_objs = lsm_objs
+        self._indexes = {}
+
+    def search(self, search_key, search_value):
+        if search_key is None:
+            return list(self.lsm_objs)
+
+        index = self._indexes.get(search_key)
+        if index is None:
+            index = {}
+            for lsm_obj in self.lsm_objs:
+                index.setdefault(getattr(lsm_obj, search_key), []).append(
+                    lsm_obj)
+            self._indexes[search_key] = index
+        return list(index.get(search_value, []))
+
+
+def _many(func, items):
+    """
+    Returns a [result, error] pair for each of items, func(item) and None,
+    or None and the [code, message, data] of the LsmError it raised.
+    """
+    rc = []
+    for item in items:
+        try:
+            rc.append([func(item), None])
+        except LsmError as le:
+            rc.append([None, [le.code, le.msg, le.data]])
+    return rc
+
 
 def search_property(lsm_objs, search_key, search_value):
     """
     This method does not check whether lsm_obj contain requested property.
     The method caller should do the check.
+
+    lsm_objs may also be a SearchIndex, which is searched through its index.
     """
     if search_key is None:
+        if isinstance(lsm_objs, SearchIndex):
+            return list(lsm_objs.lsm_objs)
         return lsm_objs
+    if isinstance(lsm_objs, SearchIndex):
+        return lsm_objs.search(search_key, search_value)
     return list(lsm_obj for lsm_obj in lsm_objs
                 if getattr(lsm_obj, search_key) == search_value)
 
 
+# Listing methods taking a search_key, the class they list and the capability
+# telling whether they search on the array
+_QUICK_SEARCH = {
+    'pools': (Pool, Capabilities.POOLS_QUICK_SEARCH),
+    'volumes': (Volume, Capabilities.VOLUMES_QUICK_SEARCH),
+    'disks': (Disk, Capabilities.DISKS_QUICK_SEARCH),
+    'access_groups': (AccessGroup, Capabilities.ACCESS_GROUPS_QUICK_SEARCH),
+    'fs': (FileSystem, Capabilities.FS_QUICK_SEARCH),
+    'exports': (NfsExport, Capabilities.NFS_EXPORTS_QUICK_SEARCH),
+    'target_ports': (TargetPort, Capabilities.TARGET_PORTS_QUICK_SEARCH),
+}
+
+
+def quick_search_set(cap, quick_search_keys):
+    """
+    Sets the *_QUICK_SEARCH capabilities in cap from the QUICK_SEARCH_KEYS
+    declaration of a plug-in, a listing method searches on the array if it
+    evaluates all of the search keys of its class there.
+    """
+    for (method, (lsm_class, cap_num)) in _QUICK_SEARCH.items():
+        if set(lsm_class.SUPPORTED_SEARCH_KEYS) <= \
+                set(quick_search_keys.get(method, [])):
+            cap.set(cap_num)
+        else:
+            cap.set(cap_num, Capabilities.UNSUPPORTED)
+
+
 class PluginRunner(object):
     """
     Plug-in side common code which uses the passed in plugin to do meaningful
@@ -54,46 +383,307 @@ def _is_number(val):
 
     def __init__(self, plugin, args):
         self.cmdline = False
+        self.worker = None
+        self.plugin_class = plugin
+        #Registered plug-in instances kept for reuse by a pooled worker,
+        #(uri, password digest) -> (plug-in instance, result cache, expiry)
+        self.sessions = {}
+        self.session = None
+        self.cache = None
+        self.stats = _PluginStats()
+        #Directory to dump cProfile output of each method to, if any
+        self.profile_dir = os.getenv('LSM_PLUGIN_PROFILE_DIR')
+        self.profiles = {}
         if len(args) == 2 and PluginRunner._is_number(args[1]):
             try:
-                fd = int(args[1])
-                self.tp = _transport.TransPort(
-                    socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM))
-
-                #At this point we can return errors to the client, so we can
-                #inform the client if the plug-in fails to create itself
-                try:
-                    self.plugin = plugin()
-                except Exception as e:
-                    exception_info = sys.exc_info()
-
-                    self.tp.send_error(0, -32099,
-                                       'Error instantiating plug-in ' + str(e))
-                    raise exception_info[1], None, exception_info[2]
-
+                self._connect(socket.fromfd(int(args[1]), socket.AF_UNIX,
+                                            socket.SOCK_STREAM))
             except Exception:
                 error(traceback.format_exc())
                 error('Plug-in exiting.')
                 sys.exit(2)
 
+        elif len(args) == 3 and PluginRunner._is_number(args[1]) and \
+                PluginRunner._is_number(args[2]):
+            #Pooled worker of lsmd: plug-in listening socket and control
+            #socket, clients are accepted in run()
+            self.worker = (int(args[1]), int(args[2]))
         else:
             self.cmdline = True
             cmd_line_wrapper(plugin)
 
+    def _connect(self, client):
+        """
+        Sets up the transport for a client socket and creates the plug-in
+        instance which serves it.
+        """
+        self.tp = _transport.TransPort(client)
+        self.session = None
+        self.cache = None
+
+        #At this point we can return errors to the client, so we can
+        #inform the client if the plug-in fails to create itself
+        try:
+            self.plugin = self.plugin_class()
+        except Exception as e:
+            exception_info = sys.exc_info()
+
+            self.tp.send_error(0, -32099,
+                               'Error instantiating plug-in ' + str(e))
+            raise exception_info[1], None, exception_info[2]
+
+    @staticmethod
+    def _session_key(params):
+        """
+        Key of a registered session, the password is only kept as a digest.
+        """
+        password = params.get('password') or u''
+        return (params.get('uri'),
+                hashlib.sha256(password.encode('utf-8')).hexdigest())
+
+    def _session_drop(self, key=None, drop_all=False):
+        """
+        Unregisters and forgets the expired sessions and the session for key
+        if given, or every session if drop_all.
+        """
+        now = time.time()
+        for (k, (plugin, cache, expires)) in self.sessions.items():
+            if drop_all or k == key or expires <= now:
+                del self.sessions[k]
+                try:
+                    plugin.plugin_unregister()
+                except Exception:
+                    error(traceback.format_exc())
+
+    def _session_keep(self):
+        """
+        Keeps the registered plug-in of the current client for reuse instead
+        of unregistering it, returns False if the client did not ask for it.
+        """
+        if not self.session:
+            return False
+
+        (key, ttl) = self.session
+        self._session_drop(key)
+        if len(self.sessions) >= SESSION_MAX:
+            oldest = min(self.sessions, key=lambda k: self.sessions[k][2])
+            self._session_drop(oldest)
+        self.sessions[key] = (self.plugin, self.cache, time.time() + ttl)
+        self.session = None
+        return True
+
+    def _register(self, params):
+        """
+        Handles plugin_register.  A client passing 'session_ttl' (seconds)
+        to a pooled worker gets a session which is kept that long after it
+        unregisters, a later client registering with the same uri and
+        password takes it over instead of registering the plug-in again.
+        A client passing 'cache_ttl' (seconds) gets the results of read only
+        methods cached that long.
+        """
+        ttl = params.pop('session_ttl', 0)
+        cache_ttl = params.pop('cache_ttl', 0)
+        if cache_ttl:
+            self.cache = _ResultCache(
+                cache_ttl, getattr(self.plugin, 'QUICK_SEARCH_KEYS', {}))
+
+        register = self._profiled('plugin_register',
+                                  self.plugin.plugin_register)
+        if not ttl or not self.worker:
+            return register(**params)
+
+        key = PluginRunner._session_key(params)
+        self._session_drop()
+        if key in self.sessions:
+            #The instance created for this client was never registered,
+            #the kept cache goes along with the kept instance
+            (self.plugin, cache) = self.sessions.pop(key)[:2]
+            if cache and cache_ttl:
+                cache.ttl = cache_ttl
+                self.cache = cache
+            try:
+                self.plugin.time_out_set(params['timeout'],
+                                         params.get('flags', 0))
+            except LsmError:
+                pass
+            rc = None
+        else:
+            rc = register(**params)
+        self.session = (key, ttl)
+        return rc
+
+    def _profiled(self, method, func):
+        """
+        Returns func, wrapped to run under cProfile when profiling is
+        enabled by LSM_PLUGIN_PROFILE_DIR.  The statistics accumulate per
+        method and are written to <dir>/<plug-in>-<pid>-<method>.prof after
+        each call, results which are generators are only profiled as far as
+        producing the generator.
+        """
+        if not self.profile_dir:
+            return func
+
+        def run(*args, **kwargs):
+            profile = self.profiles.setdefault(method, cProfile.Profile())
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                profile.dump_stats(os.path.join(
+                    self.profile_dir, '%s-%d-%s.prof' % (
+                        self.plugin_class.__name__, os.getpid(), method)))
+        return run
+
+    def _work(self):
+        """
+        Serves clients as a pooled worker until lsmd closes the control
+        socket.  The listening socket is non-blocking as lsmd and the other
+        workers of the plug-in race us to accept each client.
+        """
+        (listen_fd, ctrl) = self.worker
+        listener = socket.fromfd(listen_fd, socket.AF_UNIX,
+                                 socket.SOCK_STREAM)
+        os.close(listen_fd)
+
+        try:
+            while True:
+                #Wake up to unregister sessions as they expire
+                tmo = None
+                if self.sessions:
+                    tmo = max(0, min(s[2] for s in self.sessions.values())
+                              - time.time())
+
+                try:
+                    readable = select.select([listener, ctrl], [], [],
+                                             tmo)[0]
+                except select.error as se:
+                    if se[0] == errno.EINTR:
+                        continue
+                    raise
+
+                self._session_drop()
+
+                #lsmd only ever closes its end, we are no longer needed
+                if ctrl in readable:
+                    break
+
+                if not readable:
+                    continue
+
+                try:
+                    client = listener.accept()[0]
+                except socket.error as se:
+                    if se.errno in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                    errno.EINTR):
+                        continue
+                    raise
+
+                os.write(ctrl, _WORKER_BUSY)
+                try:
+                    self._connect(client)
+                    self._serve()
+                except Exception:
+                    error(traceback.format_exc())
+                finally:
+                    client.close()
+                os.write(ctrl, _WORKER_IDLE)
+        except OSError as oe:
+            #lsmd went away while we were serving a client
+            if oe.errno != errno.EPIPE:
+                raise
+        finally:
+            self._session_drop(drop_all=True)
+
+    def _method(self, method):
+        """
+        Returns the plug-in function serving method, falling back to the
+        PluginRunner one of _FALLBACKS if the plug-in has none or it raises
+        NO_SUPPORT.
+        """
+        if method not in _FALLBACKS:
+            return getattr(self.plugin, method)
+
+        fallback = getattr(self, _FALLBACKS[method])
+        if not hasattr(self.plugin, method):
+            return fallback
+
+        func = getattr(self.plugin, method)
+
+        def run(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except LsmError as le:
+                if le.code != ErrorNumber.NO_SUPPORT:
+                    raise
+            return fallback(*args, **kwargs)
+        return run
+
+    def _jobs_status(self, job_ids, flags=0):
+        """
+        jobs_status() of plug-ins which only implement job_status(), polls
+        the jobs one by one here rather than by one request each from the
+        client.
+        """
+        return [self.plugin.job_status(job_id, flags) for job_id in job_ids]
+
+    def _volume_create_many(self, pool, volume_names, size_bytes,
+                            provisioning, flags=0):
+        return _many(
+            lambda name: self.plugin.volume_create(
+                pool, name, size_bytes, provisioning, flags),
+            volume_names)
+
+    def _volume_delete_many(self, volumes, flags=0):
+        return _many(
+            lambda volume: self.plugin.volume_delete(volume, flags),
+            volumes)
+
+    def _volume_mask_many(self, access_group, volumes, flags=0):
+        return _many(
+            lambda volume: self.plugin.volume_mask(
+                access_group, volume, flags),
+            volumes)
+
+    def _send_batches(self, result, msg_id, batch):
+        """
+        Sends a list (or generator) result in chunks of at most batch items,
+        the plug-in generator is only advanced as each chunk is filled.
+        """
+        chunk = []
+        for item in result:
+            chunk.append(item)
+            if len(chunk) >= batch:
+                self.tp.send_resp(chunk, msg_id, more=True)
+                chunk = []
+        self.tp.send_resp(chunk, msg_id)
+
     def run(self):
         #Don't need to invoke this when running stand alone as a cmdline
         if self.cmdline:
             return
 
+        if self.worker:
+            self._work()
+        elif self._serve():
+            sys.exit(2)
+
+    def _serve(self):
+        """
+        Handles the requests of the connected client, returns True if the
+        client went away without unregistering.
+        """
         need_shutdown = False
         msg_id = 0
 
         try:
             while True:
+                method = None
+                start = None
+                failed = True
                 try:
                     #result = None
 
                     msg = self.tp.read_req()
+                    start = (time.time(), _cpu_time(), self.tp.counters())
 
                     method = msg['method']
                     msg_id = msg['id']
@@ -101,17 +691,46 @@ def run(self):
 
                     #Check to see if this plug-in implements this operation
                     #if not return the expected error.
-                    if hasattr(self.plugin, method):
-                        if params is None:
-                            result = getattr(self.plugin, method)()
+                    if method == 'plugin_register' and params:
+                        result = self._register(params)
+                    elif method == 'plugin_unregister' and \
+                            self._session_keep():
+                        result = None
+                    elif method == 'session_invalidate':
+                        #Neither keep nor reuse the session of this client
+                        if self.session:
+                            self._session_drop(self.session[0])
+                            self.session = None
+                        result = None
+                    elif method == 'cache_stats':
+                        result = _ResultCache(0).stats()
+                        if self.cache:
+                            result = self.cache.stats()
+                    elif method == 'plugin_stats':
+                        result = self.stats.report()
+                    elif hasattr(self.plugin, method) or \
+                            method in _FALLBACKS:
+                        func = self._profiled(method, self._method(method))
+                        if self.cache:
+                            result = self.cache.call(func, method,
+                                                     params or {})
+                        elif params is None:
+                            result = func()
                         else:
-                            result = getattr(self.plugin, method)(
-                                **msg['params'])
+                            result = func(**msg['params'])
                     else:
                         raise LsmError(ErrorNumber.NO_SUPPORT,
                                        "Unsupported operation")
 
-                    self.tp.send_resp(result)
+                    batch = msg.get('batch')
+                    if batch and isinstance(result, (list, tuple,
+                                                     types.GeneratorType)):
+                        self._send_batches(result, msg_id, int(batch))
+                    else:
+                        if isinstance(result, types.GeneratorType):
+                            result = list(result)
+                        self.tp.send_resp(result, msg_id)
+                    failed = False
 
                     if method == 'plugin_register':
                         need_shutdown = True
@@ -131,6 +750,12 @@ def run(self):
                 except LsmError as lsm_err:
                     self.tp.send_error(msg_id, lsm_err.code, lsm_err.msg,
                                        lsm_err.data)
+                finally:
+                    if method is not None and start is not None:
+                        self.stats.record(method, failed,
+                                          time.time() - start[0],
+                                          _cpu_time() - start[1], start[2],
+                                          self.tp.counters())
         except _SocketEOF:
             #Client went away and didn't meet our expectations for protocol,
             #this error message should not be seen as it shouldn't be occuring.
@@ -150,4 +775,4 @@ def run(self):
             if need_shutdown:
                 #Client wasn't nice, we will allow plug-in to cleanup
                 self.plugin.plugin_unregister()
-                sys.exit(2)
+        return need_shutdown
@@ -19,6 +19,7 @@
 import socket
 import string
 import os
+import time
 from _common import SocketEOF as _SocketEOF
 from _common import LsmError, ErrorNumber
 from _data import DataDecoder as _DataDecoder, DataEncoder as _DataEncoder
@@ -36,12 +37,32 @@ class TransPort(object):
     valid json.
 
     Notes:
-    id field (json-rpc) is present but currently not being used.
-    This is available to be expanded on later.
+    Every request is tagged with a monotonically increasing id (json-rpc) and
+    the peer echoes it back in the reply.  This allows more than one request
+    to be in flight at a time (see rpc_pipeline), replies are matched back to
+    their request by id regardless of the order they arrive in.  Replies
+    carrying an id we are not waiting on (e.g. older peers which always
+    reply with a fixed id) are handed to the oldest outstanding request.
+
+    A request may carry a 'batch' member asking for a list result to be
+    returned in chunks of at most that many items.  Every chunk but the last
+    is marked with 'more': true, peers which do not understand 'batch' simply
+    reply with the whole list in one message (see rpc_iter).
     """
 
     HDR_LEN = 10
 
+    # Ids are limited to an unsigned 32 bit value for C peers
+    MAX_ID = 0xFFFFFFFF
+
+    # Maximum number of pipelined requests written before we start reading
+    # replies, so neither end blocks on a full socket buffer.
+    PIPELINE_WINDOW = 32
+
+    # Messages smaller than this get the header prepended in one buffer,
+    # larger ones are written without copying the payload.
+    COALESCE_LIMIT = 64 * 1024
+
     def _read_all(self, l):
         """
         Reads l number of bytes before returning.  Will raise a SocketEOF
@@ -51,14 +72,35 @@ def _read_all(self, l):
         if l < 1:
             raise ValueError("Trying to read less than 1 byte!")
 
-        data = ""
-        while len(data) < l:
-            r = self.s.recv(l - len(data))
+        data = bytearray(l)
+        view = memoryview(data)
+        received = 0
+        while received < l:
+            r = self.s.recv_into(view[received:], l - received)
             if not r:
                 raise _SocketEOF()
-            data += r
+            received += r
 
-        return data
+        return str(data)
+
+    def _send_all(self, buffers):
+        """
+        Writes out the list of buffers in order, using a single gather write
+        when the socket supports it.
+        """
+        if not hasattr(self.s, 'sendmsg'):
+            for b in buffers:
+                self.s.sendall(b)
+            return
+
+        views = [memoryview(b) for b in buffers]
+        while views:
+            sent = self.s.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
 
     def _send_msg(self, msg):
         """
@@ -70,9 +112,14 @@ def _send_msg(self, msg):
             raise ValueError("Msg argument empty")
 
         #Note: Don't catch io exceptions at this level!
-        s = string.zfill(len(msg), self.HDR_LEN) + msg
+        start = time.time()
+        hdr = string.zfill(len(msg), self.HDR_LEN)
         #common.Info("SEND: ", msg)
-        self.s.sendall(s)
+        if len(msg) < TransPort.COALESCE_LIMIT:
+            self.s.sendall(hdr + msg)
+        else:
+            self._send_all([hdr, msg])
+        self._account('send', self.HDR_LEN + len(msg), time.time() - start)
 
     def _recv_msg(self):
         """
@@ -81,16 +128,84 @@ def _recv_msg(self):
         """
         try:
             l = self._read_all(self.HDR_LEN)
+            start = time.time()
             msg = self._read_all(int(l))
             #common.Info("RECV: ", msg)
         except socket.error as e:
             raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
                            "Error while reading a message from the plug-in",
                            str(e))
+        self._account('recv', self.HDR_LEN + len(msg), time.time() - start)
+        return msg
+
+    def _account(self, direction, num_bytes, duration):
+        """
+        Updates the message counters for direction 'send' or 'recv'.
+        """
+        c = self._counters[direction]
+        c['msgs'] += 1
+        c['bytes'] += num_bytes
+        c['time'] += duration
+        c['last_bytes'] = num_bytes
+        c['last_time'] = duration
+        c['max_bytes'] = max(c['max_bytes'], num_bytes)
+
+    def _encode(self, msg):
+        """
+        Serializes msg to json, accounting the time spent on 'send'.
+        """
+        start = time.time()
+        data = json.dumps(msg, cls=_DataEncoder)
+        c = self._counters['send']
+        c['last_json_time'] = time.time() - start
+        c['json_time'] += c['last_json_time']
+        return data
+
+    def _decode(self, data):
+        """
+        Parses the json message data, accounting the time spent on 'recv'.
+        """
+        start = time.time()
+        msg = json.loads(data, cls=_DataDecoder)
+        c = self._counters['recv']
+        c['last_json_time'] = time.time() - start
+        c['json_time'] += c['last_json_time']
         return msg
 
+    def counters(self):
+        """
+        Returns a dict keyed by 'send' and 'recv', each holding the number of
+        messages, total bytes and seconds spent (time for a received message
+        is measured from the arrival of its header), the size and time of the
+        last message and the largest message seen.  'json_time' and
+        'last_json_time' are the seconds spent encoding (send) or decoding
+        (recv) json.
+        """
+        return dict((k, dict(v)) for k, v in self._counters.items())
+
+    def counters_reset(self):
+        """
+        Zeros the message counters.
+        """
+        self._counters = dict(
+            (k, dict(msgs=0, bytes=0, time=0.0, last_bytes=0, last_time=0.0,
+                     max_bytes=0, json_time=0.0, last_json_time=0.0))
+            for k in ('send', 'recv'))
+
     def __init__(self, socket_descriptor):
         self.s = socket_descriptor
+        self._last_id = 0
+        self._outstanding = []
+        self._replies = {}
+        self._abandoned = set()
+        self.counters_reset()
+
+    def _next_id(self):
+        """
+        Returns the id to use for the next request, wrapping back to 1.
+        """
+        self._last_id = self._last_id % TransPort.MAX_ID + 1
+        return self._last_id
 
     @staticmethod
     def get_socket(path):
@@ -122,20 +237,26 @@ def close(self):
         """
         self.s.close()
 
-    def send_req(self, method, args):
+    def send_req(self, method, args, batch=None):
         """
-        Sends a request given a method and arguments.
+        Sends a request given a method and arguments, returns the id the
+        request was tagged with.  When batch is set, the reply is requested
+        in chunks of at most batch items.
         Note: arguments must be in the form that can be automatically
         serialized to json
         """
+        msg_id = self._next_id()
         try:
-            msg = {'method': method, 'id': 100, 'params': args}
-            data = json.dumps(msg, cls=_DataEncoder)
-            self._send_msg(data)
+            msg = {'method': method, 'id': msg_id, 'params': args}
+            if batch:
+                msg['batch'] = batch
+            self._send_msg(self._encode(msg))
         except socket.error as se:
             raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
                            "Error while sending a message to the plug-in",
                            str(se))
+        self._outstanding.append(msg_id)
+        return msg_id
 
     def read_req(self):
         """
@@ -144,16 +265,113 @@ def read_req(self):
         data = self._recv_msg()
         if len(data):
             #common.Info(str(data))
-            return json.loads(data, cls=_DataDecoder)
+            return self._decode(data)
+
+    def _read_reply(self):
+        """
+        Reads the next reply off the wire and files it under the request id
+        it belongs to.
+        """
+        resp = self._decode(self._recv_msg())
+        msg_id = resp.get('id')
+
+        if msg_id not in self._outstanding:
+            if not self._outstanding:
+                raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
+                               "Received a reply with no request outstanding",
+                               str(msg_id))
+            msg_id = self._outstanding[0]
+
+        more = resp.get('more', False) and 'result' in resp
+        if not more:
+            self._outstanding.remove(msg_id)
+
+        if msg_id in self._abandoned:
+            if not more:
+                self._abandoned.remove(msg_id)
+        else:
+            self._replies.setdefault(msg_id, []).append(resp)
+
+    def _wait_msg(self, msg_id):
+        """
+        Returns the next reply message received for the request msg_id.
+        """
+        while not self._replies.get(msg_id):
+            self._read_reply()
+
+        resp = self._replies[msg_id].pop(0)
+        if not self._replies[msg_id]:
+            del self._replies[msg_id]
+        return resp
+
+    def wait_resp(self, msg_id):
+        """
+        Waits for the reply to the request with the supplied id, replies for
+        other requests which arrive in the mean time are kept until asked for.
+        """
+        resp = self._wait_msg(msg_id)
+        if 'result' in resp:
+            return resp['result']
+        else:
+            e = resp['error']
+            raise LsmError(**e)
 
     def rpc(self, method, args):
         """
         Sends a request and waits for a response.
         """
-        self.send_req(method, args)
-        (reply, msg_id) = self.read_resp()
-        assert msg_id == 100
-        return reply
+        return self.wait_resp(self.send_req(method, args))
+
+    def rpc_iter(self, method, args, batch):
+        """
+        Sends a request for a list result and yields the items as each chunk
+        of at most batch items arrives.  If the iteration is stopped early,
+        the remaining chunks are discarded as they arrive.
+        """
+        msg_id = self.send_req(method, args, batch)
+        more = True
+        try:
+            while more:
+                resp = self._wait_msg(msg_id)
+                if 'error' in resp:
+                    more = False
+                    raise LsmError(**resp['error'])
+
+                more = resp.get('more', False)
+                for item in resp['result']:
+                    yield item
+        finally:
+            if more:
+                self._abandoned.add(msg_id)
+                self._replies.pop(msg_id, None)
+
+    def rpc_pipeline(self, requests):
+        """
+        Sends a list of (method, args) requests without waiting for each
+        reply before sending the next one.  Returns a list of results in the
+        same order as the requests.  If any request failed, all the replies are
+        still consumed and the first error is raised.
+        """
+        msg_ids = []
+        first_error = None
+
+        for (method, args) in requests:
+            if len(self._outstanding) >= TransPort.PIPELINE_WINDOW:
+                self._read_reply()
+            msg_ids.append(self.send_req(method, args))
+
+        rc = []
+        for msg_id in msg_ids:
+            try:
+                rc.append(self.wait_resp(msg_id))
+            except LsmError as le:
+                rc.append(None)
+                if first_error is None:
+                    first_error = le
+
+        if first_error is not None:
+            raise first_error
+        return rc
 
     def send_error(self, msg_id, error_code, msg, data=None):
         """
@@ -161,18 +379,26 @@ def send_error(self, msg_id, error_code, msg, data=None):
         """
         e = {'id': msg_id, 'error': {'code': error_code, 'message': msg,
                                      'data': data}}
-        self._send_msg(json.dumps(e, cls=_DataEncoder))
+        self._send_msg(self._encode(e))
 
-    def send_resp(self, result, msg_id=100):
+    def send_resp(self, result, msg_id=100, more=False):
         """
-        Used to transmit a response
+        Used to transmit a response, set more when result is one chunk of a
+        batched reply and further chunks follow.
         """
         r = {'id': msg_id, 'result': result}
-        self._send_msg(json.dumps(r, cls=_DataEncoder))
+        if more:
+            r['more'] = True
+        self._send_msg(self._encode(r))
 
     def read_resp(self):
-        data = self._recv_msg()
-        resp = json.loads(data, cls=_DataDecoder)
+        """
+        Reads the next reply, returns a tuple (result, id).
+        """
+        resp = self._decode(self._recv_msg())
+
+        if resp.get('id') in self._outstanding:
+            self._outstanding.remove(resp['id'])
 
         if 'result' in resp:
             return resp['result'], resp['id']
@@ -197,10 +423,18 @@ def _server(s):
                     msg['id'],
                     msg['params']['errorcode'],
                     msg['params']['errormsg'])
+            elif 'batch' in msg:
+                items = msg['params']
+                b = msg['batch']
+                for i in range(0, len(items), b):
+                    srv.send_resp(items[i:i + b], msg['id'],
+                                  more=(i + b < len(items)))
+                if not items:
+                    srv.send_resp([], msg['id'])
             else:
-                srv.send_resp(msg['params'])
+                srv.send_resp(msg['params'], msg['id'])
             msg = srv.read_req()
-        srv.send_resp(msg['params'])
+        srv.send_resp(msg['params'], msg['id'])
     finally:
         s.close()
 
@@ -219,11 +453,33 @@ def test_simple(self):
         tc = ['0', ' ', '   ', '{}:""', "Some text message", 'DEADBEEF']
 
         for t in tc:
-            self.client.send_req('test', t)
+            sent_id = self.client.send_req('test', t)
             reply, msg_id = self.client.read_resp()
-            self.assertTrue(msg_id == 100)
+            self.assertTrue(msg_id == sent_id)
             self.assertTrue(reply == t)
 
+    def test_rpc_ids(self):
+        first = self.client.send_req('test', 'a')
+        second = self.client.send_req('test', 'b')
+        self.assertTrue(second == first + 1)
+
+        # Replies are matched to requests even when asked for out of order
+        self.assertTrue(self.client.wait_resp(second) == 'b')
+        self.assertTrue(self.client.wait_resp(first) == 'a')
+
+    def test_pipeline(self):
+        tc = [('test', str(i)) for i in range(200)]
+        reply = self.client.rpc_pipeline(tc)
+        self.assertTrue(reply == [t[1] for t in tc])
+
+        tc = [('test', 'a'),
+              ('error', {'errorcode': 100, 'errormsg': 'pipeline error'}),
+              ('test', 'b')]
+        self.assertRaises(LsmError, self.client.rpc_pipeline, tc)
+
+        # Every reply was consumed, the connection is still usable
+        self.assertTrue(self.client.rpc('test', 'c') == 'c')
+
     def test_exceptions(self):
 
         e_msg = 'Test error message'
@@ -260,6 +516,30 @@ def test_slow(self):
             reply, msg_id = self.client.read_resp()
             self.assertTrue(payload == reply)
 
+    def test_iter(self):
+        items = [str(i) for i in range(1000)]
+        self.assertTrue(list(self.client.rpc_iter('test', items, 64)) == items)
+        self.assertTrue(list(self.client.rpc_iter('test', [], 64)) == [])
+
+        # Stop early, the rest of the chunks must not confuse later calls
+        it = self.client.rpc_iter('test', items, 10)
+        self.assertTrue(next(it) == '0')
+        it.close()
+        self.assertTrue(self.client.rpc('test', 'after') == 'after')
+
+    def test_large(self):
+        # Crosses the size where header and payload are written separately
+        payload = "x" * (TransPort.COALESCE_LIMIT * 4)
+        self.client.counters_reset()
+        self.assertTrue(self.client.rpc('test', payload) == payload)
+
+        c = self.client.counters()
+        self.assertTrue(c['send']['msgs'] == 1 and c['recv']['msgs'] == 1)
+        self.assertTrue(c['send']['bytes'] > len(payload))
+        self.assertTrue(c['recv']['last_bytes'] > len(payload))
+        self.assertTrue(c['send']['json_time'] > 0 and
+                        c['recv']['json_time'] > 0)
+
     def tearDown(self):
         self.client.send_req("done", None)
         resp, msg_id = self.client.read_resp()
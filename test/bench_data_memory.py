@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Memory per object and _to_dict() throughput of the __slots__ based lsm data
+classes compared with the same classes holding their attributes in a
+per-instance __dict__, which is how they used to be laid out.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+import lsm
+from lsm._data import IData
+
+
+def dict_layout(cls):
+    """
+    Returns a class with the same constructor as cls, but no __slots__.
+    """
+    return type('Dict' + cls.__name__, (object,),
+                {'__init__': cls.__init__.im_func})
+
+
+def old_to_dict(obj):
+    """
+    Reference implementation of the previous IData._to_dict()
+    """
+    rc = {'class': obj.__class__.__name__}
+    for (k, v) in obj.__dict__.items():
+        if isinstance(v, IData):
+            rc[k[1:]] = v._to_dict()
+        else:
+            rc[k[1:]] = v
+    return rc
+
+
+def make_volume(cls, i):
+    return cls('VOL_ID_%08d' % i, 'volume_%d' % i, '60%030x' % i, 512,
+               2097152, lsm.Volume.ADMIN_STATE_ENABLED, 'sim-01',
+               'POOL_ID_00001')
+
+
+def make_disk(cls, i):
+    return cls('DISK_ID_%08d' % i, 'disk_%d' % i, lsm.Disk.TYPE_SAS, 512,
+               3907029168, lsm.Disk.STATUS_OK, 'sim-01')
+
+
+def object_size(obj):
+    """
+    Size of the object itself plus its __dict__ if it has one, the
+    attribute values are shared by both layouts and not counted.
+    """
+    rc = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        rc += sys.getsizeof(obj.__dict__)
+    return rc
+
+
+def rss_growth_kib(make, cls, count):
+    """
+    Max RSS growth in KiB of a child process holding count objects.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        objs = [make(cls, i) for i in xrange(count)]
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(w, str(after - before))
+        del objs
+        os._exit(0)
+    os.close(w)
+    rc = int(os.read(r, 64))
+    os.close(r)
+    os.waitpid(pid, 0)
+    return rc
+
+
+def to_dict_rate(func, objs):
+    start = time.time()
+    for o in objs:
+        func(o)
+    return len(objs) / (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=200000,
+                        help='Number of objects held in memory')
+    args = parser.parse_args()
+
+    print "%-8s %10s %10s %12s %12s %12s %12s" % (
+        'type', 'dict B/obj', 'slot B/obj', 'dict RSS KiB', 'slot RSS KiB',
+        'old dict/s', 'new dict/s')
+
+    for (cls, make) in [(lsm.Volume, make_volume), (lsm.Disk, make_disk)]:
+        old_cls = dict_layout(cls)
+        old_objs = [make(old_cls, i) for i in xrange(10000)]
+        new_objs = [make(cls, i) for i in xrange(10000)]
+
+        print "%-8s %10d %10d %12d %12d %12.0f %12.0f" % (
+            cls.__name__, object_size(old_objs[0]), object_size(new_objs[0]),
+            rss_growth_kib(make, old_cls, args.count),
+            rss_growth_kib(make, cls, args.count),
+            to_dict_rate(old_to_dict, old_objs),
+            to_dict_rate(lambda o: o._to_dict(), new_objs))
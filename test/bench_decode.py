@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Micro-benchmark of the wire decoder: decodes synthetic Volume and Disk
+replies with the two pass decoder lsm used to have (json.loads followed by
+a recursive walk) and with lsm._data.DataDecoder.
+"""
+
+import argparse
+import json
+import time
+
+import lsm
+from lsm._common import get_class
+from lsm._data import DataEncoder, DataDecoder
+
+
+def _old_factory(d):
+    class_name = d['class']
+    del d['class']
+    c = get_class('lsm._data.' + class_name)
+    for k, v in d.items():
+        if isinstance(v, dict) and 'class' in v:
+            d['_' + k] = _old_factory(d.pop(k))
+        else:
+            d['_' + k] = d.pop(k)
+    return c(**d)
+
+
+def _old_decode(e):
+    if type(e) is dict:
+        if 'class' in e:
+            return _old_factory(e)
+        return dict((k, _old_decode(v)) for (k, v) in e.iteritems())
+    elif type(e) is list:
+        return [_old_decode(v) for v in e]
+    return e
+
+
+def old_decoder(data):
+    """
+    Reference implementation of the previous DataDecoder.decode()
+    """
+    return _old_decode(json.loads(data))
+
+
+def new_decoder(data):
+    return json.loads(data, cls=DataDecoder)
+
+
+def reply(count, kind):
+    if kind == 'volume':
+        items = [lsm.Volume('VOL_ID_%08d' % i, 'volume_%d' % i,
+                            '60%030x' % i, 512, 2097152,
+                            lsm.Volume.ADMIN_STATE_ENABLED, 'sim-01',
+                            'POOL_ID_00001')
+                 for i in range(count)]
+    else:
+        items = [lsm.Disk('DISK_ID_%08d' % i, 'disk_%d' % i,
+                          lsm.Disk.TYPE_SAS, 512, 3907029168,
+                          lsm.Disk.STATUS_OK, 'sim-01')
+                 for i in range(count)]
+    return json.dumps({'id': 1, 'result': items}, cls=DataEncoder)
+
+
+def best_of(func, data, rounds):
+    rc = None
+    for _ in range(rounds):
+        start = time.time()
+        func(data)
+        t = time.time() - start
+        if rc is None or t < rc:
+            rc = t
+    return rc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, action='append',
+                        help='Objects per reply (may repeat)')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    print "%-8s %8s %12s %12s %12s %8s" % (
+        'type', 'objects', 'bytes', 'old obj/s', 'new obj/s', 'speedup')
+
+    for kind in ['volume', 'disk']:
+        for count in args.count or [1000, 10000, 50000]:
+            data = reply(count, kind)
+            old = best_of(old_decoder, data, args.rounds)
+            new = best_of(new_decoder, data, args.rounds)
+            print "%-8s %8d %12d %12.0f %12.0f %7.2fx" % (
+                kind, count, len(data), count / old, count / new, old / new)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Bulk provisioning throughput of the simulator: creates, masks and deletes
+--count volumes one call per volume and then with the batched calls in
+chunks of each --batch size, and prints the volumes per second of each step.
+Every call or batch is one transaction on the state file.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugin', 'sim'))
+
+from simarray import SimArray
+
+VOL_SIZE = 1024 * 1024
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def timed(func, count):
+    start = time.time()
+    func()
+    return count / (time.time() - start)
+
+
+def run(sim, ag_id, vol_ids, count, create, mask, delete):
+    rc = [timed(create, count), timed(mask, count)]
+    # Not timed, there is no batched unmask
+    for vol_id in vol_ids:
+        sim.volume_unmask(ag_id, vol_id)
+    return rc + [timed(delete, count)]
+
+
+def run_single(sim, pool_id, ag_id, names):
+    vol_ids = []
+
+    def create():
+        for name in names:
+            sim.volume_create(pool_id, name, VOL_SIZE, 0)
+        vol_ids.extend(v.id for v in sim.volumes() if v.name in names)
+
+    def mask():
+        for vol_id in vol_ids:
+            sim.volume_mask(ag_id, vol_id)
+
+    def delete():
+        for vol_id in vol_ids:
+            sim.volume_delete(vol_id)
+
+    return run(sim, ag_id, vol_ids, len(names), create, mask, delete)
+
+
+def run_batch(sim, pool_id, ag_id, names, batch):
+    vol_ids = []
+
+    def create():
+        for chunk in chunks(names, batch):
+            sim.volume_create_many(pool_id, chunk, VOL_SIZE, 0)
+        vol_ids.extend(v.id for v in sim.volumes() if v.name in names)
+
+    def mask():
+        for chunk in chunks(vol_ids, batch):
+            sim.volume_mask_many(ag_id, chunk)
+
+    def delete():
+        for chunk in chunks(vol_ids, batch):
+            sim.volume_delete_many(chunk)
+
+    return run(sim, ag_id, vol_ids, len(names), create, mask, delete)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--batch', type=int, action='append',
+                        help='Volumes per batched call (may repeat)')
+    args = parser.parse_args()
+
+    (fd, statefile) = tempfile.mkstemp(prefix='lsm_sim_bench_')
+    os.close(fd)
+    os.unlink(statefile)
+
+    print "%8s %12s %12s %12s" % ('batch', 'create/s', 'mask/s', 'delete/s')
+
+    try:
+        sim = SimArray(statefile, 30000)
+        pool_id = sorted(sim.pools(), key=lambda p: p.free_space)[-1].id
+        ag_id = sim.access_group_create(
+            'bench_ag', 'iqn.1994-05.com.domain:01.bench',
+            2, sim.systems()[0].id).id
+        names = ['bench_%d' % i for i in range(args.count)]
+
+        print "%8s %12.0f %12.0f %12.0f" % tuple(
+            ['single'] + run_single(sim, pool_id, ag_id, names))
+        for batch in args.batch or [10, 100, 500]:
+            print "%8d %12.0f %12.0f %12.0f" % tuple(
+                [batch] + run_batch(sim, pool_id, ag_id, names, batch))
+    finally:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(statefile + suffix):
+                os.unlink(statefile + suffix)
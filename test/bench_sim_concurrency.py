@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Multi-process stress of the simulator state file: forks a number of workers
+sharing one state file, each looping over the listing calls for a fixed time
+while every --write-every call creates and deletes a volume, and prints the
+total throughput and lock timeouts for each worker count and journal mode.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugin', 'sim'))
+
+from lsm import LsmError, ErrorNumber
+from simarray import SimArray, BackStore
+
+
+def worker(statefile, duration, write_every, wid):
+    """
+    Returns (calls, timeouts) done by one worker.
+    """
+    sim = SimArray(statefile, 30000)
+    listings = [sim.systems, sim.pools, sim.volumes, sim.disks, sim.ags,
+                sim.fs, sim.exports, sim.target_ports]
+    pool_id = sim.pools()[-1].id
+    calls = 0
+    timeouts = 0
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            if write_every and calls % write_every == write_every - 1:
+                sim_vol_id = sim.volume_create(
+                    pool_id, 'bench_%d_%d' % (wid, calls), 1024 * 1024, 0,
+                    _internal_use=True)
+                sim.bs_obj.trans_begin()
+                sim.bs_obj.sim_vol_delete(sim_vol_id)
+                sim.bs_obj.trans_commit()
+            else:
+                listings[calls % len(listings)]()
+        except LsmError as le:
+            if le.code != ErrorNumber.TIMEOUT:
+                raise
+            timeouts += 1
+        calls += 1
+    return (calls, timeouts)
+
+
+def run(statefile, workers, duration, write_every):
+    pipes = []
+    for wid in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, "%d %d" % worker(statefile, duration, write_every,
+                                         wid))
+            os._exit(0)
+        os.close(w)
+        pipes.append((pid, r))
+
+    calls = 0
+    timeouts = 0
+    for (pid, r) in pipes:
+        data = os.read(r, 64)
+        os.close(r)
+        os.waitpid(pid, 0)
+        if data:
+            (c, t) = data.split()
+            calls += int(c)
+            timeouts += int(t)
+    return (calls, timeouts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, action='append',
+                        help='Worker processes (may repeat)')
+    parser.add_argument('--journal', action='append',
+                        help='sqlite journal mode, WAL or DELETE (may '
+                             'repeat)')
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--write-every', type=int, default=20,
+                        help='Make every Nth call of a worker a write, 0 '
+                             'for no writes')
+    args = parser.parse_args()
+
+    print "%-8s %8s %10s %10s %10s" % (
+        'journal', 'workers', 'calls', 'calls/s', 'timeouts')
+
+    for journal in args.journal or ['DELETE', 'WAL']:
+        BackStore.JOURNAL_MODE = journal
+        (fd, statefile) = tempfile.mkstemp(prefix='lsm_sim_bench_')
+        os.close(fd)
+        os.unlink(statefile)
+        try:
+            SimArray(statefile, 30000)
+            for workers in args.workers or [1, 2, 4, 8, 16]:
+                (calls, timeouts) = run(statefile, workers, args.duration,
+                                        args.write_every)
+                print "%-8s %8d %10d %10.0f %10d" % (
+                    journal, workers, calls, calls / args.duration, timeouts)
+        finally:
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(statefile + suffix):
+                    os.unlink(statefile + suffix)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Job polling strategies against the simulator job engine: starts a batch of
+volume creations and replications in one pool, with the pool limited to
+--max concurrent jobs and durations proportional to --rate, then waits for
+all of them polling one job at a time or all of them at once, at a fixed or
+exponentially growing interval, and prints the status calls made and how
+late the batch was seen complete.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugin', 'sim'))
+
+from lsm import JobStatus, Volume
+from simarray import SimArray
+
+
+def start_jobs(sim, pool_id, count, size):
+    jobs = []
+    for i in range(count):
+        name = 'bench_%d_%f' % (i, time.time())
+        if i % 2:
+            src_vol = [v for v in sim.volumes() if v.name == 'bench_src'][0]
+            jobs.append(sim.volume_replicate(
+                pool_id, Volume.REPLICATE_CLONE, src_vol.id, name)[0])
+        else:
+            jobs.append(sim.volume_create(pool_id, name, size, 0)[0])
+    return jobs
+
+
+def wait_each(sim, jobs, interval, backoff):
+    calls = 0
+    for job in jobs:
+        delay = interval
+        while True:
+            calls += 1
+            if sim.job_status(job)[0] == JobStatus.COMPLETE:
+                break
+            time.sleep(delay)
+            delay = min(delay * backoff, 1)
+    return calls
+
+
+def wait_bulk(sim, jobs, interval, backoff):
+    calls = 0
+    delay = interval
+    while jobs:
+        calls += 1
+        jobs = [j for (j, s) in zip(jobs, sim.jobs_status(jobs))
+                if s[0] != JobStatus.COMPLETE]
+        if jobs:
+            time.sleep(delay)
+            delay = min(delay * backoff, 1)
+    return calls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=16)
+    parser.add_argument('--max', type=int, default=4,
+                        help='Concurrent jobs per pool')
+    parser.add_argument('--time', type=float, default=0.2,
+                        help='Base job duration in seconds')
+    parser.add_argument('--rate', type=float, default=1024 ** 3,
+                        help='Bytes per second of sized jobs')
+    parser.add_argument('--size', type=int, default=256 * 1024 ** 2,
+                        help='Volume size in bytes')
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='First polling interval in seconds')
+    args = parser.parse_args()
+
+    os.environ['LSM_SIM_TIME'] = str(args.time)
+    os.environ['LSM_SIM_JOB_MAX'] = str(args.max)
+    os.environ['LSM_SIM_JOB_RATE'] = str(args.rate)
+
+    (fd, statefile) = tempfile.mkstemp(prefix='lsm_sim_bench_')
+    os.close(fd)
+    os.unlink(statefile)
+
+    print "%-6s %8s %8s %12s %12s" % (
+        'poll', 'backoff', 'calls', 'elapsed s', 'late s')
+
+    try:
+        sim = SimArray(statefile, 30000)
+        pool_id = sorted(sim.pools(), key=lambda p: p.free_space)[-1].id
+        sim.volume_create(pool_id, 'bench_src', args.size, 0)
+        for (name, func) in [('each', wait_each), ('bulk', wait_bulk)]:
+            for backoff in [1, 2]:
+                start = time.time()
+                jobs = start_jobs(sim, pool_id, args.jobs, args.size)
+                # The last job of the pool queue finishes last
+                done = sim.bs_obj._sql_exec(
+                    "SELECT MAX(timestamp + duration) FROM jobs;")[0][0]
+                calls = func(sim, jobs, args.interval, backoff)
+                end = time.time()
+                print "%-6s %8d %8d %12.3f %12.3f" % (
+                    name, backoff, calls, end - start, end - done)
+                for vol in sim.volumes():
+                    if vol.name.startswith('bench_') and \
+                       vol.name != 'bench_src':
+                        sim.bs_obj.trans_begin()
+                        sim.bs_obj.sim_vol_delete(
+                            SimArray._sim_vol_id_of(vol.id))
+                        sim.bs_obj.trans_commit()
+    finally:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(statefile + suffix):
+                os.unlink(statefile + suffix)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Latency of repeated simulator listings: for each volume count, times
+volumes() and pools() converting every row (object cache dropped before each
+call), returning the cached objects of an unchanged state and after one
+volume changed, where only the objects of changed rows are rebuilt.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugin', 'sim'))
+
+from simarray import SimArray
+
+VOL_SIZE = 1024 * 1024
+
+
+def best_of(func, rounds, before=None):
+    rc = None
+    for _ in range(rounds):
+        if before:
+            before()
+        start = time.time()
+        func()
+        t = time.time() - start
+        if rc is None or t < rc:
+            rc = t
+    return rc * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, action='append',
+                        help='Volumes in the pool (may repeat)')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    (fd, statefile) = tempfile.mkstemp(prefix='lsm_sim_bench_')
+    os.close(fd)
+    os.unlink(statefile)
+
+    print "%8s %-8s %12s %12s %12s" % (
+        'volumes', 'call', 'convert ms', 'cached ms', 'changed ms')
+
+    try:
+        sim = SimArray(statefile, 30000)
+        pool_id = sorted(sim.pools(), key=lambda p: p.free_space)[-1].id
+        created = 0
+        for count in sorted(args.count or [100, 1000, 10000]):
+            sim.volume_create_many(
+                pool_id, ['bench_%d' % i for i in range(created, count)],
+                VOL_SIZE, 0)
+            created = count
+            vol_id = sim.volumes()[-1].id
+            state = [False]
+
+            def change():
+                # Flip one volume between enabled and disabled
+                state[0] = not state[0]
+                if state[0]:
+                    sim.volume_disable(vol_id)
+                else:
+                    sim.volume_enable(vol_id)
+
+            for (name, func) in [('volumes', sim.volumes),
+                                 ('pools', sim.pools)]:
+                func()
+                print "%8d %-8s %12.3f %12.3f %12.3f" % (
+                    count, name,
+                    best_of(func, args.rounds, sim._lsm_obj_cache.clear),
+                    best_of(func, args.rounds),
+                    best_of(func, args.rounds, change))
+    finally:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(statefile + suffix):
+                os.unlink(statefile + suffix)
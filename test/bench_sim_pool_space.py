@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Scaling of the simulator pool space accounting: grows the number of volumes
+in one pool and, at each step, times volume creation and pool listing on the
+pool_space ledger and the pool free space lookup through the aggregating
+pools_view the simulator used to have.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugin', 'sim'))
+
+from simarray import BackStore
+
+OLD_POOLS_VIEW = """
+    CREATE TEMP VIEW old_pools_view AS
+        SELECT
+            pool.id,
+                ifnull(pool.total_space,
+                    ifnull(SUM(disk.total_space), 0)) -
+                ifnull(SUM(volume.consumed_size), 0) -
+                ifnull(SUM(fs.consumed_size), 0) -
+                ifnull(SUM(pool2.total_space), 0)
+            free_space
+        FROM
+            pools pool
+                LEFT JOIN disks disk
+                    ON pool.id = disk.owner_pool_id AND
+                       disk.role = 'DATA'
+                LEFT JOIN volumes volume
+                    ON volume.pool_id = pool.id
+                LEFT JOIN fss fs
+                    ON fs.pool_id = pool.id
+                LEFT JOIN pools pool2
+                    ON pool2.parent_pool_id = pool.id
+        GROUP BY
+            pool.id
+"""
+
+VOL_SIZE = 1024 * 1024
+
+
+def best_of(func, rounds):
+    rc = None
+    for _ in range(rounds):
+        start = time.time()
+        func()
+        t = time.time() - start
+        if rc is None or t < rc:
+            rc = t
+    return rc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, action='append',
+                        help='Volumes in the pool (may repeat)')
+    parser.add_argument('--pool', type=int, default=1,
+                        help='Simulator pool id to fill')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--sample', type=int, default=100,
+                        help='Volume creations timed at each step')
+    args = parser.parse_args()
+
+    (fd, statefile) = tempfile.mkstemp(prefix='lsm_sim_bench_')
+    os.close(fd)
+    os.unlink(statefile)
+
+    try:
+        bs = BackStore(statefile, 30000)
+        bs.check_version_and_init()
+        bs.sql_conn.execute(OLD_POOLS_VIEW)
+
+        print "%8s %14s %14s %14s" % (
+            'volumes', 'create ms/vol', 'pools() ms', 'old free ms')
+
+        created = 0
+        for count in sorted(args.count or [1000, 10000, 100000]):
+            bs.trans_begin()
+            while created < count - args.sample:
+                bs.sim_vol_create('bench_%d' % created, VOL_SIZE, args.pool,
+                                  0)
+                created += 1
+            bs.trans_commit()
+
+            bs.trans_begin()
+            start = time.time()
+            sample = count - created
+            while created < count:
+                bs.sim_vol_create('bench_%d' % created, VOL_SIZE, args.pool,
+                                  0)
+                created += 1
+            create = (time.time() - start) / max(sample, 1)
+            bs.trans_commit()
+
+            print "%8d %14.3f %14.3f %14.3f" % (
+                count, create * 1000,
+                best_of(bs.sim_pools, args.rounds) * 1000,
+                best_of(lambda: bs._sql_exec(
+                    "SELECT free_space FROM old_pools_view WHERE id=%d" %
+                    args.pool), args.rounds) * 1000)
+    finally:
+        os.unlink(statefile)
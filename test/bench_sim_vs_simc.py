@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+
+# Copyright (C) 2015 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Side by side comparison of the python (sim://) and C (simc://) simulator
+plugins: runs the same workload through lsm.Client against each --uri, the
+listing calls followed by --count volume creations, masks, unmasks and
+deletions, and prints the mean latency and calls per second of each call.
+Job based calls are waited on with job_status(), whose polls are reported
+on their own line.  Needs a running lsmd.
+
+The two plug-ins do not hold the same array: simc has a fixed small data
+set and cannot load the sim:// profiles, so run sim:// without a profile
+and compare listings by the objects column, the number of objects the
+last call returned.
+"""
+
+import argparse
+import time
+
+import lsm
+
+VOL_SIZE = 1024 * 1024
+
+
+class Timings(object):
+    def __init__(self):
+        self.calls = {}
+        self.objects = {}
+
+    def time(self, name, func, *args):
+        start = time.time()
+        rc = func(*args)
+        (count, total) = self.calls.get(name, (0, 0.0))
+        self.calls[name] = (count + 1, total + time.time() - start)
+        return rc
+
+
+def wait(c, timings, job, result):
+    """
+    Returns the result of a call, polling its job to completion if needed.
+    """
+    while job:
+        (status, percent, item) = timings.time('job_status', c.job_status,
+                                               job)
+        if status == lsm.JobStatus.COMPLETE:
+            c.job_free(job)
+            return item
+        if status != lsm.JobStatus.INPROGRESS:
+            raise RuntimeError("Job %s ended with status %d" % (job, status))
+        time.sleep(0.05)
+    return result
+
+
+def run(uri, count, rounds):
+    c = lsm.Client(uri)
+    timings = Timings()
+    try:
+        for _ in range(rounds):
+            for name in ['systems', 'pools', 'volumes', 'disks',
+                         'access_groups']:
+                timings.objects[name] = len(
+                    timings.time(name, getattr(c, name)))
+
+        system = c.systems()[0]
+        pool = sorted(c.pools(), key=lambda p: p.free_space)[-1]
+        ag = c.access_group_create('bench_ag',
+                                   'iqn.1994-05.com.domain:01.bench',
+                                   lsm.AccessGroup.INIT_TYPE_ISCSI_IQN,
+                                   system)
+        try:
+            vols = []
+            for i in range(count):
+                vols.append(wait(c, timings, *timings.time(
+                    'volume_create', c.volume_create, pool, 'bench_%d' % i,
+                    VOL_SIZE, lsm.Volume.PROVISION_DEFAULT)))
+            for vol in vols:
+                timings.time('volume_mask', c.volume_mask, ag, vol)
+            for vol in vols:
+                timings.time('volume_unmask', c.volume_unmask, ag, vol)
+            for vol in vols:
+                wait(c, timings, timings.time('volume_delete',
+                                              c.volume_delete, vol), None)
+        finally:
+            c.access_group_delete(ag)
+    finally:
+        c.close()
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--uri', action='append',
+                        help='Plugin uri (may repeat)')
+    parser.add_argument('--count', type=int, default=100,
+                        help='Volumes created, masked and deleted')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='Repeats of each listing call')
+    args = parser.parse_args()
+
+    print "%-10s %-14s %8s %8s %10s %10s" % (
+        'uri', 'call', 'calls', 'objects', 'mean ms', 'calls/s')
+
+    for uri in args.uri or ['sim://', 'simc://']:
+        timings = run(uri, args.count, args.rounds)
+        for name in sorted(timings.calls):
+            (count, total) = timings.calls[name]
+            print "%-10s %-14s %8d %8s %10.3f %10.0f" % (
+                uri, name, count, timings.objects.get(name, '-'),
+                total / count * 1000, count / total)
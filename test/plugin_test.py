@@ -321,6 +321,160 @@ def test_pools_list(self):
         pools_list = self.c.pools()
         self.assertTrue(len(pools_list) > 0, "We need at least 1 pool to test")
 
+    def test_rpc_pipeline(self):
+        calls = [('systems', {}), ('pools', {}), ('plugin_info', {})]
+        (systems, pools, info) = self.c.rpc_pipeline(calls)
+        self.assertTrue([s.id for s in systems] ==
+                        [s.id for s in self.systems])
+        self.assertTrue([p.id for p in pools] == [p.id for p in self.pools])
+        self.assertTrue(info == list(self.c.plugin_info()))
+
+    def _check_search(self, client):
+        for (method, lsm_class) in [('pools', lsm.Pool),
+                                    ('volumes', lsm.Volume),
+                                    ('disks', lsm.Disk),
+                                    ('access_groups', lsm.AccessGroup),
+                                    ('fs', lsm.FileSystem),
+                                    ('exports', lsm.NfsExport),
+                                    ('target_ports', lsm.TargetPort)]:
+            try:
+                objs = getattr(client, method)()
+            except LsmError as le:
+                if le.code == ErrorNumber.NO_SUPPORT:
+                    continue
+                raise
+
+            for key in lsm_class.SUPPORTED_SEARCH_KEYS:
+                values = set(getattr(o, key) for o in objs[:3])
+                values.add(rs('not_there'))
+                for value in values:
+                    found = getattr(client, method)(search_key=key,
+                                                    search_value=value)
+                    self.assertTrue(
+                        sorted(o.id for o in found) ==
+                        sorted(o.id for o in objs
+                               if getattr(o, key) == value),
+                        "%s search on %s=%s" % (method, key, value))
+
+    def test_search(self):
+        # Searches must find the same objects whether they are evaluated on
+        # the array, by filtering the whole list or from the result cache.
+        self._check_search(self.c)
+
+        tmp_c = lsm.Client(TestPlugin.URI, TestPlugin.PASSWORD, cache_ttl=60)
+        self._check_search(tmp_c)
+        tmp_c.close()
+
+    def test_session_reuse(self):
+        # Whether the session is really kept depends on lsmd running the
+        # plug-in in a worker pool, either way the client must not notice.
+        for i in range(3):
+            tmp_c = lsm.Client(TestPlugin.URI, TestPlugin.PASSWORD,
+                               session_ttl=60)
+            self.assertTrue([s.id for s in tmp_c.systems()] ==
+                            [s.id for s in self.systems])
+            if i == 2:
+                tmp_c.session_invalidate()
+            tmp_c.close()
+
+        # The session key is a digest of the password, which must work for
+        # any password the plug-in accepts
+        tmp_c = lsm.Client(TestPlugin.URI, u'p\xe4ssword', session_ttl=60)
+        self.assertTrue(len(tmp_c.systems()) == len(self.systems))
+        tmp_c.close()
+
+    def test_result_cache(self):
+        orig_c = self.c
+        self.c = TestProxy(lsm.Client(TestPlugin.URI, TestPlugin.PASSWORD,
+                                      cache_ttl=60))
+        try:
+            try:
+                stats = self.c.cache_stats()
+            except LsmError as le:
+                # Only the python plug-ins cache results
+                if le.code == ErrorNumber.NO_SUPPORT:
+                    return
+                raise
+
+            self.assertTrue(stats['ttl'] == 60)
+            self.assertTrue(len(self.c.systems()) == len(self.systems))
+            self.c.systems()
+            stats = self.c.cache_stats()
+            self.assertTrue(stats['hits'] == 1 and stats['misses'] == 1)
+
+            # Volume create and delete check the volume list each time, which
+            # only works if they drop the cached list
+            for s in self.systems:
+                cap = self.c.capabilities(s)
+                if supported(cap, [Cap.VOLUME_CREATE, Cap.VOLUME_DELETE]):
+                    vol = self._volume_create(s.id)[0]
+                    self._volume_delete(vol)
+                    self.assertTrue(
+                        self.c.cache_stats()['invalidations'] > 0)
+                    break
+        finally:
+            self.c.close()
+            self.c = orig_c
+
+    def test_plugin_stats(self):
+        try:
+            stats = self.c.plugin_stats()
+        except LsmError as le:
+            # Only the python plug-ins are instrumented
+            if le.code == ErrorNumber.NO_SUPPORT:
+                return
+            raise
+
+        self.c.systems()
+        calls = stats['methods'].get('systems', {}).get('calls', 0)
+        m = self.c.plugin_stats()['methods']['systems']
+        self.assertTrue(m['calls'] == calls + 1)
+        self.assertTrue(len(m['wall_hist']) == len(stats['buckets']) + 1)
+        self.assertTrue(sum(m['wall_hist']) == m['calls'])
+        self.assertTrue(m['request_bytes'] > 0 and m['response_bytes'] > 0)
+
+    def test_jobs_status(self):
+        for s in self.systems:
+            cap = self.c.capabilities(s)
+            if supported(cap, [Cap.VOLUME_CREATE, Cap.VOLUME_DELETE]):
+                p = self._get_pool_by_usage(s.id,
+                                            lsm.Pool.ELEMENT_TYPE_VOLUME)
+                self.assertTrue(p is not None,
+                                "Unable to find a suitable pool")
+                jobs = []
+                vols = []
+                # Bypass the proxy, it waits for each job
+                for i in range(3):
+                    (job, vol) = self.c.o.volume_create(
+                        p, rs('v'), self._object_size(p),
+                        lsm.Volume.PROVISION_DEFAULT)
+                    if job:
+                        jobs.append(job)
+                    else:
+                        vols.append(vol)
+
+                if jobs:
+                    done = self.c.job_wait_any(jobs)
+                    self.assertTrue(len(done) > 0)
+                    self.assertTrue(set(done.keys()) <= set(jobs))
+
+                    done = self.c.job_wait_all(jobs, max_interval=0.2)
+                    self.assertTrue(sorted(done.keys()) == sorted(jobs))
+
+                    status = self.c.jobs_status(jobs)
+                    self.assertTrue(len(status) == len(jobs))
+                    for (job_state, percent, vol) in status:
+                        self.assertTrue(job_state == lsm.JobStatus.COMPLETE)
+                        self.assertTrue(percent == 100)
+                        vols.append(vol)
+
+                    for job in jobs:
+                        self.c.job_free(job)
+
+                for vol in vols:
+                    self._volume_delete(vol)
+                break
+
     @staticmethod
     def _vpd_correct(vpd):
         if vpd and re.match('^[a-f0-9]{32}$', vpd):
@@ -353,6 +507,15 @@ def test_volume_list(self):
         if flag_created:
             self._volume_delete(volumes[0])
 
+    def test_volume_list_iter(self):
+        (volumes, flag_created) = self._find_or_create_volumes()
+        for batch in [1, 2, 500]:
+            self.assertTrue([v.id for v in self.c.volumes_iter(batch=batch)]
+                            == [v.id for v in volumes])
+
+        if flag_created:
+            self._volume_delete(volumes[0])
+
     def test_volume_vpd83(self):
         (volumes, flag_created) = self._find_or_create_volumes()
         self.assertTrue(len(volumes) > 0, "We need at least 1 volume to test")
@@ -774,6 +937,53 @@ def test_mask_unmask(self):
                     self.c.access_group_delete(ag_created)
                     ag_created = None
 
+    def test_volume_many(self):
+        for s in self.systems:
+            cap = self.c.capabilities(s)
+
+            if supported(cap, [Cap.VOLUME_MASK,
+                               Cap.VOLUME_UNMASK,
+                               Cap.VOLUME_CREATE,
+                               Cap.VOLUME_DELETE,
+                               Cap.ACCESS_GROUP_CREATE_ISCSI_IQN]):
+                p = self._get_pool_by_usage(s.id,
+                                            lsm.Pool.ELEMENT_TYPE_VOLUME)
+                self.assertTrue(p is not None,
+                                "Unable to find a suitable pool")
+
+                # The repeated name fails on its own
+                names = [rs('v') for i in range(3)]
+                rc = self.c.volume_create_many(
+                    p, names + names[:1], self._object_size(p),
+                    lsm.Volume.PROVISION_DEFAULT)
+                self.assertTrue(len(rc) == 4)
+                self.assertTrue(rc[3][0] is None)
+                self.assertTrue(rc[3][1].code == ErrorNumber.NAME_CONFLICT)
+                vols = []
+                for (result, error) in rc[:3]:
+                    self.assertTrue(error is None)
+                    vols.append(self.c.wait_for_it('volume_create_many',
+                                                   *result))
+                self.assertTrue([v.name for v in vols] == names)
+
+                ag = self._create_access_group(
+                    cap, rs('ag'), s, lsm.AccessGroup.INIT_TYPE_ISCSI_IQN)
+                rc = self.c.volume_mask_many(ag, vols + vols[:1])
+                self.assertTrue([e is None for (r, e) in rc] ==
+                                [True, True, True, False])
+                self.assertTrue(rc[3][1].code == ErrorNumber.NO_STATE_CHANGE)
+                for vol in vols:
+                    self._masking_state(cap, ag, vol, True)
+                    self.c.volume_unmask(ag, vol)
+                self._delete_access_group(ag)
+
+                rc = self.c.volume_delete_many(vols)
+                for (result, error) in rc:
+                    self.assertTrue(error is None)
+                    self.c.wait_for_it('volume_delete_many', result, None)
+                for vol in vols:
+                    self.assertFalse(self._volume_exists(vol.id))
+
     def _create_access_group(self, cap, name, s, init_type):
         ag_created = None
 
@@ -19,7 +19,6 @@
 import os
 import sys
 import getpass
-import time
 import tty
 import termios
 
@@ -224,6 +223,11 @@ def _get_item(l, the_id, friendly_name='item', raise_error=True):
         help='Retrieves plugin description and version',
     ),
 
+    dict(
+        name='stats',
+        help='Retrieves per method call statistics of the plugin process',
+    ),
+
     dict(
         name='volume-create',
         help='Creates a volume (logical unit)',
@@ -1105,6 +1109,38 @@ def plugin_info(self, args):
         else:
             out("Description: %s Version: %s" % (desc, version))
 
+    def stats(self, args):
+        stats = self.c.plugin_stats()
+
+        sep = DisplayData.DEFAULT_SPLITTER
+        if self.args.sep is not None:
+            sep = self.args.sep
+
+        buckets = ['<= %ss' % b for b in stats['buckets']] + \
+            ['> %ss' % stats['buckets'][-1]]
+
+        stats_data = []
+        for method in sorted(stats['methods'].keys()):
+            m = stats['methods'][method]
+            d = OrderedDict()
+            d['Method'] = method
+            d['Calls'] = m['calls']
+            d['Errors'] = m['errors']
+            d['Wall Time Total'] = '%.6f' % m['wall_time']
+            d['Wall Time Max'] = '%.6f' % m['wall_max']
+            d['CPU Time Total'] = '%.6f' % m['cpu_time']
+            d['Wall Time Histogram'] = [
+                '%s: %d' % x for x in zip(buckets, m['wall_hist'])]
+            d['CPU Time Histogram'] = [
+                '%s: %d' % x for x in zip(buckets, m['cpu_hist'])]
+            d['Request Bytes'] = m['request_bytes']
+            d['Response Bytes'] = m['response_bytes']
+            d['JSON Decode Time'] = '%.6f' % m['decode_time']
+            d['JSON Encode Time'] = '%.6f' % m['encode_time']
+            stats_data.append(d)
+
+        DisplayData.display_data_script_way(stats_data, sep)
+
     ## Creates a volume
     def volume_create(self, args):
         #Get pool
@@ -1182,19 +1218,16 @@ def _wait_for_it(self, msg, job, item):
                 out(job)
                 self.shutdown(ErrorNumber.JOB_STARTED)
 
-            while True:
-                (s, percent, item) = self.c.job_status(job)
+            #Poll at least every 0.25 seconds, the user is waiting on us
+            (s, percent, item) = self.c.job_wait_all(
+                [job], max_interval=0.25)[job]
 
-                if s == JobStatus.INPROGRESS:
-                    #Add an option to spit out progress?
-                    #print "%s - Percent %s complete" % (job, percent)
-                    time.sleep(0.25)
-                elif s == JobStatus.COMPLETE:
-                    self.c.job_free(job)
-                    return item
-                else:
-                    #Something better to do here?
-                    raise ArgError(msg + " job error code= " + str(s))
+            if s == JobStatus.COMPLETE:
+                self.c.job_free(job)
+                return item
+            else:
+                #Something better to do here?
+                raise ArgError(msg + " job error code= " + str(s))
 
     ## Retrieves the status of the specified job
     def job_status(self, args):